@@ -0,0 +1,220 @@
+'''Checks of the concurrent download stage of p4a (download_recipes, in
+pythonforandroid.build) against a local HTTP server (see
+httpfixture.py), with recipes whose urls point to it.
+
+The checks are:
+
+- concurrent: several recipes are downloaded with up to --download-jobs
+  connections at once, and each gets its ``.mark-<file>`` marker
+  recording the digests of the download. The wall time is compared
+  with downloading them one at a time;
+- interrupted: a recipe whose fetch keeps being dropped fails the
+  stage, leaving its .part file but no download and no marker, while
+  the other recipes complete. The next run resumes the .part file and
+  writes the marker, and the run after that downloads nothing;
+- unmarked: a download without a marker (e.g. left by an older
+  version of p4a that was interrupted) is fetched again, as is one
+  whose marker doesn't match the recipe's md5sum.
+
+Run with::
+
+    python benchmarks/download_recipes.py [--download-jobs 4] [check ...]
+'''
+
+from __future__ import print_function
+
+from os.path import dirname, abspath, join, exists
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, dirname(abspath(__file__)))
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from httpfixture import FixtureServer, make_data  # noqa: E402
+from range_download import CheckFailed, expect, describe, run_checks  # noqa
+from pythonforandroid.build import download_recipes  # noqa: E402
+from pythonforandroid.logger import logger, download_progress  # noqa
+from pythonforandroid.recipe import Recipe  # noqa: E402
+from pythonforandroid.util import RangeDownload  # noqa: E402
+
+RECIPE_SIZE = 512 * 1024
+
+# Set by main
+options = argparse.Namespace(download_jobs=4)
+
+
+class FixtureContext(object):
+    '''The parts of the build context used by the downloads.'''
+
+    def __init__(self, temp_dir, download_jobs):
+        self.packages_path = join(temp_dir, 'packages')
+        self.download_jobs = download_jobs
+        self.download_segments = 1
+
+
+def make_recipes(server, ctx, names, size=RECIPE_SIZE):
+    '''Returns recipes with the given names, served by server.'''
+    recipes = []
+    for index, name in enumerate(names):
+        path = '/{}-1.0.tar.gz'.format(name)
+        data = make_data(size, seed=index * size)
+        server.files[path] = data
+        # The name of a recipe is taken from its module
+        recipe_class = type(str(name), (Recipe, ), {
+            '__module__': 'pythonforandroid.recipes.{}'.format(name),
+            'version': '1.0',
+            'url': server.url('/{}-{{version}}.tar.gz'.format(name)),
+            'md5sum': hashlib.md5(data).hexdigest()})
+        recipe = recipe_class()
+        recipe.ctx = ctx
+        recipe.path = path
+        recipe.data = data
+        recipes.append(recipe)
+    return recipes
+
+
+def get_filename(recipe):
+    return join(recipe.ctx.packages_path, recipe.name,
+                '{}-1.0.tar.gz'.format(recipe.name))
+
+
+def get_marker_filename(recipe):
+    return join(recipe.ctx.packages_path, recipe.name,
+                '.mark-{}-1.0.tar.gz'.format(recipe.name))
+
+
+def check_downloaded(recipe):
+    '''Checks the download and marker of a recipe.'''
+    filename = get_filename(recipe)
+    expect(exists(filename), '{} was not downloaded', recipe.name)
+    with open(filename, 'rb') as fileh:
+        expect(fileh.read() == recipe.data,
+               'the download of {} differs from the served data',
+               recipe.name)
+    marker_filename = get_marker_filename(recipe)
+    expect(exists(marker_filename), '{} has no marker', recipe.name)
+    with open(marker_filename) as fileh:
+        digests = json.load(fileh)
+    expect(digests.get('md5') == recipe.md5sum and
+           digests.get('sha256') ==
+           hashlib.sha256(recipe.data).hexdigest(),
+           'the marker of {} has the wrong digests: {}', recipe.name,
+           digests)
+
+
+def check_concurrent(temp_dir):
+    jobs = options.download_jobs
+    names = ['fixture{}'.format(index) for index in range(2 * jobs)]
+    durations = []
+    for run_jobs in (1, jobs):
+        # Served slowly, as a remote server would, so that the
+        # connections overlap
+        with FixtureServer({}, delay=0.01) as server:
+            ctx = FixtureContext(join(temp_dir, str(run_jobs)), run_jobs)
+            recipes = make_recipes(server, ctx, names)
+            start = time.time()
+            download_recipes(recipes, ctx)
+            durations.append(time.time() - start)
+            for recipe in recipes:
+                check_downloaded(recipe)
+        expect(server.max_active == run_jobs,
+               'expected {} downloads at once, there were up to {}',
+               run_jobs, server.max_active)
+    print('  {} recipes: {:.2f}s one at a time, {:.2f}s with {} jobs'.format(
+        len(names), durations[0], durations[1], jobs))
+
+
+def check_interrupted(temp_dir):
+    ctx = FixtureContext(temp_dir, options.download_jobs)
+    with FixtureServer({}) as server:
+        broken, first, second = make_recipes(
+            server, ctx, ['broken', 'healthy1', 'healthy2'])
+        # Every attempt of the broken download is dropped
+        server.drop(broken.path, 64 * 1024, times=RangeDownload.retries + 1)
+        try:
+            download_recipes([broken, first, second], ctx)
+        except (IOError, OSError) as e:
+            print('  first run failed as expected: {}'.format(e))
+        else:
+            raise CheckFailed('the first run did not fail')
+        part_filename = get_filename(broken) + '.part'
+        expect(exists(part_filename) and
+               not exists(get_filename(broken)) and
+               not exists(get_marker_filename(broken)),
+               'the interrupted download should only leave a .part file')
+        for recipe in (first, second):
+            check_downloaded(recipe)
+
+        del server.requests[:]
+        download_recipes([broken, first, second], ctx)
+        check_downloaded(broken)
+        requests = server.requests
+        expect(len(requests) == 1 and requests[0].path == broken.path and
+               requests[0].status == 206 and requests[0].start > 0,
+               'expected only the interrupted download to be resumed: {}',
+               describe(requests))
+
+        del server.requests[:]
+        download_recipes([broken, first, second], ctx)
+        expect(not server.requests,
+               'expected the marked downloads to be reused: {}',
+               describe(server.requests))
+
+
+def check_unmarked(temp_dir):
+    ctx = FixtureContext(temp_dir, options.download_jobs)
+    with FixtureServer({}) as server:
+        unmarked, mismatched = make_recipes(
+            server, ctx, ['unmarked', 'mismatched'])
+        download_recipes([unmarked, mismatched], ctx)
+        for recipe in (unmarked, mismatched):
+            check_downloaded(recipe)
+        # A complete file without its marker, and a marker of another
+        # download
+        with open(get_marker_filename(mismatched), 'w') as fileh:
+            json.dump({'md5': 'not the md5sum'}, fileh)
+        os.unlink(get_marker_filename(unmarked))
+
+        del server.requests[:]
+        download_recipes([unmarked, mismatched], ctx)
+        for recipe in (unmarked, mismatched):
+            check_downloaded(recipe)
+        requests = sorted(server.requests, key=lambda request: request.path)
+    expect([(request.path, request.status) for request in requests] ==
+           [(mismatched.path, 200), (unmarked.path, 200)],
+           'expected both downloads to be fetched again: {}',
+           describe(requests))
+
+
+CHECKS = [('concurrent', check_concurrent),
+          ('interrupted', check_interrupted),
+          ('unmarked', check_unmarked)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check the concurrent recipe downloads against a '
+        'local server')
+    parser.add_argument('--download-jobs', type=int, default=4)
+    parser.add_argument('--verbose', action='store_true',
+                        help='show the log of the downloads')
+    parser.add_argument('checks', nargs='*',
+                        help='the checks to run (by default, all of {})'
+                        .format(', '.join([name for name, _ in CHECKS])))
+    parser.parse_args(namespace=options)
+    if not options.verbose:
+        logger.setLevel(logging.ERROR)
+        # The progress line is written straight to the terminal
+        download_progress.update = lambda name, received, size: None
+        download_progress.finish = lambda name: None
+    if run_checks(CHECKS, options.checks):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+'''A local HTTP server serving files from memory, which can drop
+connections mid-transfer, ignore Range requests or serve slowly, for
+checking the downloads of p4a (see range_download.py and
+download_recipes.py) without the network.
+
+Files are served with an ETag (from their contents) and a Last-Modified
+date, and the If-Range header of Range requests is honoured, so that
+changing a file in ``files`` is seen by the downloads as a new version
+of it.
+
+Every request is logged, with the Range it asked for and the status
+of the response, so that checks can tell a resumed download from a
+restarted one.
+'''
+
+from __future__ import print_function
+
+import contextlib
+import hashlib
+import re
+import socket
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d+)-(\d*)$')
+LAST_MODIFIED = 'Mon, 01 Jan 2018 00:00:00 GMT'
+
+
+class Request(object):
+    '''A request made to the server.'''
+
+    def __init__(self, path, range_header, status):
+        self.path = path
+        self.range_header = range_header
+        self.status = status
+        self.start = 0
+        if range_header is not None and status == 206:
+            self.start = int(RANGE_PATTERN.match(range_header).group(1))
+
+    def __repr__(self):
+        return '<{} Range: {} -> {}>'.format(self.path, self.range_header,
+                                             self.status)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        data = server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        etag = server.get_etag(data)
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        start, end = 0, len(data) - 1
+        status = 200
+        if server.if_range and if_range is not None and \
+           if_range not in (etag, LAST_MODIFIED):
+            # Changed since the client got its part of the file, so the
+            # whole file is sent
+            honour_range = False
+        else:
+            honour_range = not server.ignore_range
+        if range_header is not None and honour_range:
+            match = RANGE_PATTERN.match(range_header)
+            if match is not None:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)))
+                status = 206
+                if start >= len(data):
+                    server.log(self.path, range_header, 416)
+                    self.send_response(416)
+                    self.send_header('Content-Range',
+                                     'bytes */{}'.format(len(data)))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+        server.log(self.path, range_header, status)
+
+        drop_after = server.take_drop(self.path)
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        if server.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if server.validators:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', LAST_MODIFIED)
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, len(data)))
+        self.end_headers()
+
+        body = data[start:end + 1]
+        if drop_after is not None:
+            body = body[:drop_after]
+        chunks = [body[offset:offset + server.chunk_size]
+                  for offset in range(0, len(body), server.chunk_size)]
+        with server.connection():
+            for chunk in chunks[:-1]:
+                self.wfile.write(chunk)
+                if server.delay:
+                    time.sleep(server.delay)
+        # The last chunk is sent once the response no longer counts as
+        # active, as the client may send its next request as soon as it
+        # has it
+        if chunks:
+            self.wfile.write(chunks[-1])
+        if drop_after is not None:
+            # Closes the connection before the whole body was sent, as
+            # a connection lost mid-transfer
+            self.wfile.flush()
+            self.close_connection = True
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class FixtureServer(ThreadingMixIn, HTTPServer):
+    '''The server, on a free port of localhost. Use as a context
+    manager, or call start() and stop().'''
+
+    daemon_threads = True
+
+    def __init__(self, files, ignore_range=False, accept_ranges=True,
+                 chunk_size=16 * 1024, delay=0, validators=True,
+                 if_range=True):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FixtureHandler)
+        self.files = files  # path -> contents
+        self.ignore_range = ignore_range
+        self.accept_ranges = accept_ranges
+        self.validators = validators  # whether to send ETag/Last-Modified
+        self.if_range = if_range  # whether to honour If-Range
+        self.chunk_size = chunk_size
+        self.delay = delay  # seconds to wait after each chunk
+        self.drops = {}  # path -> [bytes sent before dropping, ...]
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @staticmethod
+    def get_etag(data):
+        return '"{}"'.format(hashlib.sha1(data).hexdigest()[:16])
+
+    def handle_error(self, request, client_address):
+        # Clients closing a connection before reading the whole response
+        # (e.g. the segments of a failed download) are expected
+        pass
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server_address[1], path)
+
+    def drop(self, path, after, times=1):
+        '''Makes the next `times` responses for path close the connection
+        after sending `after` bytes of the body.'''
+        with self.lock:
+            self.drops.setdefault(path, []).extend([after] * times)
+
+    def take_drop(self, path):
+        with self.lock:
+            drops = self.drops.get(path)
+            if drops:
+                return drops.pop(0)
+        return None
+
+    def log(self, path, range_header, status):
+        with self.lock:
+            self.requests.append(Request(path, range_header, status))
+
+    def requests_for(self, path):
+        with self.lock:
+            return [request for request in self.requests
+                    if request.path == path]
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''Counts the responses being sent while in the context.'''
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def make_data(size, seed=0):
+    '''Returns size bytes of data that differ at every offset, so that
+    misplaced blocks are noticed.'''
+    data = bytearray()
+    counter = seed
+    while len(data) < size:
+        data.extend('{:015d}\n'.format(counter).encode('ascii'))
+        counter += 1
+    return bytes(data[:size])
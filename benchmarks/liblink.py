@@ -0,0 +1,145 @@
+'''Benchmark of the liblink commands that extension modules are linked
+with (LDSHARED), tools/liblink (python) and tools/liblink.sh.
+
+A kivy-sized fixture of extension modules (a few objects each, made
+from a small C file with the host compiler) is linked with each
+command the way distutils calls LDSHARED, using the host ld. The total
+wall time and the number of python interpreters started (counted by a
+``python`` shim first in the PATH, which ``#!/usr/bin/env python``
+finds) are reported, and the outputs of the commands are checked to be
+the same. Run with::
+
+    python benchmarks/liblink.py [--extensions 120] [--objects 3]
+'''
+
+from os.path import dirname, abspath, join, exists
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = dirname(dirname(abspath(__file__)))
+TOOLS_DIR = join(ROOT_DIR, 'pythonforandroid', 'tools')
+
+COMMANDS = ['liblink', 'liblink.sh']
+
+SOURCE = '''
+static int counter = 0;
+int function_{index}(int value) {{ return value + counter++; }}
+'''
+
+
+def find_program(name):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        filename = join(path, name)
+        if exists(filename) and os.access(filename, os.X_OK):
+            return filename
+    sys.exit('{} was not found in the PATH'.format(name))
+
+
+def make_fixture(temp_dir, extensions, objects):
+    '''Compiles the objects of each extension, and returns the LDSHARED
+    arguments of each.'''
+    cc = find_program('cc')
+    temp_build_dir = join(temp_dir, 'build', 'temp')
+    os.makedirs(temp_build_dir)
+    links = []
+    for extension in range(extensions):
+        object_filenames = []
+        for number in range(objects):
+            name = 'ext{}_{}'.format(extension, number)
+            source = join(temp_build_dir, name + '.c')
+            with open(source, 'w') as fileh:
+                fileh.write(SOURCE.format(index=name))
+            object_filenames.append(join(temp_build_dir, name + '.o'))
+            subprocess.check_call([cc, '-c', '-fPIC', '-o',
+                                   object_filenames[-1], source])
+        # distutils passes LDSHARED the CFLAGS and LDFLAGS, then the
+        # objects, libraries and output
+        links.append(['-DANDROID', '-mandroid', '-fomit-frame-pointer',
+                      '-I/usr/include', '-O2'] + object_filenames +
+                     ['-L/usr/lib', '-lm', '-lpython2.7', '-o',
+                      join(temp_dir, 'build', 'lib',
+                           'ext{}.so'.format(extension))])
+    os.makedirs(join(temp_dir, 'build', 'lib'))
+    return links
+
+
+def make_python_shim(temp_dir):
+    '''Returns the dir of a python shim counting its runs in the file
+    returned too.'''
+    shim_dir = join(temp_dir, 'shim')
+    os.makedirs(shim_dir)
+    counter = join(temp_dir, 'python_runs')
+    with open(join(shim_dir, 'python'), 'w') as fileh:
+        fileh.write('#!/bin/sh\necho >> {}\nexec {} "$@"\n'.format(
+            counter, sys.executable))
+    os.chmod(join(shim_dir, 'python'), 0o755)
+    return shim_dir, counter
+
+
+def run_command(command, links, temp_dir, shim_dir, counter):
+    liblink_path = join(temp_dir, 'objects_' + command)
+    os.makedirs(liblink_path)
+    env = dict(os.environ)
+    env['PATH'] = shim_dir + os.pathsep + env['PATH']
+    env['LD'] = find_program('ld')
+    env['LIBLINK_PATH'] = liblink_path
+    if exists(counter):
+        os.unlink(counter)
+
+    start = time.time()
+    for link in links:
+        subprocess.check_call([join(TOOLS_DIR, command)] + link, env=env)
+    wall = time.time() - start
+
+    runs = 0
+    if exists(counter):
+        with open(counter) as fileh:
+            runs = len(fileh.readlines())
+    return wall, runs, liblink_path
+
+
+def read_libs(liblink_path):
+    libs = {}
+    for filename in os.listdir(liblink_path):
+        if filename.endswith('.libs'):
+            with open(join(liblink_path, filename)) as fileh:
+                libs[filename] = fileh.read()
+    return libs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the liblink commands')
+    parser.add_argument('--extensions', type=int, default=120)
+    parser.add_argument('--objects', type=int, default=3)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        links = make_fixture(temp_dir, args.extensions, args.objects)
+        shim_dir, counter = make_python_shim(temp_dir)
+        print('{} extensions of {} objects'.format(args.extensions,
+                                                    args.objects))
+        print('{:<12} {:>9} {:>10} {:>14}'.format(
+            'command', 'wall', 'per link', 'interpreters'))
+        outputs = []
+        for command in COMMANDS:
+            wall, runs, liblink_path = run_command(
+                command, links, temp_dir, shim_dir, counter)
+            outputs.append(read_libs(liblink_path))
+            print('{:<12} {:>8.0f}ms {:>8.1f}ms {:>14}'.format(
+                command, wall * 1000, wall * 1000 / len(links), runs))
+        if any([output != outputs[0] for output in outputs]):
+            print('The .libs files of the commands differ')
+            sys.exit(1)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+'''Checks of the resumable downloads of p4a (RangeDownload, in
+pythonforandroid.util) against a local HTTP server which drops
+connections mid-transfer (see httpfixture.py).
+
+Each check downloads a file from the server and compares the result,
+and the digests RangeDownload returns, with the served data. The
+requests the server received show whether a download was resumed
+(a Range request from where it stopped) or restarted. The checks are:
+
+- resume: dropped connections are resumed from the end of the .part
+  file;
+- ignored-range: a server ignoring the Range of a resumed request
+  sends the whole file again, which restarts the download;
+- leftover-part: a .part file left by an earlier run is resumed, or
+  restarted if it is bigger than the file (416);
+- changed-file: a .part file of a file that changed on the server
+  since is restarted, whether the server honours If-Range (and sends
+  the whole file) or not (and sends a part of the new file, with
+  another ETag);
+- unvalidated-part: a .part file without the ETag or Last-Modified
+  date of its file (e.g. from a server sending neither) is restarted;
+- segmented: a file fetched in several segments at once, some of
+  which are dropped and resumed;
+- segmented-resume: a segmented download that failed is resumed from
+  its recorded progress by the next run;
+- segmented-fallback: a server answering the requests for segments
+  with the whole file makes the download restart over a single
+  connection.
+
+Run with::
+
+    python benchmarks/range_download.py [check ...]
+'''
+
+from __future__ import print_function
+
+from os.path import dirname, abspath, join, exists
+import argparse
+import hashlib
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, dirname(abspath(__file__)))
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from httpfixture import FixtureServer, make_data  # noqa: E402
+from pythonforandroid.util import RangeDownload  # noqa: E402
+
+DIGESTS = ('md5', 'sha256')
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(condition, message, *args):
+    if not condition:
+        raise CheckFailed(message.format(*args))
+
+
+def check_download(download, data, digests):
+    '''Checks the file and digests of a finished download.'''
+    with open(download.filename, 'rb') as fileh:
+        contents = fileh.read()
+    expect(contents == data, 'the file differs from the served data '
+           '({} bytes instead of {})', len(contents), len(data))
+    for name in DIGESTS:
+        expect(digests.get(name) == hashlib.new(name, data).hexdigest(),
+               'wrong {} digest', name)
+    expect(not exists(download.part_filename), 'the .part file was left')
+    expect(not exists(download.segments_filename),
+           'the .part.segments file was left')
+    expect(not exists(download.validator_filename),
+           'the .part.validator file was left')
+
+
+def describe(requests):
+    return ', '.join([repr(request) for request in requests])
+
+
+def check_resume(temp_dir):
+    data = make_data(1024 * 1024)
+    with FixtureServer({'/file.bin': data}) as server:
+        server.drop('/file.bin', 100000, times=2)
+        download = RangeDownload(server.url('/file.bin'),
+                                 join(temp_dir, 'file.bin'), digests=DIGESTS)
+        check_download(download, data, download.run())
+        requests = server.requests_for('/file.bin')
+    expect([(request.status, request.start) for request in requests] ==
+           [(200, 0), (206, 100000), (206, 200000)],
+           'the download was not resumed: {}', describe(requests))
+
+
+def check_ignored_range(temp_dir):
+    data = make_data(1024 * 1024)
+    with FixtureServer({'/file.bin': data}, ignore_range=True,
+                       accept_ranges=False) as server:
+        server.drop('/file.bin', 100000)
+        download = RangeDownload(server.url('/file.bin'),
+                                 join(temp_dir, 'file.bin'), digests=DIGESTS)
+        check_download(download, data, download.run())
+        requests = server.requests_for('/file.bin')
+    expect(len(requests) == 2 and requests[1].range_header is not None and
+           requests[1].status == 200,
+           'the resumed request was not sent with a Range, or not '
+           'answered with the whole file: {}', describe(requests))
+
+
+def interrupt_download(server, filename, after):
+    '''Runs a download of /file.bin that is dropped after `after` bytes
+    and not resumed, leaving its .part file as an earlier run of p4a
+    would.'''
+    server.drop('/file.bin', after)
+    download = RangeDownload(server.url('/file.bin'), filename,
+                             digests=DIGESTS)
+    download.retries = 0
+    try:
+        download.run()
+    except (IOError, OSError):
+        pass
+    else:
+        raise CheckFailed('the interrupted download did not fail')
+    expect(exists(download.part_filename) and
+           exists(download.validator_filename),
+           'the interrupted download did not leave its .part and '
+           '.part.validator files')
+    del server.requests[:]
+    return RangeDownload(server.url('/file.bin'), filename, digests=DIGESTS)
+
+
+def check_leftover_part(temp_dir):
+    data = make_data(1024 * 1024)
+    with FixtureServer({'/file.bin': data}) as server:
+        download = interrupt_download(server, join(temp_dir, 'file.bin'),
+                                      300000)
+        check_download(download, data, download.run())
+        requests = server.requests_for('/file.bin')
+        expect([(request.status, request.start) for request in requests] ==
+               [(206, 300000)], 'the .part file was not resumed: {}',
+               describe(requests))
+
+        # A .part file bigger than the file is answered with 416, and
+        # the download restarted
+        download = interrupt_download(server, join(temp_dir, 'bigger.bin'),
+                                      300000)
+        with open(download.part_filename, 'ab') as fileh:
+            fileh.write(data)
+        check_download(download, data, download.run())
+        requests = server.requests_for('/file.bin')
+    expect([request.status for request in requests] == [416, 200],
+           'the download was not restarted after a 416: {}',
+           describe(requests))
+
+
+def check_changed_file(temp_dir):
+    data = make_data(1024 * 1024)
+    changed = make_data(1024 * 1024, seed=1)
+    for if_range, statuses in ((True, [200]), (False, [206, 200])):
+        files = {'/file.bin': data}
+        with FixtureServer(files, if_range=if_range) as server:
+            download = interrupt_download(
+                server, join(temp_dir, 'file{}.bin'.format(if_range)),
+                300000)
+            files['/file.bin'] = changed
+            check_download(download, changed, download.run())
+            requests = server.requests_for('/file.bin')
+        expect([request.status for request in requests] == statuses and
+               requests[0].range_header == 'bytes=300000-',
+               'expected the resumed request to be answered with {}, and '
+               'the download restarted: {}', statuses, describe(requests))
+
+
+def check_unvalidated_part(temp_dir):
+    data = make_data(1024 * 1024)
+    with FixtureServer({'/file.bin': data}, validators=False) as server:
+        download = RangeDownload(server.url('/file.bin'),
+                                 join(temp_dir, 'file.bin'), digests=DIGESTS)
+        with open(download.part_filename, 'wb') as fileh:
+            fileh.write(make_data(300000, seed=1))
+        check_download(download, data, download.run())
+        requests = server.requests_for('/file.bin')
+    expect([(request.range_header, request.status)
+            for request in requests] == [(None, 200)],
+           'expected the .part file to be restarted: {}',
+           describe(requests))
+
+
+def make_segmented_download(server, temp_dir, segments=4):
+    download = RangeDownload(server.url('/file.bin'),
+                             join(temp_dir, 'file.bin'), digests=DIGESTS,
+                             segments=segments)
+    download.min_segment_size = 128 * 1024
+    download.save_interval = 64 * 1024
+    return download
+
+
+def check_segmented(temp_dir):
+    data = make_data(2 * 1024 * 1024 + 12345)
+    with FixtureServer({'/file.bin': data}) as server:
+        server.drop('/file.bin', 50000, times=2)
+        download = make_segmented_download(server, temp_dir)
+        check_download(download, data, download.run())
+        requests = server.requests_for('/file.bin')
+    ranged = [request for request in requests
+              if request.range_header is not None]
+    expect(len(requests) == 6 and len(ranged) == 5 and
+           all([not request.range_header.endswith('-')
+                for request in ranged]),
+           'expected a request for the first segment, 3 for the other '
+           'segments and 2 to resume the dropped ones: {}',
+           describe(requests))
+
+
+def check_segmented_resume(temp_dir):
+    data = make_data(2 * 1024 * 1024 + 12345)
+    with FixtureServer({'/file.bin': data}) as server:
+        server.drop('/file.bin', 200000, times=2)
+        download = make_segmented_download(server, temp_dir)
+        download.retries = 0
+        try:
+            download.run()
+        except (IOError, OSError) as e:
+            print('  first run failed as expected: {}'.format(e))
+        else:
+            raise CheckFailed('the first run did not fail')
+        expect(exists(download.part_filename) and
+               exists(download.segments_filename) and
+               not exists(download.filename),
+               'the failed run did not leave its .part and '
+               '.part.segments files')
+        with open(download.segments_filename) as fileh:
+            segments = json.load(fileh)['segments']
+        expected = sorted(['bytes={}-{}'.format(start + received, end)
+                           for start, end, received in segments
+                           if 0 < received < end - start + 1])
+        expect(len(expected) == 2,
+               'expected two segments to be partly downloaded: {}',
+               segments)
+        del server.requests[:]
+
+        download = make_segmented_download(server, temp_dir)
+        check_download(download, data, download.run())
+        requests = server.requests_for('/file.bin')
+    expect(sorted([request.range_header for request in requests]) ==
+           expected and
+           all([request.status == 206 for request in requests]),
+           'expected the two failed segments to be resumed from their '
+           'recorded progress ({}): {}', ', '.join(expected),
+           describe(requests))
+
+
+def check_segmented_fallback(temp_dir):
+    data = make_data(2 * 1024 * 1024 + 12345)
+    with FixtureServer({'/file.bin': data}, ignore_range=True) as server:
+        download = make_segmented_download(server, temp_dir)
+        check_download(download, data, download.run())
+        requests = server.requests_for('/file.bin')
+    expect(len(requests) >= 3 and
+           all([request.status == 200 for request in requests]) and
+           requests[0].range_header is None and
+           requests[-1].range_header is None,
+           'expected the segments to be answered with the whole file, '
+           'and the download restarted: {}', describe(requests))
+
+
+CHECKS = [('resume', check_resume),
+          ('ignored-range', check_ignored_range),
+          ('leftover-part', check_leftover_part),
+          ('changed-file', check_changed_file),
+          ('unvalidated-part', check_unvalidated_part),
+          ('segmented', check_segmented),
+          ('segmented-resume', check_segmented_resume),
+          ('segmented-fallback', check_segmented_fallback)]
+
+
+def run_checks(checks, names):
+    failed = []
+    for name, check in checks:
+        if names and name not in names:
+            continue
+        temp_dir = tempfile.mkdtemp(prefix='p4a-check-')
+        start = time.time()
+        try:
+            check(temp_dir)
+        except CheckFailed as e:
+            print('{}: FAILED, {}'.format(name, e))
+            failed.append(name)
+        else:
+            print('{}: ok ({:.2f}s)'.format(name, time.time() - start))
+        finally:
+            shutil.rmtree(temp_dir)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check the resumable downloads against a local server')
+    parser.add_argument('checks', nargs='*',
+                        help='the checks to run (by default, all of {})'
+                        .format(', '.join([name for name, _ in CHECKS])))
+    args = parser.parse_args()
+    if run_checks(CHECKS, args.checks):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+'''Benchmark of the recipe dependency resolution on synthetic graphs.
+
+Each graph has a number of recipes (500 by default) in layers, where
+every recipe depends on a few recipes of the layers below it. Some of
+the dependencies are tuples of alternatives, and some recipes conflict
+with the preferred alternatives, so that the resolver has to go back
+and use the others. Run with::
+
+    python benchmarks/resolve_recipes.py [--recipes 500] [--repeat 5]
+'''
+
+from os.path import dirname, abspath
+import argparse
+import random
+import sys
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from pythonforandroid.graph import RecipeResolver  # noqa: E402
+
+
+class SyntheticRecipe(object):
+    def __init__(self, name):
+        self.name = name
+        self.depends = []
+        self.conflicts = []
+        self.opt_depends = []
+
+
+def make_recipes(count, seed, layers=10, alternatives=0.15,
+                 conflicts=0.1, pip_modules=0.02):
+    '''Returns a dict of count synthetic recipes, and the names of the
+    recipes to resolve (those of the top layer).
+
+    A fifth of the recipes (which only depend on recipes of the two
+    bottom layers) are only ever depended on as alternatives,
+    as a (preferred, fallback) tuple. Some recipes conflict with
+    preferred alternatives, so the fallback has to be used instead.
+    Fallbacks never conflict with anything, so there is always a valid
+    set.'''
+    rand = random.Random(seed)
+    providers = count // 5
+    preferred = ['preferred{}'.format(i) for i in range(providers // 2)]
+    fallbacks = ['fallback{}'.format(i) for i in range(providers // 2)]
+    names = ['recipe{}'.format(i)
+             for i in range(count - len(preferred) - len(fallbacks))]
+    layer_size = max(1, len(names) // layers)
+    recipes = {}
+    for i, name in enumerate(names):
+        recipe = recipes[name] = SyntheticRecipe(name)
+        below = names[:(i // layer_size) * layer_size]
+        if not below:
+            continue
+        for _ in range(rand.randint(1, 4)):
+            if len(below) > 2 * layer_size and rand.random() < alternatives:
+                recipe.depends.append((rand.choice(preferred),
+                                       rand.choice(fallbacks)))
+            elif rand.random() < pip_modules:
+                recipe.depends.append('module{}'.format(rand.randint(0, 50)))
+            else:
+                recipe.depends.append(rand.choice(below))
+        if rand.random() < 0.05:
+            recipe.opt_depends.append(rand.choice(below))
+        if rand.random() < conflicts:
+            recipe.conflicts.append(rand.choice(preferred))
+
+    for name in preferred + fallbacks:
+        recipe = recipes[name] = SyntheticRecipe(name)
+        # Only depends on the two bottom layers, to avoid cycles
+        recipe.depends = rand.sample(names[:2 * layer_size],
+                                     rand.randint(0, 3))
+
+    return recipes, names[-layer_size:]
+
+
+def run(count, seed, repeat):
+    '''Resolves a synthetic graph repeat times, and returns the best
+    times taken to choose the recipes and to sort them.'''
+    recipes, targets = make_recipes(count, seed)
+    resolve_times = []
+    order_times = []
+    for _ in range(repeat):
+        resolver = RecipeResolver(recipes.get)
+        start = time.time()
+        chosen = resolver.resolve(targets)
+        resolve_times.append(time.time() - start)
+        if chosen is None:
+            order = None
+            continue
+        start = time.time()
+        order = list(resolver.get_graph(chosen).find_order())
+        order_times.append(time.time() - start)
+    print('seed {:<4} {:>6} recipes {:>14} resolve {:>8.4f}s '
+          'order {:>8.4f}s'.format(
+              seed, count,
+              'no valid set' if order is None
+              else '{} chosen'.format(len(order)),
+              min(resolve_times), min(order_times or [0])))
+    return min(resolve_times), min(order_times or [0])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the recipe resolver on synthetic graphs')
+    parser.add_argument('--recipes', type=int, default=500)
+    parser.add_argument('--graphs', type=int, default=10,
+                        help='Number of random graphs to resolve')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    times = [run(args.recipes, seed, args.repeat)
+             for seed in range(args.graphs)]
+    print('total resolve {:.4f}s order {:.4f}s'.format(
+        sum([resolve for resolve, order in times]),
+        sum([order for resolve, order in times])))
+
+
+if __name__ == '__main__':
+    main()
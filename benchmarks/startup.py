@@ -0,0 +1,85 @@
+'''Benchmark of the startup time of the toolchain commands.
+
+Each command is run several times in a fresh interpreter with ``-X
+importtime`` (so this needs Python 3.7 or later), and the best wall
+time, the time spent importing modules, the number of modules imported
+and whether the build machinery was imported are reported. HOME is set
+to a temporary dir, so the commands see an empty storage dir. Run
+with::
+
+    python benchmarks/startup.py [--repeat 5] [command ...]
+'''
+
+from os.path import dirname, abspath
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = dirname(dirname(abspath(__file__)))
+
+COMMANDS = ['archs', 'distributions', 'bootstraps', 'build_status',
+            'recipes --compact', 'recipes', 'recipes --levels']
+
+# Modules that commands which don't build anything shouldn't need
+HEAVY_MODULES = ('sh', 'jinja2', 'pythonforandroid.recipe',
+                 'pythonforandroid.build')
+
+
+def run_command(command, home):
+    env = dict(os.environ)
+    env['HOME'] = home
+    env['PYTHONPATH'] = ROOT_DIR
+    start = time.time()
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-W', 'ignore', '-m',
+         'pythonforandroid.toolchain'] + command.split(),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+        cwd=home)
+    _, err = process.communicate()
+    wall = time.time() - start
+
+    import_time = 0
+    modules = set()
+    for line in err.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        # Only count the modules imported at the top level, as the
+        # cumulative times of these include the others
+        if not name[1:].startswith(' '):
+            import_time += int(cumulative) / 1e6
+    return wall, import_time, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the startup time of the toolchain commands')
+    parser.add_argument('commands', nargs='*', default=COMMANDS)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp()
+    try:
+        print('{:<20} {:>9} {:>9} {:>8}  {}'.format(
+            'command', 'wall', 'imports', 'modules', 'heavy modules'))
+        for command in args.commands:
+            results = [run_command(command, home)
+                       for _ in range(args.repeat)]
+            wall = min([result[0] for result in results])
+            import_time = min([result[1] for result in results])
+            modules = results[-1][2]
+            heavy = [name for name in HEAVY_MODULES if name in modules]
+            print('{:<20} {:>8.0f}ms {:>8.0f}ms {:>8}  {}'.format(
+                command, wall * 1000, import_time * 1000, len(modules),
+                ', '.join(heavy) or '-'))
+    finally:
+        shutil.rmtree(home)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+'''Extraction of downloaded recipe archives.
+
+Archives are read in a single pass with :mod:`tarfile` or
+:mod:`zipfile`, and the root dir of the archive (e.g. Python-2.7.2/)
+is replaced by the destination dir as each member is extracted. If a
+parallel decompressor such as pigz or pbzip2 is installed, the
+decompression of tarballs is handed to it.
+'''
+
+from os.path import join, exists, dirname, normpath
+from os import environ, rename, makedirs, symlink, chmod
+import shutil
+import stat
+import subprocess
+import tarfile
+import zipfile
+
+from pythonforandroid.util import which
+
+
+TAR_EXTENSIONS = {
+    'gz': ('.tar.gz', '.tgz'),
+    'bz2': ('.tar.bz2', '.tbz2'),
+    'xz': ('.tar.xz', '.txz'),
+    }
+
+# Parallel decompressors for each compression, in order of preference;
+# each is called as [command] + args + [filename] and must write the
+# decompressed tarball to stdout
+DECOMPRESSORS = {
+    'gz': [('pigz', ['-d', '-c'])],
+    'bz2': [('lbzip2', ['-d', '-c']), ('pbzip2', ['-d', '-c'])],
+    'xz': [('pixz', ['-d', '-i']), ('xz', ['-d', '-c', '-T0'])],
+    }
+
+
+def is_archive(filename):
+    return (filename.endswith('.zip') or
+            any([filename.endswith(extensions)
+                 for extensions in TAR_EXTENSIONS.values()]))
+
+
+def get_decompressor(filename):
+    '''Returns the command line of a parallel decompressor for the given
+    tarball, or None if none is available.'''
+    for compression, extensions in TAR_EXTENSIONS.items():
+        if not filename.endswith(extensions):
+            continue
+        for command, args in DECOMPRESSORS[compression]:
+            executable = which(command, environ.get('PATH', ''))
+            if executable is not None:
+                return [executable] + args + [filename]
+    return None
+
+
+def _strip_root(name, root):
+    '''Returns the name relative to the root dir of the archive, '' for
+    the root dir itself, or None if it is outside the root dir.'''
+    name = normpath(name.lstrip('/'))
+    if name == root:
+        return ''
+    if name.startswith(root + '/'):
+        return name[len(root) + 1:]
+    return None
+
+
+def _tar_members(tar, root_holder):
+    for member in tar:
+        if not root_holder:
+            root_holder.append(normpath(member.name.lstrip('/'))
+                               .split('/')[0])
+        name = _strip_root(member.name, root_holder[0])
+        if not name:
+            # The root dir itself is replaced by the destination, and
+            # anything outside it is dropped
+            continue
+        member.name = name
+        if member.islnk():
+            linkname = _strip_root(member.linkname, root_holder[0])
+            if linkname is None:
+                continue
+            member.linkname = linkname
+        yield member
+
+
+def _extract_tar(filename, directory):
+    command = get_decompressor(filename)
+    process = None
+    if command is None:
+        tar = tarfile.open(filename, 'r|*')
+    else:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        tar = tarfile.open(fileobj=process.stdout, mode='r|')
+
+    try:
+        kwargs = {}
+        if hasattr(tarfile, 'tar_filter'):
+            kwargs['filter'] = 'tar'
+        tar.extractall(directory, _tar_members(tar, []), **kwargs)
+    finally:
+        tar.close()
+        if process is not None:
+            process.stdout.close()
+            if process.wait() != 0:
+                raise Exception('{} failed to decompress {}'.format(
+                    command[0], filename))
+
+
+def _extract_zip(filename, directory):
+    with zipfile.ZipFile(filename, 'r') as fileh:
+        members = fileh.infolist()
+        if not members:
+            return
+        root = normpath(members[0].filename.lstrip('/')).split('/')[0]
+        for member in members:
+            name = _strip_root(member.filename, root)
+            if not name:
+                continue
+            target = join(directory, name)
+            mode = member.external_attr >> 16
+            if member.filename.endswith('/'):
+                if not exists(target):
+                    makedirs(target)
+                continue
+            if not exists(dirname(target)):
+                makedirs(dirname(target))
+            if stat.S_ISLNK(mode):
+                symlink(fileh.read(member).decode('utf-8'), target)
+                continue
+            with fileh.open(member) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            # Keep the permissions (mostly the executable bit) like unzip
+            if mode & 0o777:
+                chmod(target, mode & 0o777)
+
+
+def extract_archive(filename, directory):
+    '''Extracts the contents of the root dir of the archive to the given
+    directory, which must not exist yet. The archive is extracted to a
+    temporary dir next to it first, so the directory only appears once
+    the extraction has succeeded.'''
+    temp_dir = directory + '.part'
+    if exists(temp_dir):
+        shutil.rmtree(temp_dir)
+    makedirs(temp_dir)
+    if filename.endswith('.zip'):
+        _extract_zip(filename, temp_dir)
+    else:
+        _extract_tar(filename, temp_dir)
+    rename(temp_dir, directory)
@@ -1,10 +1,10 @@
 from os.path import (join)
 from os import environ, uname
 import sys
-from distutils.spawn import find_executable
 
 from pythonforandroid.logger import warning
-from pythonforandroid.recipe import Recipe
+from pythonforandroid.util import which
+from pythonforandroid.tracing import tracer
 
 
 class Arch(object):
@@ -18,10 +18,19 @@ class Arch(object):
     def __init__(self, ctx):
         super(Arch, self).__init__()
         self.ctx = ctx
+        self._env = None
+        self._env_key = None
 
     def __str__(self):
         return self.arch
 
+    @property
+    def ndk_platform(self):
+        '''The NDK platform dir (used as the sysroot) for this arch.'''
+        return join(self.ctx.ndk_dir, 'platforms',
+                    'android-{}'.format(self.ctx.android_api),
+                    self.platform_dir)
+
     @property
     def include_dirs(self):
         return [
@@ -30,12 +39,33 @@ class Arch(object):
                 d.format(arch=self))
             for d in self.ctx.include_dirs]
 
+    def get_env_key(self):
+        '''The settings the environment of :meth:`compute_env` depends
+        on; it is only worked out again when these change.'''
+        return (self.ctx._ndk_dir, self.ctx._android_api,
+                self.ctx.toolchain_version, self.ctx.ccache,
+                self.ctx.build_dir, environ.get('USE_CCACHE'),
+                environ.get('PATH'))
+
     def get_env(self):
+        '''Returns the build environment for this arch. It is worked out
+        once for each set of toolchain settings, and each call returns a
+        copy of it, which the caller may change freely.'''
+        key = self.get_env_key()
+        if self._env is None or self._env_key != key:
+            tracer.count('arch env computed')
+            self._env = self.compute_env()
+            self._env_key = key
+        else:
+            tracer.count('arch env reused')
+        return dict(self._env)
+
+    def compute_env(self):
         env = {}
 
         env["CFLAGS"] = " ".join([
             "-DANDROID", "-mandroid", "-fomit-frame-pointer",
-            "--sysroot", self.ctx.ndk_platform])
+            "--sysroot", self.ndk_platform])
 
         env["CXXFLAGS"] = env["CFLAGS"]
 
@@ -45,7 +75,7 @@ class Arch(object):
         if py_platform in ['linux2', 'linux3']:
             py_platform = 'linux'
 
-        toolchain_prefix = self.ctx.toolchain_prefix
+        toolchain_prefix = self.toolchain_prefix
         toolchain_version = self.ctx.toolchain_version
         command_prefix = self.command_prefix
 
@@ -60,8 +90,8 @@ class Arch(object):
             env['NDK_CCACHE'] = self.ctx.ccache
 
         print('path is', environ['PATH'])
-        cc = find_executable('{command_prefix}-gcc'.format(
-            command_prefix=command_prefix), path=environ['PATH'])
+        cc = which('{command_prefix}-gcc'.format(
+            command_prefix=command_prefix), environ['PATH'])
         if cc is None:
             warning('Couldn\'t find executable for CC. This indicates a '
                     'problem locating the {} executable in the Android '
@@ -85,6 +115,9 @@ class Arch(object):
         env['MAKE'] = 'make -j5'
         env['READELF'] = '{}-readelf'.format(command_prefix)
 
+        # Imported here, as listing the archs shouldn't import the
+        # recipe machinery
+        from pythonforandroid.recipe import Recipe
         hostpython_recipe = Recipe.get_recipe('hostpython2', self.ctx)
 
         # AND: This hardcodes python version 2.7, needs fixing
@@ -109,8 +142,8 @@ class ArchARM(Arch):
 class ArchARMv7_a(ArchARM):
     arch = 'armeabi-v7a'
 
-    def get_env(self):
-        env = super(ArchARMv7_a, self).get_env()
+    def compute_env(self):
+        env = super(ArchARMv7_a, self).compute_env()
         env['CFLAGS'] = (env['CFLAGS'] +
                          (' -march=armv7-a -mfloat-abi=softfp '
                           '-mfpu=vfp -mthumb'))
@@ -124,8 +157,8 @@ class Archx86(Arch):
     command_prefix = 'i686-linux-android'
     platform_dir = 'arch-x86'
 
-    def get_env(self):
-        env = super(Archx86, self).get_env()
+    def compute_env(self):
+        env = super(Archx86, self).compute_env()
         env['CFLAGS'] = (env['CFLAGS'] +
                          ' -march=i686 -mtune=intel -mssse3 -mfpmath=sse -m32')
         env['CXXFLAGS'] = env['CFLAGS']
@@ -138,8 +171,8 @@ class Archx86_64(Arch):
     command_prefix = 'x86_64-linux-android'
     platform_dir = 'arch-x86'
 
-    def get_env(self):
-        env = super(Archx86_64, self).get_env()
+    def compute_env(self):
+        env = super(Archx86_64, self).compute_env()
         env['CFLAGS'] = (env['CFLAGS'] +
                          ' -march=x86-64 -msse4.2 -mpopcnt -m64 -mtune=intel')
         env['CXXFLAGS'] = env['CFLAGS']
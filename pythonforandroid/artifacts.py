@@ -0,0 +1,225 @@
+'''A content-addressed cache of recipe build outputs.
+
+Each cached build is stored under a key made by hashing everything
+that can affect the build: the recipe source (by content, the sha256
+of the download recorded in its marker or the commit of a git
+checkout), version, url and patches, the target arch and Android API,
+the NDK version, the compiler flags, and the keys of the recipes it
+depends on. When a recipe would be built and a build with the same key
+is cached, its outputs are restored instead of running
+:meth:`~pythonforandroid.recipe.Recipe.build_arch`.
+
+Only recipes setting :attr:`~pythonforandroid.recipe.Recipe.build_cache`
+are cached, which are the Python recipes. These install what they
+build into their own staging dir rather than straight into the
+python-install dir shared by every recipe (see
+:meth:`~pythonforandroid.recipe.Recipe.get_staging_dir`), so the
+outputs stored for a build are the files of its staging dir, along
+with the recipe's ``objects_<name>`` dir of objects to be biglinked.
+Builds can be recorded while other recipes are built.
+
+The other recipes (such as python2, hostpython2 and the NDK recipes)
+are not cached: their outputs stay in their build dirs, which are
+reused as long as their fingerprints match (see
+:mod:`pythonforandroid.fingerprints`).
+'''
+
+from os.path import join, exists, isdir, isfile, dirname, relpath, basename
+from os import environ, walk, rename, makedirs, getpid
+import contextlib
+import hashlib
+import json
+import shutil
+
+from pythonforandroid.logger import (info, debug)
+from pythonforandroid.util import ensure_dir
+from pythonforandroid.scheduler import get_recipe_dependencies
+from pythonforandroid.fingerprints import get_source_state, get_build_env
+
+# Changed whenever the layout of the entries changes
+ARTIFACT_CACHE_VERSION = 2
+
+
+def _list_files(directory):
+    '''Returns the paths (relative to directory) of the files in
+    directory.'''
+    files = []
+    for root, dirnames, filenames in walk(directory):
+        for filename in filenames:
+            files.append(relpath(join(root, filename), directory))
+    return sorted(files)
+
+
+def _copy_files(src_dir, dst_dir, filenames):
+    for filename in filenames:
+        dst = join(dst_dir, filename)
+        ensure_dir(dirname(dst))
+        shutil.copy2(join(src_dir, filename), dst)
+
+
+def _hash_file(filename):
+    file_hash = hashlib.sha256()
+    with open(filename, 'rb') as fileh:
+        for block in iter(lambda: fileh.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_source_key(recipe):
+    '''Returns a summary of the contents of the recipe source, which
+    (unlike :func:`~pythonforandroid.fingerprints.get_source_state`)
+    doesn't change when the same source is downloaded again or restored
+    from a CI cache: the sha256 of a downloaded file, recorded in its
+    marker, or the commit of a git checkout.'''
+    state = get_source_state(recipe)
+    if state is None or state[0] != 'file':
+        return state
+    filename = join(recipe.ctx.packages_path, recipe.name,
+                    recipe.versioned_url.rstrip('/').split('/')[-1])
+    marker_filename = join(dirname(filename),
+                           '.mark-{}'.format(basename(filename)))
+    if exists(marker_filename):
+        digests = recipe.read_download_marker(marker_filename, filename)
+        if digests.get('sha256'):
+            return ['file', digests['sha256']]
+    return ['file', _hash_file(filename)]
+
+
+class ArtifactCache(object):
+    '''Stores and restores the outputs of recipe builds, see the module
+    docstring.'''
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.keys = {}  # (recipe name, arch name) -> key
+
+    @property
+    def cache_dir(self):
+        return join(self.ctx.storage_dir, 'build_cache')
+
+    def is_cacheable(self, recipe):
+        '''Whether the outputs of the recipe can be cached. Recipes built
+        from a P4A_<name>_DIR are never cached, as their source may
+        change at any time.'''
+        if not recipe.build_cache:
+            return False
+        if getattr(recipe, 'install_in_hostpython', False):
+            return False
+        return environ.get('P4A_{}_DIR'.format(recipe.name.lower())) is None
+
+    def compute_keys(self, recipes, arch):
+        '''Works out the key of every recipe for the given arch. The
+        recipes must be given in build order.'''
+        dependencies = get_recipe_dependencies(recipes)
+        base_env = arch.get_env()
+        for recipe in recipes:
+            key_hash = hashlib.sha1()
+            data = {
+                'cache_version': ARTIFACT_CACHE_VERSION,
+                'name': recipe.name,
+                'dir_name': recipe.get_dir_name(),
+                'version': recipe.version,
+                'url': recipe.versioned_url,
+                'arch': arch.arch,
+                'android_api': self.ctx.android_api,
+                'ndk_ver': self.ctx.ndk_ver,
+                'env': get_build_env(base_env),
+                'depends': sorted([self.keys[(depend, arch.arch)]
+                                   for depend in dependencies[recipe.name]]),
+                'source': get_source_key(recipe),
+                }
+            key_hash.update(json.dumps(data, sort_keys=True).encode('utf-8'))
+            for filename in self._build_files(recipe, arch):
+                key_hash.update(filename.encode('utf-8'))
+                with open(join(recipe.recipe_dir, filename), 'rb') as fileh:
+                    key_hash.update(fileh.read())
+            self.keys[(recipe.name, arch.arch)] = key_hash.hexdigest()
+
+    def _build_files(self, recipe, arch):
+        '''The recipe files that affect the build: the recipe module and
+        any patches that will be applied.'''
+        filenames = ['__init__.py']
+        for patch in recipe.patches:
+            if isinstance(patch, (tuple, list)):
+                patch, patch_check = patch
+                if not patch_check(arch=arch, recipe=recipe):
+                    continue
+            filenames.append(patch.format(version=recipe.version,
+                                          arch=arch.arch))
+        return [filename for filename in filenames
+                if isfile(join(recipe.recipe_dir, filename))]
+
+    def get_key(self, recipe, arch):
+        if not self.is_cacheable(recipe):
+            return None
+        return self.keys.get((recipe.name, arch.arch))
+
+    def get_objects_dir(self, recipe, arch):
+        return join(recipe.get_build_container_dir(arch.arch),
+                    'objects_{}'.format(recipe.name))
+
+    def restore(self, recipe, arch):
+        '''Restores a cached build of the recipe, returning True if one
+        was found.'''
+        key = self.get_key(recipe, arch)
+        if key is None:
+            return False
+        entry_dir = join(self.cache_dir, key)
+        if not exists(join(entry_dir, 'artifact.json')):
+            return False
+        with open(join(entry_dir, 'artifact.json')) as fileh:
+            artifact = json.load(fileh)
+
+        info('Restoring cached build of {} for {} ({})'.format(
+            recipe.name, arch.arch, key[:12]))
+        _copy_files(join(entry_dir, 'python-install'),
+                    self.ctx.get_python_install_dir(arch),
+                    artifact['files']['python-install'])
+        _copy_files(join(entry_dir, 'objects'),
+                    self.get_objects_dir(recipe, arch),
+                    artifact['files']['objects'])
+        return True
+
+    @contextlib.contextmanager
+    def record(self, recipe, arch):
+        '''Context manager that stores the outputs of the build run inside
+        it: the files the build installed into the recipe's staging dir,
+        and its objects dir.'''
+        yield
+        key = self.get_key(recipe, arch)
+        if key is None or exists(join(self.cache_dir, key)):
+            return
+        staging_dir = recipe.get_staging_dir(arch)
+        objects_dir = self.get_objects_dir(recipe, arch)
+        files = {'python-install': [], 'objects': []}
+        if isdir(staging_dir):
+            files['python-install'] = _list_files(staging_dir)
+        if isdir(objects_dir):
+            files['objects'] = _list_files(objects_dir)
+        self._store(key, recipe, arch, staging_dir, objects_dir, files)
+
+    def _store(self, key, recipe, arch, staging_dir, objects_dir, files):
+        entry_dir = join(self.cache_dir, key)
+        # The entry is assembled in a temporary dir and renamed into
+        # place, so a failed store never leaves a partial entry, and
+        # other processes never see one
+        temp_dir = '{}.tmp{}'.format(entry_dir, getpid())
+        if exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        makedirs(temp_dir)
+
+        _copy_files(staging_dir, join(temp_dir, 'python-install'),
+                    files['python-install'])
+        _copy_files(objects_dir, join(temp_dir, 'objects'), files['objects'])
+        with open(join(temp_dir, 'artifact.json'), 'w') as fileh:
+            json.dump({'recipe': recipe.name,
+                       'arch': arch.arch,
+                       'files': files}, fileh)
+        try:
+            rename(temp_dir, entry_dir)
+        except OSError:
+            # Stored by another process meanwhile
+            shutil.rmtree(temp_dir)
+            return
+        debug('Stored build of {} for {} in the build cache ({})'.format(
+            recipe.name, arch.arch, key[:12]))
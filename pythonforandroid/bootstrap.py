@@ -10,6 +10,7 @@ from pythonforandroid.logger import (warning, shprint, info, logger,
 from pythonforandroid.util import (current_directory, ensure_dir,
                                    temp_directory, which)
 from pythonforandroid.recipe import Recipe
+from pythonforandroid.stripping import strip_tree
 
 
 class Bootstrap(object):
@@ -110,28 +111,27 @@ class Bootstrap(object):
     @classmethod
     def get_bootstrap_from_recipes(cls, recipes, ctx):
         '''Returns a bootstrap whose recipe requirements do not conflict with
-        the given recipes.'''
+        the given recipes, preferring those that add the fewest recipes
+        not already among them.'''
         info('Trying to find a bootstrap that matches the given recipes.')
-        bootstraps = [cls.get_bootstrap(name, ctx)
-                      for name in cls.list_bootstraps()]
+        conflicts = ctx.recipe_index.conflicts
+        recipes_mask = conflicts.get_mask(recipes)
         acceptable_bootstraps = []
-        for bs in bootstraps:
-            ok = True
+        for name in sorted(cls.list_bootstraps()):
+            bs = cls.get_bootstrap(name, ctx)
             if not bs.can_be_chosen_automatically:
-                ok = False
-            for recipe in bs.recipe_depends:
-                recipe = Recipe.get_recipe(recipe, ctx)
-                if any([conflict in recipes for conflict in recipe.conflicts]):
-                    ok = False
-                    break
-            for recipe in recipes:
-                recipe = Recipe.get_recipe(recipe, ctx)
-                if any([conflict in bs.recipe_depends
-                        for conflict in recipe.conflicts]):
-                    ok = False
-                    break
-            if ok:
-                acceptable_bootstraps.append(bs)
+                continue
+            # The recipes are all loaded already, and conflicts are
+            # recorded both ways, so this covers either side's conflicts
+            if (conflicts.get_conflicts_mask(bs.recipe_depends) &
+                    recipes_mask):
+                continue
+            added = len([recipe for recipe in bs.recipe_depends
+                         if recipe not in recipes])
+            acceptable_bootstraps.append((added, bs))
+        acceptable_bootstraps = [
+            bs for added, bs in sorted(acceptable_bootstraps,
+                                       key=lambda item: item[0])]
         info('Found {} acceptable bootstraps: {}'.format(
             len(acceptable_bootstraps),
             [bs.name for bs in acceptable_bootstraps]))
@@ -221,13 +221,7 @@ class Bootstrap(object):
         if strip is None:
             warning('Can\'t find strip in PATH...')
             return
-        strip = sh.Command(strip)
-        filens = shprint(sh.find, join(self.dist_dir, 'private'),
-                         join(self.dist_dir, 'libs'),
-                         '-iname', '*.so', _env=env).stdout.decode('utf-8')
         logger.info('Stripping libraries in private dir')
-        for filen in filens.split('\n'):
-            try:
-                strip(filen, _env=env)
-            except sh.ErrorReturnCode_1:
-                logger.debug('Failed to strip ' + filen)
+        strip_tree(self.ctx, [strip],
+                   [join(self.dist_dir, 'private'),
+                    join(self.dist_dir, 'libs')], '*.so', env)
@@ -1,4 +1,5 @@
 from pythonforandroid.toolchain import Bootstrap, shprint, current_directory, info, warning, ArchARM, info_main
+from pythonforandroid.snapshots import snapshot_tree
 from os.path import join, exists
 from os import walk
 import glob
@@ -45,10 +46,10 @@ class PygameBootstrap(Bootstrap):
             info('Copying python distribution')
             hostpython = sh.Command(self.ctx.hostpython)
             # AND: This *doesn't* need to be in arm env?
-            shprint(hostpython, '-OO', '-m', 'compileall', self.ctx.get_python_install_dir(),
+            shprint(hostpython, '-OO', '-m', 'compileall', self.ctx.get_python_install_dir(arch),
                     _tail=10, _filterout="^Listing", _critical=True)
             if not exists('python-install'):
-                shprint(sh.cp, '-a', self.ctx.get_python_install_dir(), './python-install')
+                snapshot_tree(self.ctx.get_python_install_dir(arch), 'python-install')
 
             self.distribute_libs(arch, [join(self.build_dir, 'libs', arch.arch), self.ctx.get_libs_dir(arch.arch)]);
             self.distribute_aars(arch)
@@ -56,7 +57,7 @@ class PygameBootstrap(Bootstrap):
 
             info('Filling private directory')
             if not exists(join('private', 'lib')):
-                shprint(sh.cp, '-a', join('python-install', 'lib'), 'private')
+                snapshot_tree(join('python-install', 'lib'), join('private', 'lib'))
             shprint(sh.mkdir, '-p', join('private', 'include', 'python2.7'))
             
             # AND: Copylibs stuff should go here
@@ -1,4 +1,5 @@
 from pythonforandroid.toolchain import Bootstrap, shprint, current_directory, info, warning, ArchARM, info_main
+from pythonforandroid.snapshots import snapshot_tree
 from os.path import join, exists
 from os import walk
 import glob
@@ -35,10 +36,10 @@ class SDL2Bootstrap(Bootstrap):
             
             hostpython = sh.Command(self.ctx.hostpython)
             shprint(hostpython, '-OO', '-m', 'compileall',
-                    self.ctx.get_python_install_dir(),
+                    self.ctx.get_python_install_dir(arch),
                     _tail=10, _filterout="^Listing", _critical=True)
             if not exists('python-install'):
-                shprint(sh.cp, '-a', self.ctx.get_python_install_dir(), './python-install')
+                snapshot_tree(self.ctx.get_python_install_dir(arch), 'python-install')
 
             self.distribute_libs(arch, [self.ctx.get_libs_dir(arch.arch)])
             self.distribute_aars(arch)
@@ -47,7 +48,7 @@ class SDL2Bootstrap(Bootstrap):
             info('Filling private directory')
             if not exists(join('private', 'lib')):
                 info('private/lib does not exist, making')
-                shprint(sh.cp, '-a', join('python-install', 'lib'), 'private')
+                snapshot_tree(join('python-install', 'lib'), join('private', 'lib'))
             shprint(sh.mkdir, '-p', join('private', 'include', 'python2.7'))
             
             # AND: Copylibs stuff should go here
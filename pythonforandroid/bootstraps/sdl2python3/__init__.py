@@ -1,4 +1,5 @@
 from pythonforandroid.toolchain import Bootstrap, shprint, current_directory, info, warning, ArchARM, info_main
+from pythonforandroid.snapshots import snapshot_tree
 from os.path import join, exists
 from os import walk
 import glob
@@ -38,7 +39,7 @@ class SDL2Bootstrap(Bootstrap):
             # AND: The compileall doesn't work with python3, tries to import a wrong-arch lib
             # shprint(hostpython, '-OO', '-m', 'compileall', join(self.ctx.build_dir, 'python-install'))
             if not exists('python-install'):
-                shprint(sh.cp, '-a', join(self.ctx.build_dir, 'python-install'), '.')
+                snapshot_tree(join(self.ctx.build_dir, 'python-install'), 'python-install')
 
             self.distribute_libs(arch, [self.ctx.libs_dir])
             self.distribute_aars(arch)
@@ -47,7 +48,7 @@ class SDL2Bootstrap(Bootstrap):
             info('Filling private directory')
             if not exists(join('private', 'lib')):
                 info('private/lib does not exist, making')
-                shprint(sh.cp, '-a', join('python-install', 'lib'), 'private')
+                snapshot_tree(join('python-install', 'lib'), join('private', 'lib'))
             shprint(sh.mkdir, '-p', join('private', 'include', 'python3.4m'))
             
             # AND: Copylibs stuff should go here
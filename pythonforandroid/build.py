@@ -1,22 +1,70 @@
 from os.path import (join, realpath, dirname, expanduser, exists,
-                     split)
-from os import environ
+                     split, isabs, getmtime, basename)
+from os import environ, rename, getpid
 import os
+import contextlib
 import glob
 import sys
 import re
+import threading
+import time
+import json
+import hashlib
 import sh
-from appdirs import user_data_dir
+from six import reraise
 
-from pythonforandroid.util import (ensure_dir, current_directory)
+from pythonforandroid.util import (ensure_dir, current_directory, file_lock,
+                                   get_storage_dir)
 from pythonforandroid.logger import (info, warning, error, info_notify,
                                      Err_Fore, Err_Style, info_main,
                                      shprint)
 from pythonforandroid.archs import ArchARM, ArchARMv7_a, Archx86, Archx86_64
 from pythonforandroid.recipe import Recipe
+from pythonforandroid.scheduler import JobScheduler, RecipeScheduler
+from pythonforandroid.fingerprints import FingerprintStore
+from pythonforandroid.recipeindex import RecipeIndex
+from pythonforandroid.tracing import tracer
+from pythonforandroid.stripping import log_totals as log_strip_totals
 
 DEFAULT_ANDROID_API = 15
 
+# The environment variables prepare_build_environment looks at
+ENVIRONMENT_VARIABLES = ('ANDROIDSDK', 'ANDROID_HOME', 'ANDROIDAPI',
+                         'ANDROIDNDK', 'NDK_HOME', 'ANDROID_NDK_HOME',
+                         'ANDROIDNDKVER', 'HOME', 'PATH')
+
+# The Context attributes set by prepare_build_environment
+PREPARED_ATTRIBUTES = ('_sdk_dir', '_android_api', '_ndk_dir', '_ndk_ver',
+                       'virtualenv', 'ccache', 'cython', 'ndk_platform',
+                       'toolchain_prefix', 'toolchain_version')
+
+# The results of prepare_build_environment by its inputs, kept for the
+# life of the process (which matters for the build daemon) and in
+# build_environment.json in the storage dir, see
+# Context.prepare_build_environment
+prepared_environments = {}
+
+BUILD_ENVIRONMENT_VERSION = 1
+MAX_PREPARED_ENVIRONMENTS = 16  # the number kept in build_environment.json
+
+
+def get_environment_stamps(sdk_dir, ndk_dir, path):
+    '''Returns the mtimes (None if missing) of the dirs whose contents
+    the results of prepare_build_environment depend on: the SDK and NDK
+    dirs that list the APIs and toolchains, the buildozer dir searched
+    for them and the dirs of the PATH that tools are looked for in.'''
+    dirs = [sdk_dir, join(sdk_dir, 'tools'), join(sdk_dir, 'platforms'),
+            ndk_dir, join(ndk_dir, 'toolchains'), join(ndk_dir, 'platforms'),
+            expanduser(join('~', '.buildozer', 'android', 'platform'))]
+    dirs += [directory for directory in path.split(':') if directory]
+    stamps = {}
+    for directory in dirs:
+        try:
+            stamps[directory] = getmtime(directory)
+        except OSError:
+            stamps[directory] = None
+    return stamps
+
 
 class Context(object):
     '''A build context. If anything will be built, an instance this class
@@ -45,6 +93,15 @@ class Context(object):
 
     recipe_build_order = None  # Will hold the list of all built recipes
 
+    jobs = 1  # the number of recipes that may be built at once
+    download_jobs = 4  # the number of downloads that may run at once
+    download_segments = 1  # the connections used for each large download
+    compile_jobs = 0  # the C files compiled at once, 0 for one per CPU
+
+    artifact_cache = None  # an ArtifactCache, if build outputs are cached
+
+    reprobe = False  # whether to check the SDK, NDK and tools again
+
     @property
     def packages_path(self):
         '''Where packages are downloaded before being unpacked'''
@@ -82,17 +139,23 @@ class Context(object):
         ensure_dir(dir)
         return dir
 
-    def get_python_install_dir(self):
-        dir = join(self.python_installs_dir, self.bootstrap.distribution.name)
-        return dir
+    def get_python_install_dir(self, arch=None):
+        '''The python-install dir for the given arch, defaulting to the
+        first arch being built. Each arch has its own python-install, so
+        that archs can be built at the same time.'''
+        if arch is None:
+            arch = self.archs[0]
+        dist_dir = join(self.python_installs_dir,
+                        self.bootstrap.distribution.name)
+        ensure_dir(dist_dir)
+        return join(dist_dir, arch.arch)
 
     def setup_dirs(self):
         '''Calculates all the storage and build dirs, and makes sure
         the directories exist where necessary.'''
         self.root_dir = realpath(dirname(__file__))
 
-        # AND: TODO: Allow the user to set the build_dir
-        self.storage_dir = user_data_dir('python-for-android')
+        self.storage_dir = get_storage_dir()
         self.build_dir = join(self.storage_dir, 'build')
         self.dist_dir = join(self.storage_dir, 'dists')
 
@@ -164,6 +227,86 @@ class Context(object):
         if self._build_env_prepared:
             return
 
+        # The results are reused for the same arguments, archs and
+        # environment variables, until any of the dirs they depend on
+        # changes, or --reprobe is given
+        path = environ.get('PATH', '')
+        key = json.dumps([user_sdk_dir, user_ndk_dir, user_android_api,
+                          user_ndk_ver, [arch.arch for arch in self.archs],
+                          [environ.get(name)
+                           for name in ENVIRONMENT_VARIABLES]])
+        prepared = None
+        if not self.reprobe:
+            prepared = self.get_prepared_environment(key, path)
+        if prepared is None:
+            self.probe_build_environment(user_sdk_dir, user_ndk_dir,
+                                         user_android_api, user_ndk_ver)
+            prepared = dict([(attribute, getattr(self, attribute))
+                             for attribute in PREPARED_ATTRIBUTES])
+            prepared['PATH'] = environ['PATH']
+            prepared['stamps'] = get_environment_stamps(
+                self.sdk_dir, self.ndk_dir, path)
+            prepared['time'] = time.time()
+            prepared_environments[key] = prepared
+            self.save_prepared_environments()
+        else:
+            for attribute in PREPARED_ATTRIBUTES:
+                setattr(self, attribute, prepared[attribute])
+            environ['PATH'] = prepared['PATH']
+            info('Using the Android SDK at {}, API {} and NDK at {} found '
+                 'earlier'.format(self.sdk_dir, self.android_api,
+                                  self.ndk_dir))
+        self._build_env_prepared = True
+
+    @property
+    def build_environment_filename(self):
+        return join(self.storage_dir, 'build_environment.json')
+
+    def get_prepared_environment(self, key, path):
+        '''Returns the results of prepare_build_environment for key, if
+        none of the dirs they depend on has changed since.'''
+        if key not in prepared_environments:
+            if not exists(self.build_environment_filename):
+                return None
+            try:
+                with open(self.build_environment_filename) as fileh:
+                    saved = json.load(fileh)
+            except ValueError:
+                return None
+            if saved.get('version') != BUILD_ENVIRONMENT_VERSION:
+                return None
+            for saved_key, prepared in saved['environments'].items():
+                prepared_environments.setdefault(saved_key, prepared)
+            if key not in prepared_environments:
+                return None
+        prepared = prepared_environments[key]
+        if prepared['stamps'] != get_environment_stamps(
+                prepared['_sdk_dir'], prepared['_ndk_dir'], path):
+            info('The SDK, NDK or PATH dirs have changed since they were '
+                 'last checked, checking them again')
+            return None
+        return prepared
+
+    def save_prepared_environments(self):
+        environments = sorted(prepared_environments.items(),
+                              key=lambda item: item[1]['time'])
+        environments = dict(environments[-MAX_PREPARED_ENVIRONMENTS:])
+        ensure_dir(self.storage_dir)
+        # Written to a temporary file first, so other processes never
+        # read a partial file
+        temp_filename = '{}.{}'.format(self.build_environment_filename,
+                                       getpid())
+        with open(temp_filename, 'w') as fileh:
+            json.dump({'version': BUILD_ENVIRONMENT_VERSION,
+                       'environments': environments},
+                      fileh, indent=1, sort_keys=True)
+        rename(temp_filename, self.build_environment_filename)
+
+    def probe_build_environment(self, user_sdk_dir, user_ndk_dir,
+                                user_android_api, user_ndk_ver):
+        '''Does the work of :meth:`prepare_build_environment`, finding
+        the SDK, NDK and tools and checking them.'''
+
         # AND: This needs revamping to carefully check each dependency
         # in turn
         ok = True
@@ -374,17 +517,28 @@ class Context(object):
 
         self.toolchain_prefix = toolchain_prefix
         self.toolchain_version = toolchain_version
-        # Modify the path so that sh finds modules appropriately
+        # Modify the path so that sh finds modules appropriately. The
+        # toolchains of all the archs being built are added, as the
+        # archs may be built at the same time.
+        toolchain_paths = ''
+        toolchain_prefixes = []
+        for other_arch in self.archs:
+            if other_arch.toolchain_prefix not in toolchain_prefixes:
+                toolchain_prefixes.append(other_arch.toolchain_prefix)
+        for prefix in toolchain_prefixes:
+            toolchain_paths += (
+                '{ndk_dir}/toolchains/{toolchain_prefix}-{toolchain_version}/'
+                'prebuilt/{py_platform}-x86/bin/:{ndk_dir}/toolchains/'
+                '{toolchain_prefix}-{toolchain_version}/prebuilt/'
+                '{py_platform}-x86_64/bin/:').format(
+                    ndk_dir=self.ndk_dir, toolchain_prefix=prefix,
+                    toolchain_version=toolchain_version,
+                    py_platform=py_platform)
         environ['PATH'] = (
-            '{ndk_dir}/toolchains/{toolchain_prefix}-{toolchain_version}/'
-            'prebuilt/{py_platform}-x86/bin/:{ndk_dir}/toolchains/'
-            '{toolchain_prefix}-{toolchain_version}/prebuilt/'
-            '{py_platform}-x86_64/bin/:{ndk_dir}:{sdk_dir}/'
-            'tools:{path}').format(
+            '{toolchain_paths}{ndk_dir}:{sdk_dir}/tools:{path}').format(
+                toolchain_paths=toolchain_paths,
                 sdk_dir=self.sdk_dir, ndk_dir=self.ndk_dir,
-                toolchain_prefix=toolchain_prefix,
-                toolchain_version=toolchain_version,
-                py_platform=py_platform, path=environ.get('PATH'))
+                path=environ.get('PATH'))
 
         for executable in ("pkg-config", "autoconf", "automake", "libtoolize",
                            "tar", "bzip2", "unzip", "make", "gcc", "g++"):
@@ -413,6 +567,9 @@ class Context(object):
 
         self.local_recipes = None
 
+        self.fingerprints = FingerprintStore(self)
+        self.recipe_index = RecipeIndex(self)
+
         # root of the toolchain
         self.setup_dirs()
 
@@ -432,6 +589,21 @@ class Context(object):
         self.env.pop("ARCHFLAGS", None)
         self.env.pop("CFLAGS", None)
 
+    def forget_shadowed_recipes(self):
+        '''Forgets the recipes loaded so far from other files than those
+        that would be loaded now, along with all the recipe metadata.
+        This is needed when the context is reused from another dir or
+        with other local recipes, as the build daemon does.'''
+        recipes = getattr(Recipe, 'recipes', {})
+        for name, recipe in list(recipes.items()):
+            recipe_file = self.recipe_index.get_recipe_file(name)
+            # Relative recipe dirs depend on the current dir
+            if (recipe_file is None or not isabs(recipe.recipe_dir) or
+                    realpath(recipe_file) !=
+                    realpath(join(recipe.recipe_dir, '__init__.py'))):
+                del recipes[name]
+        self.recipe_index.reset()
+
     def set_archs(self, arch_names):
         all_archs = self.archs
         new_archs = set()
@@ -458,13 +630,12 @@ class Context(object):
 
     def get_site_packages_dir(self, arch=None):
         '''Returns the location of site-packages in the python-install build
-        dir.
+        dir for the given arch.
         '''
 
         # AND: This *must* be replaced with something more general in
-        # order to support multiple python versions and/or multiple
-        # archs.
-        return join(self.get_python_install_dir(),
+        # order to support multiple python versions.
+        return join(self.get_python_install_dir(arch),
                     'lib', 'python2.7', 'site-packages')
 
     def get_libs_dir(self, arch):
@@ -503,55 +674,188 @@ def build_recipes(build_order, python_modules, ctx):
 
     recipes = [Recipe.get_recipe(name, ctx) for name in build_order]
 
-    # download is arch independent
-    info_main('# Downloading recipes ')
-    for recipe in recipes:
-        recipe.download_if_necessary()
+    with tracer.span('build_recipes', 'build'):
+        # download is arch independent
+        info_main('# Downloading recipes ')
+        download_recipes(recipes, ctx)
+
+        if ctx.jobs > 1 and len(ctx.archs) > 1:
+            info_main('# Building archs {} in parallel'.format(
+                ', '.join([arch.arch for arch in ctx.archs])))
+            scheduler = JobScheduler(
+                ctx, dict([(arch.arch, arch) for arch in ctx.archs]),
+                dict([(arch.arch, set()) for arch in ctx.archs]),
+                len(ctx.archs))
+            scheduler.run(
+                lambda arch: build_arch_recipes(recipes, arch, ctx))
+        else:
+            for arch in ctx.archs:
+                build_arch_recipes(recipes, arch, ctx)
 
-    for arch in ctx.archs:
-        info_main('# Building all recipes for arch {}'.format(arch.arch))
+        info_main('# Installing pure Python modules')
+        with tracer.span('pymodules_install', 'build'):
+            run_pymodules_install(ctx, python_modules)
 
+    log_strip_totals('the recipe builds')
+    return
+
+
+def build_arch_recipes(recipes, arch, ctx):
+    '''Runs the whole build pipeline of the recipes for a single arch.
+    This uses only per-arch build dirs, except for recipes whose build
+    dir is shared between archs, which are locked while used.'''
+    info_main('# Building all recipes for arch {}'.format(arch.arch))
+
+    ctx.fingerprints.compute(recipes, arch)
+    if ctx.artifact_cache is not None:
+        ctx.artifact_cache.compute_keys(recipes, arch)
+
+    if ctx.jobs > 1:
+        info_main('# Unpacking, prebuilding and building recipes')
+        scheduler = RecipeScheduler(ctx, recipes, ctx.jobs)
+        scheduler.run(lambda recipe: build_recipe(recipe, arch))
+    else:
         info_main('# Unpacking recipes')
         for recipe in recipes:
-            ensure_dir(recipe.get_build_container_dir(arch.arch))
-            recipe.prepare_build_dir(arch.arch)
+            unpack_recipe(recipe, arch)
 
         info_main('# Prebuilding recipes')
         # 2) prebuild packages
         for recipe in recipes:
-            info_main('Prebuilding {} for {}'.format(recipe.name, arch.arch))
-            recipe.prebuild_arch(arch)
-            recipe.apply_patches(arch)
+            prebuild_recipe(recipe, arch)
 
         # 3) build packages
         info_main('# Building recipes')
         for recipe in recipes:
-            info_main('Building {} for {}'.format(recipe.name, arch.arch))
-            if recipe.should_build(arch):
-                recipe.build_arch(arch)
-            else:
-                info('{} said it is already built, skipping'
-                     .format(recipe.name))
+            build_recipe_arch(recipe, arch)
 
-        # 4) biglink everything
-        # AND: Should make this optional
-        info_main('# Biglinking object files')
+    # 4) biglink everything
+    # AND: Should make this optional
+    info_main('# Biglinking object files')
+    with tracer.span('biglink', 'build', arch=arch.arch):
         biglink(ctx, arch)
 
-        # 5) postbuild packages
-        info_main('# Postbuilding recipes')
-        for recipe in recipes:
-            info_main('Postbuilding {} for {}'.format(recipe.name, arch.arch))
+    # 5) postbuild packages
+    info_main('# Postbuilding recipes')
+    for recipe in recipes:
+        info_main('Postbuilding {} for {}'.format(recipe.name, arch.arch))
+        with tracer.span('postbuild', 'recipe', recipe=recipe.name,
+                         arch=arch.arch):
             recipe.postbuild_arch(arch)
 
-    info_main('# Installing pure Python modules')
-    run_pymodules_install(ctx, python_modules)
 
-    return
+def download_recipes(recipes, ctx):
+    '''Downloads the given recipes if necessary, using at most
+    ctx.download_jobs connections at once.'''
+    ensure_dir(ctx.packages_path)
+    jobs = min(ctx.download_jobs, len(recipes))
+    if jobs <= 1:
+        for recipe in recipes:
+            download_recipe(recipe)
+        return
+
+    info('Downloading recipes with up to {} connections'.format(jobs))
+    queue = list(recipes)
+    queue_lock = threading.Lock()
+    failures = []
+
+    def download_worker():
+        while not failures:
+            with queue_lock:
+                if not queue:
+                    return
+                recipe = queue.pop(0)
+            try:
+                download_recipe(recipe)
+            except BaseException:
+                failures.append(sys.exc_info())
+
+    threads = [threading.Thread(target=download_worker)
+               for _ in range(jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        reraise(*failures[0])
+
+
+def download_recipe(recipe):
+    with tracer.span('download', 'recipe', recipe=recipe.name):
+        recipe.download_if_necessary()
+
+
+@contextlib.contextmanager
+def shared_build_dir_lock(recipe, arch):
+    '''Locks the build dir of the recipe while in the context if it is
+    shared between the archs being built (e.g. hostpython2, or the
+    bootstrap jni dir), as the archs may be built at the same time.'''
+    ctx = recipe.ctx
+    container_dir = recipe.get_build_container_dir(arch.arch)
+    if (len(ctx.archs) < 2 or
+        any([recipe.get_build_container_dir(other.arch) != container_dir
+             for other in ctx.archs])):
+        yield
+        return
+    ensure_dir(container_dir)
+    with file_lock(join(container_dir, '.p4a-lock')):
+        yield
+
+
+def unpack_recipe(recipe, arch):
+    fingerprints = recipe.ctx.fingerprints
+    with tracer.span('unpack', 'recipe', recipe=recipe.name,
+                     arch=arch.arch):
+        with shared_build_dir_lock(recipe, arch):
+            fingerprints.clean_stale_build_dir(recipe, arch)
+            ensure_dir(recipe.get_build_container_dir(arch.arch))
+            recipe.prepare_build_dir(arch.arch)
+            fingerprints.mark_build_dir(recipe, arch)
+
+
+def prebuild_recipe(recipe, arch):
+    info_main('Prebuilding {} for {}'.format(recipe.name, arch.arch))
+    with shared_build_dir_lock(recipe, arch):
+        with tracer.span('prebuild', 'recipe', recipe=recipe.name,
+                         arch=arch.arch):
+            recipe.prebuild_arch(arch)
+        with tracer.span('patch', 'recipe', recipe=recipe.name,
+                         arch=arch.arch):
+            recipe.apply_patches(arch)
+
+
+def build_recipe_arch(recipe, arch):
+    info_main('Building {} for {}'.format(recipe.name, arch.arch))
+    if not recipe.should_build(arch):
+        info('{} said it is already built, skipping'
+             .format(recipe.name))
+        return
+
+    artifact_cache = recipe.ctx.artifact_cache
+    with tracer.span('build', 'recipe', recipe=recipe.name,
+                     arch=arch.arch):
+        with shared_build_dir_lock(recipe, arch):
+            if artifact_cache is None:
+                recipe.build_arch(arch)
+            elif not artifact_cache.restore(recipe, arch):
+                with artifact_cache.record(recipe, arch):
+                    recipe.build_arch(arch)
+            recipe.ctx.fingerprints.mark_build(recipe, arch)
+    recipe.ctx.fingerprints.record(recipe, arch)
+
+
+def build_recipe(recipe, arch):
+    '''Unpacks, prebuilds and builds a single recipe. This is the job run
+    for each recipe when building with more than one job.'''
+    unpack_recipe(recipe, arch)
+    prebuild_recipe(recipe, arch)
+    build_recipe_arch(recipe, arch)
 
 
 def run_pymodules_install(ctx, modules):
-    modules = filter(ctx.not_has_package, modules)
+    modules = [module for module in modules
+               if any([ctx.not_has_package(module, arch)
+                       for arch in ctx.archs])]
 
     if not modules:
         info('There are no Python modules to install, skipping')
@@ -578,17 +882,18 @@ def run_pymodules_install(ctx, modules):
 
         # This bash method is what old-p4a used
         # It works but should be replaced with something better
-        shprint(sh.bash, '-c', (
-            "source venv/bin/activate && env CC=/bin/false CXX=/bin/false "
-            "PYTHONPATH={0} pip install --target '{0}' -r requirements.txt"
-        ).format(ctx.get_site_packages_dir()))
+        for arch in ctx.archs:
+            shprint(sh.bash, '-c', (
+                "source venv/bin/activate && env CC=/bin/false CXX=/bin/false "
+                "PYTHONPATH={0} pip install --target '{0}' -r requirements.txt"
+            ).format(ctx.get_site_packages_dir(arch)))
 
 
 def biglink(ctx, arch):
-    # First, collate object files from each recipe
-    info('Collating object files from each recipe')
-    obj_dir = join(ctx.bootstrap.build_dir, 'collated_objects')
-    ensure_dir(obj_dir)
+    # The object files are linked straight from the objects dir of each
+    # recipe
+    info('Finding the object files of each recipe')
+    objs_paths = []
     recipes = [Recipe.get_recipe(name, ctx) for name in ctx.recipe_build_order]
     for recipe in recipes:
         recipe_obj_dir = join(recipe.get_build_container_dir(arch.arch),
@@ -597,19 +902,18 @@ def biglink(ctx, arch):
             info('{} recipe has no biglinkable files dir, skipping'
                  .format(recipe.name))
             continue
-        files = glob.glob(join(recipe_obj_dir, '*'))
-        if not len(files):
+        if not os.listdir(recipe_obj_dir):
             info('{} recipe has no biglinkable files, skipping'
                  .format(recipe.name))
-        info('{} recipe has object files, copying'.format(recipe.name))
-        files.append(obj_dir)
-        shprint(sh.cp, '-r', *files)
+            continue
+        info('{} recipe has object files'.format(recipe.name))
+        objs_paths.append(recipe_obj_dir)
 
     env = arch.get_env()
     env['LDFLAGS'] = env['LDFLAGS'] + ' -L{}'.format(
         join(ctx.bootstrap.build_dir, 'obj', 'local', arch.arch))
 
-    if not len(glob.glob(join(obj_dir, '*'))):
+    if not objs_paths:
         info('There seem to be no libraries to biglink, skipping.')
         return
     info('Biglinking')
@@ -617,46 +921,79 @@ def biglink(ctx, arch):
                                  'libpymodules.so')))
     biglink_function(
         join(ctx.get_libs_dir(arch.arch), 'libpymodules.so'),
-        obj_dir.split(' '),
+        objs_paths,
         extra_link_dirs=[join(ctx.bootstrap.build_dir,
                               'obj', 'local', arch.arch)],
-        env=env)
+        env=env,
+        work_dir=join(ctx.bootstrap.build_dir, 'biglink', arch.arch))
 
 
-def biglink_function(soname, objs_paths, extra_link_dirs=[], env=None):
-    print('objs_paths are', objs_paths)
-    sofiles = []
+# Link commands whose arguments are longer than this are passed a
+# response file instead
+MAX_ARGUMENTS_LENGTH = 32768
 
-    for directory in objs_paths:
-        for fn in os.listdir(directory):
-            fn = os.path.join(directory, fn)
 
+def unique_last(args):
+    '''Returns args without duplicates, keeping the last occurrence of
+    each (so libraries stay after everything that uses them).'''
+    seen = set()
+    unique_args = []
+    for arg in reversed(args):
+        if arg not in seen:
+            seen.add(arg)
+            unique_args.append(arg)
+    unique_args.reverse()
+    return unique_args
+
+
+def write_response_file(filename, args):
+    '''Writes args to filename, to be passed to gcc as @filename.'''
+    with open(filename, 'w') as fileh:
+        for arg in args:
+            fileh.write(re.sub(r'([\s\\\'"])', r'\\\1', arg) + '\n')
+
+
+def _hash_file(filename):
+    file_hash = hashlib.sha1()
+    with open(filename, 'rb') as fileh:
+        for block in iter(lambda: fileh.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def biglink_function(soname, objs_paths, extra_link_dirs=[], env=None,
+                     work_dir=None):
+    '''Links the objects left by liblink in the dirs objs_paths into the
+    shared library soname. If work_dir is given, the response file and
+    a record of the inputs are kept there, and the link is skipped if
+    the inputs have not changed since the last one.'''
+    print('objs_paths are', objs_paths)
+    # Objects of the same name in later dirs replace those of earlier
+    # ones, as when the dirs were all copied into one
+    sofiles = {}  # object filename -> path without the .o
+    for directory in objs_paths:
+        for fn in sorted(os.listdir(directory)):
             if not fn.endswith(".so.o"):
                 continue
-            if not os.path.exists(fn[:-2] + ".libs"):
+            path = os.path.join(directory, fn)
+            if not os.path.exists(path[:-2] + ".libs"):
                 continue
-
-            sofiles.append(fn[:-2])
+            sofiles[fn] = path[:-2]
 
     # The raw argument list.
     args = []
 
-    for fn in sofiles:
-        afn = fn + ".o"
-        libsfn = fn + ".libs"
+    for fn in sorted(sofiles):
+        afn = sofiles[fn] + ".o"
+        libsfn = sofiles[fn] + ".libs"
 
         args.append(afn)
         with open(libsfn) as fd:
             data = fd.read()
-            args.extend(data.split(" "))
+            args.extend(data.split())
 
-    unique_args = []
-    while args:
-        a = args.pop()
-        if a in ('-L', ):
-            continue
-        if a not in unique_args:
-            unique_args.insert(0, a)
+    unique_args = unique_last([arg for arg in args
+                               if arg and arg not in ('-L', )])
 
     for dir in extra_link_dirs:
         link = '-L{}'.format(dir)
@@ -667,4 +1004,38 @@ def biglink_function(soname, objs_paths, extra_link_dirs=[], env=None):
     cc = sh.Command(cc_name.split()[0])
     cc = cc.bake(*cc_name.split()[1:])
 
-    shprint(cc, '-shared', '-O3', '-o', soname, *unique_args, _env=env)
+    if work_dir is None:
+        shprint(cc, '-shared', '-O3', '-o', soname, *unique_args, _env=env)
+        return
+
+    ensure_dir(work_dir)
+    inputs = {'command': cc_name.split() + ['-shared', '-O3', '-o', soname] +
+              unique_args,
+              'objects': dict([(sofiles[fn] + '.o', _hash_file(
+                  sofiles[fn] + '.o')) for fn in sofiles])}
+    inputs_filename = join(work_dir, basename(soname) + '.inputs')
+    if exists(soname) and exists(inputs_filename):
+        with open(inputs_filename) as fileh:
+            try:
+                old_inputs = json.load(fileh)
+            except ValueError:
+                old_inputs = None
+        if old_inputs == inputs:
+            info('The objects to biglink are unchanged, keeping {}'
+                 .format(soname))
+            return
+    if exists(inputs_filename):
+        os.unlink(inputs_filename)
+
+    if len(' '.join(unique_args)) > MAX_ARGUMENTS_LENGTH:
+        response_filename = join(work_dir, basename(soname) + '.args')
+        write_response_file(response_filename, unique_args)
+        info('Passing {} link arguments in {}'.format(
+            len(unique_args), response_filename))
+        shprint(cc, '-shared', '-O3', '-o', soname,
+                '@' + response_filename, _env=env)
+    else:
+        shprint(cc, '-shared', '-O3', '-o', soname, *unique_args, _env=env)
+
+    with open(inputs_filename, 'w') as fileh:
+        json.dump(inputs, fileh)
@@ -0,0 +1,222 @@
+'''Cythonizes the .pyx files of a recipe's build dir in parallel,
+caching what cython generates.
+
+The output of cython for a .pyx file only depends on the file, on the
+.pxd and .pxi files it may cimport or include, and on cython itself,
+so it is cached under a key made by hashing the contents of these (all
+the .pxd and .pxi files of the tree are hashed, rather than working out
+which ones each file uses) and the cython version. Cython is run from
+the top of the build dir with relative paths, so that what it
+generates is the same whichever dir (e.g. arch) the tree is in, and
+building a recipe again for another arch or dist finds everything in
+the cache.
+
+The cache is kept in ``cython_cache`` in the storage dir.
+'''
+
+from os.path import join, exists, relpath, splitext, realpath
+from os import walk, stat, rename, makedirs, getpid
+from multiprocessing import cpu_count
+import hashlib
+import shutil
+import subprocess
+import sys
+import threading
+
+from six import reraise
+
+from pythonforandroid.logger import info, debug, warning
+from pythonforandroid.tracing import tracer
+
+CYTHON_CACHE_VERSION = 1
+
+# The files cython may write for a .pyx file, after its name without
+# the extension
+OUTPUT_SUFFIXES = ('.c', '.cpp', '.h', '_api.h')
+
+# The output of cython --version, by cython executable
+_cython_versions = {}
+
+
+def get_cython_version(cython):
+    if cython not in _cython_versions:
+        # Older versions of cython print this to stderr
+        process = subprocess.Popen([cython, '--version'],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        _cython_versions[cython] = output.decode('utf-8', 'replace').strip()
+    return _cython_versions[cython]
+
+
+def _hash_file(filename):
+    file_hash = hashlib.sha1()
+    with open(filename, 'rb') as fileh:
+        for block in iter(lambda: fileh.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def find_cython_sources(directory):
+    '''Returns the paths (relative to directory) of the .pyx files, and
+    of the .pxd and .pxi files, in directory.'''
+    sources = []
+    includes = []
+    for root, dirnames, filenames in walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            extension = splitext(filename)[1].lower()
+            if extension == '.pyx':
+                sources.append(relpath(join(root, filename), directory))
+            elif extension in ('.pxd', '.pxi'):
+                includes.append(relpath(join(root, filename), directory))
+    return sources, includes
+
+
+def _get_outputs_state(filename):
+    state = {}
+    base = splitext(filename)[0]
+    for suffix in OUTPUT_SUFFIXES:
+        if exists(base + suffix):
+            file_stat = stat(base + suffix)
+            state[base + suffix] = (file_stat.st_size, file_stat.st_mtime)
+    return state
+
+
+class CythonCache(object):
+    '''The files generated by cython, by key, see the module
+    docstring.'''
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    @property
+    def cache_dir(self):
+        return join(self.ctx.storage_dir, 'cython_cache')
+
+    def get_keys(self, directory, sources, includes, cython):
+        '''Returns the key of each of the sources.'''
+        common = hashlib.sha1()
+        common.update('{}\n{}\n{}\n'.format(
+            CYTHON_CACHE_VERSION, realpath(cython),
+            get_cython_version(cython)).encode('utf-8'))
+        for filename in includes:
+            common.update('{}\n{}\n'.format(
+                filename, _hash_file(join(directory, filename))).encode(
+                    'utf-8'))
+        keys = {}
+        for filename in sources:
+            key = common.copy()
+            key.update('{}\n{}\n'.format(
+                filename, _hash_file(join(directory, filename))).encode(
+                    'utf-8'))
+            keys[filename] = key.hexdigest()
+        return keys
+
+    def restore(self, key, filename):
+        '''Copies the cached outputs for key next to filename, returning
+        whether there were any.'''
+        entry_dir = join(self.cache_dir, key)
+        if not exists(entry_dir):
+            return False
+        base = splitext(filename)[0]
+        for suffix in OUTPUT_SUFFIXES:
+            cached = join(entry_dir, 'output' + suffix)
+            if exists(cached):
+                # Not copy2, the outputs must look newer than the .pyx
+                shutil.copyfile(cached, base + suffix)
+        return True
+
+    def store(self, key, outputs):
+        '''Stores the outputs (filenames next to the .pyx file) for
+        key.'''
+        entry_dir = join(self.cache_dir, key)
+        if exists(entry_dir):
+            return
+        # The entry is assembled in a temporary dir and renamed into
+        # place, so other processes never see a partial entry
+        temp_dir = '{}.{}.{}'.format(entry_dir, getpid(),
+                                     threading.current_thread().ident)
+        makedirs(temp_dir)
+        for output, suffix in outputs:
+            shutil.copyfile(output, join(temp_dir, 'output' + suffix))
+        try:
+            rename(temp_dir, entry_dir)
+        except OSError:
+            # Stored by another process meanwhile
+            shutil.rmtree(temp_dir)
+
+
+def run_cython(cython, directory, filename, env):
+    '''Runs cython on filename (relative to directory), returning the
+    outputs it wrote as (filename, suffix) pairs, or None if it
+    failed.'''
+    path = join(directory, filename)
+    before = _get_outputs_state(path)
+    process = subprocess.Popen([cython, filename], cwd=directory, env=env,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output = process.communicate()[0].decode('utf-8', 'replace')
+    if process.returncode != 0:
+        warning('Cython failed for {}:\n{}'.format(filename, output))
+        return None
+    if output.strip():
+        debug(output.rstrip())
+    after = _get_outputs_state(path)
+    base = splitext(path)[0]
+    return [(name, name[len(base):]) for name in sorted(after)
+            if before.get(name) != after[name]]
+
+
+def cythonize_tree(ctx, directory, env, jobs=None):
+    '''Cythonizes every .pyx file in directory, using up to jobs cython
+    processes at once (by default, one per CPU) and the cache of
+    generated files. Files cython fails on are only warned about, as
+    some .pyx files of a tree may not be used by its build.'''
+    cython = str(ctx.cython).strip()
+    sources, includes = find_cython_sources(directory)
+    if not sources:
+        info('No .pyx files to cythonize')
+        return
+
+    cache = CythonCache(ctx)
+    keys = cache.get_keys(directory, sources, includes, cython)
+    queue = [filename for filename in sources
+             if not cache.restore(keys[filename], join(directory, filename))]
+    if len(queue) < len(sources):
+        tracer.count('cython cache hit', len(sources) - len(queue))
+    info('Cythonizing {} of {} .pyx files ({} were cached)'.format(
+        len(queue), len(sources), len(sources) - len(queue)))
+    if not queue:
+        return
+
+    if jobs is None:
+        jobs = cpu_count()
+    jobs = max(1, min(jobs, len(queue)))
+    runs = len(queue)
+    queue_lock = threading.Lock()
+    failures = []
+
+    def cython_worker():
+        while not failures:
+            with queue_lock:
+                if not queue:
+                    return
+                filename = queue.pop(0)
+            try:
+                debug('Cythonizing {}'.format(filename))
+                outputs = run_cython(cython, directory, filename, env)
+                if outputs:
+                    cache.store(keys[filename], outputs)
+            except BaseException:
+                failures.append(sys.exc_info())
+
+    threads = [threading.Thread(target=cython_worker)
+               for _ in range(jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    tracer.count('cython run', runs - len(queue))
+    if failures:
+        reraise(*failures[0])
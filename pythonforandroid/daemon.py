@@ -0,0 +1,460 @@
+'''A build daemon, run with ``p4a daemon``, which keeps the build
+machinery loaded between commands: a build context with every recipe
+and bootstrap imported, the results of
+:meth:`~pythonforandroid.build.Context.prepare_build_environment` and
+the info of every dist.
+
+While it runs, other p4a commands connect to it over a Unix socket in
+the storage dir and pass it their arguments, current dir, environment
+and standard streams (as file descriptors), then only wait for the exit
+status. Each command runs in a forked copy of the daemon, so commands
+cannot affect each other or the loaded state, and runs exactly as it
+would by itself, writing straight to the terminal of its client. When
+it finishes, the environments it prepared are sent back to the daemon
+so that later commands reuse them.
+
+Before each command, the recipes whose ``__init__.py`` changed (by
+mtime or size) since the daemon loaded them are loaded again, so that
+editing a recipe doesn't need a restart of the daemon. Other modules
+the recipes import are not checked.
+
+Passing file descriptors needs Python 3.3 or later; on older Pythons
+the commands always run by themselves. Setting P4A_NO_DAEMON=1 also
+runs a command by itself.
+'''
+
+from __future__ import print_function
+
+from os.path import join, exists, dirname
+import array
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import time
+import traceback
+
+from pythonforandroid.logger import info, warning
+from pythonforandroid.util import get_storage_dir, ensure_dir
+
+# Each message is a JSON object, preceded by its length
+HEADER = struct.Struct('!I')
+
+# The file descriptors passed by clients: stdin, stdout and stderr
+CLIENT_FDS = (0, 1, 2)
+
+
+def get_socket_path():
+    return join(get_storage_dir(), 'daemon.sock')
+
+
+def _get_file_state(filename):
+    try:
+        file_stat = os.stat(filename)
+    except OSError:
+        return None
+    return (file_stat.st_mtime, file_stat.st_size)
+
+
+def can_pass_fds():
+    return (hasattr(socket.socket, 'sendmsg') and
+            hasattr(socket, 'SCM_RIGHTS'))
+
+
+def _send_message(sock, message, fds=()):
+    data = json.dumps(message).encode('utf-8')
+    header = HEADER.pack(len(data))
+    if fds:
+        sock.sendmsg([header], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                 array.array('i', fds))])
+    else:
+        sock.sendall(header)
+    sock.sendall(data)
+
+
+def _recv_exactly(sock, size, data=b''):
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError('Connection closed')
+        data += chunk
+    return data
+
+
+def _recv_message(sock, max_fds=0):
+    '''Returns a message and the file descriptors passed with it.'''
+    fds = []
+    if max_fds:
+        fds_array = array.array('i')
+        header, ancdata, flags, address = sock.recvmsg(
+            HEADER.size, socket.CMSG_LEN(max_fds * fds_array.itemsize))
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds_array.frombytes(
+                    data[:len(data) - len(data) % fds_array.itemsize])
+        fds = list(fds_array)
+        if not header:
+            raise EOFError('Connection closed')
+    else:
+        header = b''
+    header = _recv_exactly(sock, HEADER.size, header)
+    length = HEADER.unpack(header)[0]
+    message = json.loads(_recv_exactly(sock, length).decode('utf-8'))
+    return message, fds
+
+
+def connect():
+    '''Returns a socket connected to the running daemon, or None if there
+    is no daemon running.'''
+    if not can_pass_fds():
+        return None
+    socket_path = get_socket_path()
+    if not exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def send_control(request):
+    '''Sends a request ('status' or 'stop') to the running daemon, and
+    returns its reply, or None if there is no daemon running.'''
+    sock = connect()
+    if sock is None:
+        return None
+    try:
+        _send_message(sock, {'request': request})
+        return _recv_message(sock)[0]
+    finally:
+        sock.close()
+
+
+def run_client(argv):
+    '''Runs the p4a command with the arguments argv in the running daemon,
+    and returns its exit status, or None if there is no daemon running
+    (or P4A_NO_DAEMON is set), in which case the command should be run
+    as usual.'''
+    if os.environ.get('P4A_NO_DAEMON'):
+        return None
+    sock = connect()
+    if sock is None:
+        return None
+    try:
+        _send_message(sock, {'request': 'run',
+                             'argv': argv,
+                             'cwd': os.getcwd(),
+                             'environ': dict(os.environ)},
+                      CLIENT_FDS)
+        # The command writes to our streams itself, and closing the
+        # connection (e.g. on Ctrl-C) stops it
+        return _recv_message(sock)[0]['status']
+    except EOFError:
+        warning('The build daemon stopped before the command finished')
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        sock.close()
+
+
+def _run_command(ctx, request, fds, state_fd):
+    '''Runs the command of request with the loaded context ctx, in a
+    forked daemon. Returns its exit status.'''
+    # In its own process group, so that it can be stopped along with
+    # every process it started
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    for target, fd in zip(CLIENT_FDS, fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['environ'])
+    sys.argv = ['p4a'] + request['argv']
+
+    status = 0
+    try:
+        from pythonforandroid.toolchain import ToolchainCL
+        ToolchainCL(ctx)
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    from pythonforandroid import build
+    state = json.dumps({'environments': build.prepared_environments})
+    state = state.encode('utf-8')
+    while state:
+        state = state[os.write(state_fd, state):]
+    return status
+
+
+class Command(object):
+    '''A command being run by the daemon, in the process pid.'''
+
+    def __init__(self, connection, argv, pid, state_fd):
+        self.connection = connection
+        self.argv = argv
+        self.pid = pid
+        self.state_fd = state_fd
+        self.state = b''
+        self.client_gone = False
+
+    def stop(self):
+        try:
+            os.killpg(self.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+class BuildDaemon(object):
+    '''The build daemon, see the module docstring.'''
+
+    def __init__(self):
+        self.socket_path = get_socket_path()
+        self.listener = None
+        self.ctx = None
+        self.recipe_files = {}  # recipe name -> (file, state when loaded)
+        self.started = time.time()
+        self.requests = 0
+        self.commands = []
+        self.stopping = False
+
+    def listen(self):
+        ensure_dir(dirname(self.socket_path))
+        if exists(self.socket_path):
+            sock = connect()
+            if sock is not None:
+                sock.close()
+                warning('A build daemon is already running, exiting.')
+                exit(1)
+            os.unlink(self.socket_path)  # left by a daemon that died
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self.listener.listen(16)
+
+    def warm_up(self):
+        '''Loads everything that commands would otherwise load each
+        time.'''
+        from pythonforandroid.build import Context
+        from pythonforandroid.bootstrap import Bootstrap
+        from pythonforandroid.distribution import Distribution
+        from pythonforandroid.recipeindex import list_recipes
+        info('Loading the recipes and bootstraps')
+        self.ctx = Context()
+        for name in sorted(set(list_recipes(self.ctx))):
+            self.load_recipe(name)
+        for name in Bootstrap.list_bootstraps():
+            Bootstrap.get_bootstrap(name, self.ctx)
+        Distribution.get_distributions(self.ctx)
+
+    def load_recipe(self, name):
+        from pythonforandroid.recipe import Recipe
+        recipe_file = self.ctx.recipe_index.get_recipe_file(name)
+        if recipe_file is None:
+            return
+        # Taken before importing, so that an edit made meanwhile is
+        # seen by the next command
+        state = _get_file_state(recipe_file)
+        try:
+            Recipe.get_recipe(name, self.ctx)
+            self.ctx.recipe_index.get(name)
+        except Exception:
+            warning('Could not load recipe {}, commands will load it '
+                    'themselves'.format(name))
+            return
+        self.recipe_files[name] = (recipe_file, state)
+
+    def reload_changed_recipes(self):
+        '''Loads again the recipes whose files changed since they were
+        loaded, so that commands don't build them with the old code.'''
+        from pythonforandroid.recipe import Recipe
+        changed = [name for name, (recipe_file, state)
+                   in sorted(self.recipe_files.items())
+                   if _get_file_state(recipe_file) != state]
+        if not changed:
+            return
+        recipes = getattr(Recipe, 'recipes', {})
+        for name in changed:
+            info('Recipe {} changed, loading it again'.format(name))
+            recipes.pop(name, None)
+            del self.recipe_files[name]
+        self.ctx.recipe_index.reset()
+        for name in changed:
+            self.load_recipe(name)
+
+    def get_status(self):
+        from pythonforandroid.recipe import Recipe
+        from pythonforandroid.distribution import Distribution
+        from pythonforandroid import build
+        return {'pid': os.getpid(),
+                'uptime': time.time() - self.started,
+                'requests': self.requests,
+                'running': [command.argv for command in self.commands],
+                'recipes': len(getattr(Recipe, 'recipes', {})),
+                'environments': len(build.prepared_environments),
+                'dists': len(Distribution.get_distributions(self.ctx))}
+
+    def serve_forever(self):
+        if not can_pass_fds():
+            warning('The build daemon needs Python 3.3 or later, exiting.')
+            exit(1)
+        self.listen()
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        try:
+            # Commands sent while loading wait for it, rather than
+            # loading everything themselves
+            self.warm_up()
+            info('Build daemon running, listening on {}'.format(
+                self.socket_path))
+            while self.commands or not self.stopping:
+                if self.stopping and self.listener is not None:
+                    info('Waiting for {} commands to finish'.format(
+                        len(self.commands)))
+                    self.close_listener()
+                self.poll()
+        finally:
+            for command in self.commands:
+                command.stop()
+            self.close_listener()
+        info('Build daemon stopped')
+
+    def handle_signal(self, signum, frame):
+        self.stopping = True
+
+    def close_listener(self):
+        if self.listener is None:
+            return
+        self.listener.close()
+        self.listener = None
+        if exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def poll(self):
+        readers = [command.connection for command in self.commands
+                   if not command.client_gone]
+        readers += [command.state_fd for command in self.commands]
+        if self.listener is not None:
+            readers.append(self.listener)
+        try:
+            readable = select.select(readers, [], [], 0.5)[0]
+        except select.error:
+            readable = []  # interrupted by a signal
+        for reader in readable:
+            if reader is self.listener:
+                self.accept()
+                continue
+            for command in self.commands:
+                if reader is command.connection:
+                    # Clients send nothing more, so this means the
+                    # client has gone
+                    if not command.connection.recv(1024):
+                        info('Client of {} has gone, stopping it'.format(
+                            command.pid))
+                        command.client_gone = True
+                        command.stop()
+                elif reader == command.state_fd:
+                    command.state += os.read(command.state_fd, 65536)
+        self.reap()
+
+    def accept(self):
+        connection = self.listener.accept()[0]
+        fds = []
+        try:
+            connection.settimeout(5)
+            request, fds = _recv_message(connection, len(CLIENT_FDS))
+            connection.settimeout(None)
+            if request['request'] == 'status':
+                _send_message(connection, self.get_status())
+            elif request['request'] == 'stop':
+                _send_message(connection, {'stopping': True})
+                self.stopping = True
+            elif (request['request'] == 'run' and
+                    len(fds) == len(CLIENT_FDS)):
+                self.start_command(connection, request, fds)
+                return
+        except (EOFError, ValueError, KeyError, socket.error) as e:
+            warning('Invalid request to the build daemon: {}'.format(e))
+        finally:
+            for fd in fds:
+                os.close(fd)
+        connection.close()
+
+    def start_command(self, connection, request, fds):
+        from pythonforandroid.distribution import Distribution
+        # Reads the info of any new dists, so commands don't have to
+        Distribution.get_distributions(self.ctx)
+        self.reload_changed_recipes()
+        state_read_fd, state_write_fd = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(state_read_fd)
+                self.listener.close()
+                for command in self.commands:
+                    command.connection.close()
+                    os.close(command.state_fd)
+                status = _run_command(self.ctx, request, fds, state_write_fd)
+            finally:
+                os._exit(status)
+        try:
+            os.setpgid(pid, pid)  # also done by the child, whichever is first
+        except OSError:
+            pass
+        os.close(state_write_fd)
+        self.requests += 1
+        self.commands.append(Command(connection, request['argv'], pid,
+                                     state_read_fd))
+        info('Running p4a {} (pid {})'.format(' '.join(request['argv']),
+                                              pid))
+
+    def reap(self):
+        from pythonforandroid import build
+        for command in list(self.commands):
+            pid, status = os.waitpid(command.pid, os.WNOHANG)
+            if pid == 0:
+                continue
+            self.commands.remove(command)
+            while True:
+                data = os.read(command.state_fd, 65536)
+                if not data:
+                    break
+                command.state += data
+            os.close(command.state_fd)
+            if command.state:
+                state = json.loads(command.state.decode('utf-8'))
+                build.prepared_environments.update(state['environments'])
+
+            if os.WIFEXITED(status):
+                status = os.WEXITSTATUS(status)
+            else:
+                status = 128 + os.WTERMSIG(status)
+            info('p4a {} (pid {}) finished with status {}'.format(
+                ' '.join(command.argv), command.pid, status))
+            try:
+                _send_message(command.connection, {'status': status})
+            except socket.error:
+                pass
+            command.connection.close()
@@ -1,4 +1,4 @@
-from os.path import exists, join
+from os.path import exists, join, getmtime
 import glob
 import json
 
@@ -6,6 +6,19 @@ from pythonforandroid.logger import (info, info_notify, warning,
                                      Err_Style, Err_Fore)
 from pythonforandroid.util import current_directory
 
+# The dist_info.json files read so far, as (mtime, info) by filename, so
+# that a long running process (the build daemon) only reads each dist's
+# info again when it changes
+_dist_infos = {}
+
+
+def _load_dist_info(filename):
+    mtime = getmtime(filename)
+    if filename not in _dist_infos or _dist_infos[filename][0] != mtime:
+        with open(filename) as fileh:
+            _dist_infos[filename] = (mtime, json.load(fileh))
+    return _dist_infos[filename][1]
+
 
 class Distribution(object):
     '''State container for information about a distribution (i.e. an
@@ -179,8 +192,7 @@ class Distribution(object):
         dists = []
         for folder in folders:
             if exists(join(folder, 'dist_info.json')):
-                with open(join(folder, 'dist_info.json')) as fileh:
-                    dist_info = json.load(fileh)
+                dist_info = _load_dist_info(join(folder, 'dist_info.json'))
                 dist = cls(ctx)
                 dist.name = folder.split('/')[-1]
                 dist.dist_dir = folder
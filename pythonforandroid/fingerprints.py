@@ -0,0 +1,297 @@
+'''Fingerprints of the inputs of recipe builds.
+
+A fingerprint is recorded for each recipe after it has been built
+successfully, and :meth:`~pythonforandroid.recipe.Recipe.should_build`
+compares it with the fingerprint of the current inputs to decide
+whether the recipe needs building again. A fingerprint is made from:
+
+- the recipe files (the recipe module, patches and anything else in
+  the recipe dir), along with its version and url,
+- the state of the source (the downloaded archive or git checkout, or
+  the dir given with P4A_<name>_DIR),
+- the variables of the build environment returned by the recipe's
+  ``get_recipe_env`` that affect what is built (the compilers, tools
+  and flags in BUILD_ENV_VARIABLES, not e.g. PATH or HOME), along with
+  the arch, Android API and NDK version,
+- the fingerprints of the recipes it depends on.
+
+Fingerprints are stored per distribution and arch, as many recipes
+install their outputs into the dist's own python-install and libs
+dirs.
+
+Build dirs are also marked with the recipe and source they were
+unpacked from, and are unpacked again if either changes, as patches
+are only applied to a freshly unpacked source. The build dirs of
+recipes setting ``clean_build_on_change`` (such as python2, which
+always runs its build but only compiles if nothing was compiled before)
+are also marked, per arch, with the build environment and dependencies
+they were built with, and are unpacked again if these change.
+'''
+
+from os.path import join, exists, isdir, isfile, dirname, relpath
+from os import environ, walk, lstat
+import hashlib
+import json
+import shutil
+
+from pythonforandroid.logger import info
+from pythonforandroid.util import ensure_dir
+from pythonforandroid.scheduler import get_recipe_dependencies
+
+
+# The variables of the build environment that affect what is built
+BUILD_ENV_VARIABLES = (
+    'CC', 'CXX', 'CPP', 'LD', 'LDSHARED', 'AR', 'RANLIB', 'STRIP',
+    'READELF', 'NM', 'CFLAGS', 'CPPFLAGS', 'CXXFLAGS', 'LDFLAGS', 'LIBS',
+    'LDLIBS', 'ARCH', 'NDKPLATFORM', 'TOOLCHAIN_PREFIX', 'TOOLCHAIN_VERSION')
+
+
+def get_build_env(env):
+    '''Returns the variables of env in BUILD_ENV_VARIABLES.'''
+    return dict([(name, env[name]) for name in BUILD_ENV_VARIABLES
+                 if name in env])
+
+
+def _hash_data(data):
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def hash_recipe_dir(recipe):
+    '''Returns a hash of the contents of every file in the recipe dir.'''
+    recipe_hash = hashlib.sha1()
+    filenames = []
+    for root, dirnames, files in walk(recipe.recipe_dir):
+        dirnames[:] = sorted([dirname for dirname in dirnames
+                              if dirname != '__pycache__'])
+        filenames.extend([join(root, filename) for filename in files
+                          if not filename.endswith(('.pyc', '.pyo'))])
+    for filename in sorted(filenames):
+        recipe_hash.update(relpath(filename, recipe.recipe_dir)
+                           .encode('utf-8'))
+        with open(filename, 'rb') as fileh:
+            recipe_hash.update(fileh.read())
+    return recipe_hash.hexdigest()
+
+
+def get_dir_state(directory):
+    '''Returns a cheap summary of the state of a source dir: the current
+    commit for a git checkout, or otherwise the size and mtime of
+    every file.'''
+    git_head = join(directory, '.git', 'HEAD')
+    if isfile(git_head):
+        with open(git_head) as fileh:
+            head = fileh.read().strip()
+        if head.startswith('ref: '):
+            ref_filename = join(directory, '.git', head[5:])
+            if isfile(ref_filename):
+                with open(ref_filename) as fileh:
+                    head = fileh.read().strip()
+        return head
+    files = []
+    for root, dirnames, filenames in walk(directory):
+        dirnames[:] = sorted(dirnames)
+        for filename in sorted(filenames):
+            path = join(root, filename)
+            stat = lstat(path)
+            files.append([relpath(path, directory), stat.st_size,
+                          stat.st_mtime])
+    return _hash_data(files)
+
+
+def get_source_state(recipe):
+    '''Returns a summary of the state of the recipe source, changing if
+    the source is downloaded again or a local source dir is modified.'''
+    user_dir = environ.get('P4A_{}_DIR'.format(recipe.name.lower()))
+    if user_dir is not None:
+        return ['user_dir', user_dir, get_dir_state(user_dir)]
+    url = recipe.versioned_url
+    if url is None:
+        return None
+    filename = join(recipe.ctx.packages_path, recipe.name,
+                    url.rstrip('/').split('/')[-1])
+    if isdir(filename):
+        return ['dir', get_dir_state(filename)]
+    if isfile(filename):
+        stat = lstat(filename)
+        return ['file', stat.st_size, stat.st_mtime]
+    return None
+
+
+class FingerprintStore(object):
+    '''Computes the fingerprints of recipe builds, and records them once
+    the builds have succeeded.'''
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.fingerprints = {}  # (recipe name, arch name) -> fingerprint
+
+    def get_fingerprint_filename(self, recipe, arch):
+        return join(self.ctx.build_dir, 'fingerprints',
+                    self.ctx.bootstrap.distribution.name, arch.arch,
+                    '{}.json'.format(recipe.name))
+
+    def compute(self, recipes, arch):
+        '''Works out the fingerprint of every recipe for the given arch.
+        The recipes must be given in build order.'''
+        dependencies = get_recipe_dependencies(recipes)
+        for recipe in recipes:
+            env = get_build_env(recipe.get_recipe_env(arch))
+            components = {
+                'recipe': _hash_data([recipe.version, recipe.versioned_url,
+                                      hash_recipe_dir(recipe)]),
+                'source': _hash_data(get_source_state(recipe)),
+                'env': _hash_data([env, arch.arch, self.ctx.android_api,
+                                   self.ctx.ndk_ver]),
+                'depends': dict(
+                    [(depend, self.fingerprints[(depend, arch.arch)]['hash'])
+                     for depend in dependencies[recipe.name]]),
+                }
+            fingerprint = {'hash': _hash_data(components),
+                           'components': components}
+            self.fingerprints[(recipe.name, arch.arch)] = fingerprint
+
+    def get_recorded(self, recipe, arch):
+        '''Returns the fingerprint recorded after the last successful
+        build, or None.'''
+        filename = self.get_fingerprint_filename(recipe, arch)
+        if not exists(filename):
+            return None
+        try:
+            with open(filename) as fileh:
+                return json.load(fileh)
+        except ValueError:
+            return None
+
+    def matches(self, recipe, arch):
+        '''Whether the current fingerprint is the one recorded after the
+        last successful build.'''
+        fingerprint = self.fingerprints.get((recipe.name, arch.arch))
+        if fingerprint is None:
+            return False
+        recorded = self.get_recorded(recipe, arch)
+        return recorded is not None and recorded['hash'] == fingerprint['hash']
+
+    def record(self, recipe, arch):
+        '''Records the current fingerprint, after a successful build.'''
+        fingerprint = self.fingerprints.get((recipe.name, arch.arch))
+        if fingerprint is None:
+            return
+        filename = self.get_fingerprint_filename(recipe, arch)
+        ensure_dir(dirname(filename))
+        with open(filename, 'w') as fileh:
+            json.dump(fingerprint, fileh)
+
+    def get_unpacked_hash(self, recipe, arch):
+        components = self.fingerprints[(recipe.name, arch.arch)]['components']
+        return _hash_data([components['recipe'], components['source']])
+
+    def clean_stale_build_dir(self, recipe, arch):
+        '''Deletes the build dir of the recipe if it was unpacked from
+        another source or version of the recipe, or (for recipes setting
+        ``clean_build_on_change``) built with another build environment
+        or other dependencies, so that it is unpacked and patched
+        again.'''
+        if (recipe.name, arch.arch) not in self.fingerprints:
+            return
+        build_dir = recipe.get_build_dir(arch.arch)
+        marker = join(build_dir, '.p4a-unpacked')
+        if not exists(marker):
+            return
+        with open(marker) as fileh:
+            unpacked_hash = fileh.read().strip()
+        if unpacked_hash != self.get_unpacked_hash(recipe, arch):
+            info('The source or recipe of {} changed, deleting its old '
+                 'build dir'.format(recipe.name))
+            shutil.rmtree(build_dir)
+        elif self.is_build_stale(recipe, arch):
+            info('The build environment or dependencies of {} changed '
+                 'since it was built, deleting its old build dir'.format(
+                     recipe.name))
+            shutil.rmtree(build_dir)
+
+    def get_build_hash(self, recipe, arch):
+        components = self.fingerprints[(recipe.name, arch.arch)]['components']
+        return _hash_data([components['env'], components['depends']])
+
+    def _read_build_marker(self, recipe, arch):
+        marker = join(recipe.get_build_dir(arch.arch), '.p4a-built')
+        if not exists(marker):
+            return {}
+        try:
+            with open(marker) as fileh:
+                return json.load(fileh)
+        except ValueError:
+            return {}
+
+    def is_build_stale(self, recipe, arch):
+        '''Whether the build dir of a recipe setting
+        ``clean_build_on_change`` was built for this arch with another
+        build environment or other dependencies than the current ones.'''
+        if (not getattr(recipe, 'clean_build_on_change', False) or
+                (recipe.name, arch.arch) not in self.fingerprints):
+            return False
+        built_hash = self._read_build_marker(recipe, arch).get(arch.arch)
+        return (built_hash is not None and
+                built_hash != self.get_build_hash(recipe, arch))
+
+    def mark_build(self, recipe, arch):
+        '''Marks the build dir of a recipe setting
+        ``clean_build_on_change`` with the build environment and
+        dependencies it was built with, after a successful build.'''
+        build_dir = recipe.get_build_dir(arch.arch)
+        if (not getattr(recipe, 'clean_build_on_change', False) or
+                (recipe.name, arch.arch) not in self.fingerprints or
+                not isdir(build_dir)):
+            return
+        marker = self._read_build_marker(recipe, arch)
+        marker[arch.arch] = self.get_build_hash(recipe, arch)
+        with open(join(build_dir, '.p4a-built'), 'w') as fileh:
+            json.dump(marker, fileh)
+
+    def mark_build_dir(self, recipe, arch):
+        '''Marks the build dir with the source and recipe it was unpacked
+        from.'''
+        build_dir = recipe.get_build_dir(arch.arch)
+        if (recipe.name, arch.arch) not in self.fingerprints or \
+           not isdir(build_dir):
+            return
+        with open(join(build_dir, '.p4a-unpacked'), 'w') as fileh:
+            fileh.write(self.get_unpacked_hash(recipe, arch))
+
+    def explain(self, recipe, arch):
+        '''Returns a list of the reasons the fingerprint does not match the
+        recorded one, which is empty if it matches.'''
+        fingerprint = self.fingerprints.get((recipe.name, arch.arch))
+        if fingerprint is None:
+            return ['its fingerprint has not been computed']
+        reasons = []
+        if self.is_build_stale(recipe, arch):
+            reasons.append('its build dir was built with another build '
+                           'environment or other dependencies, and will be '
+                           'unpacked and built again')
+        recorded = self.get_recorded(recipe, arch)
+        if recorded is None:
+            return reasons + ['it has not been built for this dist and arch']
+        if recorded['hash'] == fingerprint['hash']:
+            return reasons
+
+        old = recorded['components']
+        new = fingerprint['components']
+        descriptions = (
+            ('recipe', 'the recipe files, version or url changed'),
+            ('source', 'the source changed'),
+            ('env', 'the build environment changed'))
+        for component, description in descriptions:
+            if old.get(component) != new[component]:
+                reasons.append(description)
+        old_depends = old.get('depends', {})
+        for depend in sorted(new['depends']):
+            if depend not in old_depends:
+                reasons.append('it now depends on {}'.format(depend))
+            elif old_depends[depend] != new['depends'][depend]:
+                reasons.append('dependency {} changed'.format(depend))
+        for depend in sorted(old_depends):
+            if depend not in new['depends']:
+                reasons.append('it no longer depends on {}'.format(depend))
+        return reasons
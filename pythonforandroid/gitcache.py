@@ -0,0 +1,143 @@
+'''A cache of git repositories for recipes whose source is a git url,
+or a local git repository given with P4A_<name>_DIR.
+
+One bare mirror of each remote is kept under the storage dir, and is
+updated with an incremental fetch rather than cloned again. Checkouts
+are made as ``git clone --shared`` clones of the mirror, which borrow
+its objects instead of copying the history. These are used rather
+than ``git worktree``, as build dirs are deleted freely (e.g. by
+``clean_builds``) and would leave stale worktrees registered in the
+mirror. Submodules are mirrored the same way, so their history is
+only fetched once for every recipe and arch using them.
+'''
+
+from os.path import join, exists, isdir, basename
+import hashlib
+import threading
+
+import sh
+
+from pythonforandroid.logger import info, shprint
+from pythonforandroid.util import ensure_dir, file_lock
+
+_updated_mirrors = set()  # mirrors already fetched into in this run
+_updated_lock = threading.Lock()
+
+
+def get_mirrors_dir(ctx):
+    return join(ctx.storage_dir, 'git_mirrors')
+
+
+def get_mirror_dir(ctx, url):
+    name = basename(url.rstrip('/'))
+    if not name.endswith('.git'):
+        name += '.git'
+    return join(get_mirrors_dir(ctx), '{}-{}'.format(
+        hashlib.sha1(url.encode('utf-8')).hexdigest()[:12], name))
+
+
+def update_mirror(ctx, url):
+    '''Makes sure the mirror of url exists and has been fetched into in
+    this run, returning its path.'''
+    mirror_dir = get_mirror_dir(ctx, url)
+    ensure_dir(get_mirrors_dir(ctx))
+    with file_lock(mirror_dir + '.lock'):
+        with _updated_lock:
+            if mirror_dir in _updated_mirrors:
+                return mirror_dir
+        if not isdir(mirror_dir):
+            info('Creating git mirror of {}'.format(url))
+            shprint(sh.git, 'clone', '--mirror', url, mirror_dir)
+            # Checkouts borrow objects from the mirror, so these must
+            # never be pruned
+            shprint(sh.git, 'config', 'gc.pruneExpire', 'never',
+                    _cwd=mirror_dir)
+        else:
+            info('Updating git mirror of {}'.format(url))
+            shprint(sh.git, 'fetch', '--tags', 'origin', _cwd=mirror_dir)
+        with _updated_lock:
+            _updated_mirrors.add(mirror_dir)
+    return mirror_dir
+
+
+def _has_commit(repo_dir, version):
+    try:
+        sh.git('cat-file', '-e', '{}^{{commit}}'.format(version),
+               _cwd=repo_dir)
+    except sh.ErrorReturnCode:
+        return False
+    return True
+
+
+def _resolve_url(url, relative_url):
+    '''Resolves a submodule url relative to the url of its parent.'''
+    if not relative_url.startswith(('./', '../')):
+        return relative_url
+    url = url.rstrip('/')
+    while relative_url.startswith(('./', '../')):
+        if relative_url.startswith('./'):
+            relative_url = relative_url[2:]
+        else:
+            url = url.rsplit('/', 1)[0]
+            relative_url = relative_url[3:]
+    return '{}/{}'.format(url, relative_url)
+
+
+def checkout(ctx, url, version, target):
+    '''Checks out version (a branch, tag or commit, or the default branch
+    if None) of the repository at url to the target dir, along with
+    its submodules.'''
+    mirror_dir = update_mirror(ctx, url)
+    if version is not None and not _has_commit(mirror_dir, version):
+        # e.g. a commit not on any branch of a local repository
+        shprint(sh.git, 'fetch', url, version, _cwd=mirror_dir)
+
+    if not isdir(target):
+        shprint(sh.git, 'clone', '--shared', '--no-checkout', mirror_dir,
+                target)
+    else:
+        shprint(sh.git, 'remote', 'set-url', 'origin', mirror_dir,
+                _cwd=target)
+        shprint(sh.git, 'fetch', '--tags', 'origin', _cwd=target)
+
+    if version is None:
+        revision = 'origin/HEAD'
+    elif _has_commit(target, 'origin/{}'.format(version)):
+        revision = 'origin/{}'.format(version)
+    else:
+        revision = version
+    shprint(sh.git, 'checkout', '--force', '--detach', revision,
+            _cwd=target)
+    update_submodules(ctx, url, target)
+
+
+def update_submodules(ctx, url, target):
+    '''Checks out the submodules of the repository in target from their
+    own mirrors.'''
+    if not exists(join(target, '.gitmodules')):
+        return
+    try:
+        config = sh.git('config', '-f', '.gitmodules', '--get-regexp',
+                        r'^submodule\..*\.(url|path)$', _cwd=target,
+                        _tty_out=False)
+    except sh.ErrorReturnCode:
+        return
+
+    submodules = {}  # name -> {'url': ..., 'path': ...}
+    for line in str(config).splitlines():
+        key, value = line.split(None, 1)
+        name, attribute = key[len('submodule.'):].rsplit('.', 1)
+        submodules.setdefault(name, {})[attribute] = value
+
+    for name, submodule in sorted(submodules.items()):
+        submodule['url'] = _resolve_url(url, submodule['url'])
+        shprint(sh.git, 'config', 'submodule.{}.url'.format(name),
+                update_mirror(ctx, submodule['url']), _cwd=target)
+    # The mirrors are local repositories, which recent versions of git
+    # only allow as submodule urls if asked to
+    shprint(sh.git, '-c', 'protocol.file.allow=always', 'submodule',
+            'update', '--init', '--force', _cwd=target)
+
+    for name, submodule in sorted(submodules.items()):
+        update_submodules(ctx, submodule['url'],
+                          join(target, submodule['path']))
@@ -1,117 +1,377 @@
-
-from copy import deepcopy
+from os.path import join, exists, dirname
+from os import rename, getpid
+import hashlib
+import json
 
 from pythonforandroid.logger import (info, info_notify, warning)
-from pythonforandroid.recipe import Recipe
 from pythonforandroid.bootstrap import Bootstrap
+from pythonforandroid.util import ensure_dir
+
+
+RESOLUTION_CACHE_VERSION = 1
 
 
 class Graph(object):
     # Taken from the old python-for-android/depsort
-    # Modified to include alternative dependencies
     def __init__(self):
         # `graph`: dict that maps each package to a set of its dependencies.
-        self.graphs = [{}]
-        # self.graph = {}
-
-    def remove_redundant_graphs(self):
-        '''Removes possible graphs if they are equivalent to others.'''
-        graphs = self.graphs
-        # Walk the list backwards so that popping elements doesn't
-        # mess up indexing.
-
-        # n.b. no need to test graph 0 as it will have been tested against
-        # all others by the time we get to it
-        for i in range(len(graphs) - 1, 0, -1):
-            graph = graphs[i]
-
-            # test graph i against all graphs 0 to i-1
-            for j in range(0, i):
-                comparison_graph = graphs[j]
-
-                if set(comparison_graph.keys()) == set(graph.keys()):
-                    # graph[i] == graph[j]
-                    # so remove graph[i] and continue on to testing graph[i-1]
-                    graphs.pop(i)
-                    break
+        self.graph = {}
 
     def add(self, dependent, dependency):
         """Add a dependency relationship to the graph"""
-        if isinstance(dependency, (tuple, list)):
-            for graph in self.graphs[:]:
-                for dep in dependency[1:]:
-                    new_graph = deepcopy(graph)
-                    self._add(new_graph, dependent, dep)
-                    self.graphs.append(new_graph)
-                self._add(graph, dependent, dependency[0])
-        else:
-            for graph in self.graphs:
-                self._add(graph, dependent, dependency)
-        self.remove_redundant_graphs()
-
-    def _add(self, graph, dependent, dependency):
-        '''Add a dependency relationship to a specific graph, where dependency
-        must be a single dependency, not a list or tuple.
-        '''
-        graph.setdefault(dependent, set())
-        graph.setdefault(dependency, set())
+        self.graph.setdefault(dependent, set())
+        self.graph.setdefault(dependency, set())
         if dependent != dependency:
-            graph[dependent].add(dependency)
-
-    def conflicts(self, conflict):
-        graphs = self.graphs
-        for i in range(len(graphs)):
-            graph = graphs[len(graphs) - 1 - i]
-            if conflict in graph:
-                graphs.pop(len(graphs) - 1 - i)
-        return len(graphs) == 0
-
-    def remove_remaining_conflicts(self, ctx):
-        # It's unpleasant to have to pass ctx as an argument...
-        '''Checks all possible graphs for conflicts that have arisen during
-        the additon of alternative repice branches, as these are not checked
-        for conflicts at the time.'''
-        new_graphs = []
-        for i, graph in enumerate(self.graphs):
-            for name in graph.keys():
-                recipe = Recipe.get_recipe(name, ctx)
-                if any([c in graph for c in recipe.conflicts]):
-                    break
-            else:
-                new_graphs.append(graph)
-        self.graphs = new_graphs
+            self.graph[dependent].add(dependency)
 
     def add_optional(self, dependent, dependency):
         """Add an optional (ordering only) dependency relationship to the graph
 
         Only call this after all mandatory requirements are added
         """
-        for graph in self.graphs:
-            if dependent in graph and dependency in graph:
-                self._add(graph, dependent, dependency)
+        if dependent in self.graph and dependency in self.graph:
+            self.add(dependent, dependency)
 
-    def find_order(self, index=0):
+    def find_order(self):
         """Do a topological sort on a dependency graph
 
         :Parameters:
             :Returns:
                 iterator, sorted items form first to last
         """
-        graph = self.graphs[index]
-        graph = dict((k, set(v)) for k, v in graph.items())
-        while graph:
-            # Find all items without a parent
-            leftmost = [l for l, s in graph.items() if not s]
-            if not leftmost:
-                raise ValueError('Dependency cycle detected! %s' % graph)
-            # If there is more than one, sort them for predictable order
-            leftmost.sort()
-            for result in leftmost:
-                # Yield and remove them from the graph
-                yield result
-                graph.pop(result)
-                for bset in graph.values():
-                    bset.discard(result)
+        for level in self.find_levels():
+            for item in level:
+                yield item
+
+    def find_levels(self):
+        """Group the items of the graph into levels, see find_levels"""
+        return find_levels(self.graph)
+
+
+def find_levels(graph):
+    """Group the items of a dependency graph into levels, with Kahn's
+    algorithm: the first level holds the items without dependencies,
+    and each later level the items whose dependencies are all in
+    earlier levels. The items of a level can be built concurrently.
+
+    :Parameters:
+        `graph`: dict that maps each item to a set of its dependencies,
+                 which must all be items of the graph.
+        :Returns:
+            list of levels, each a sorted list of items
+    """
+    in_degrees = dict((item, len(deps)) for item, deps in graph.items())
+    dependents = dict((item, []) for item in graph)
+    for item, deps in graph.items():
+        for dep in deps:
+            dependents[dep].append(item)
+
+    levels = []
+    level = sorted([item for item, count in in_degrees.items()
+                    if count == 0])
+    while level:
+        levels.append(level)
+        next_level = []
+        for item in level:
+            for dependent in dependents[item]:
+                in_degrees[dependent] -= 1
+                if in_degrees[dependent] == 0:
+                    next_level.append(dependent)
+        level = sorted(next_level)
+
+    if sum([len(level) for level in levels]) < len(graph):
+        done = set([item for level in levels for item in level])
+        raise ValueError('Dependency cycle detected! %s' % dict(
+            (item, deps) for item, deps in graph.items()
+            if item not in done))
+    return levels
+
+
+class RecipeResolver(object):
+    '''Chooses a set of recipes satisfying a list of requirements, by
+    a depth first search over the alternatives of each dependency.
+
+    Each requirement is a tuple of alternative names, and is satisfied
+    if any of them is chosen. A recipe can only be chosen if it does
+    not conflict with any recipe already chosen, and none of these
+    conflict with it, so conflicts are pruned as soon as they arise.
+    When no alternative of a requirement can be chosen, the search
+    jumps back to the most recent choice responsible for one of the
+    conflicts or for pulling in the requirement, and tries its next
+    alternative (conflict directed backjumping). The alternatives are
+    tried in the order they are listed, so the set returned is the
+    first valid one in order of preference.
+
+    ``load_recipe`` is called with a name and returns its recipe (or
+    any object with ``depends``, ``conflicts`` and ``opt_depends``), or
+    None if there is no recipe of that name, in which case the name is
+    a python module to be installed with pip.
+    '''
+
+    def __init__(self, load_recipe):
+        self.load_recipe = load_recipe
+        self.recipes = {}  # name -> recipe, or None for python modules
+        self.failed_conflicts = []  # (recipe, conflict) pairs pruned
+
+    def get_recipe(self, name):
+        if name not in self.recipes:
+            self.recipes[name] = self.load_recipe(name)
+        return self.recipes[name]
+
+    def get_requirements(self, name):
+        recipe = self.get_recipe(name)
+        if recipe is None:
+            return []
+        return [tuple(depend) if isinstance(depend, (tuple, list))
+                else (depend, ) for depend in recipe.depends]
+
+    def get_conflicts(self, name):
+        recipe = self.get_recipe(name)
+        if recipe is None:
+            return []
+        return recipe.conflicts
+
+    def resolve(self, names):
+        '''Returns the chosen names in the order they were chosen, or None
+        if the requirements cannot be satisfied.'''
+        self.failed_conflicts = []
+        # The requirements met so far, each with the level of the choice
+        # that pulled it in (-1 for the given names). Those without
+        # alternatives are kept apart and satisfied first, so that the
+        # alternatives are only chosen between once every recipe that
+        # is certainly needed has been chosen and can rule them out.
+        agendas = ([((name, ), -1) for name in names], [])
+        chosen = []
+        levels = {}  # chosen name -> level of the choice that chose it
+        forbidden = {}  # name -> chosen names conflicting with it
+        # Choice points, one level each: [agenda, agenda indices, agenda
+        # lengths, number chosen, alternatives left to try, culprit
+        # levels]
+        stack = []
+
+        def undo(point):
+            for agenda, length in zip(agendas, point[2]):
+                del agenda[length:]
+            while len(chosen) > point[3]:
+                name = chosen.pop()
+                del levels[name]
+                for conflict in self.get_conflicts(name):
+                    forbidden[conflict].remove(name)
+                    if not forbidden[conflict]:
+                        del forbidden[conflict]
+
+        def choose(name, level, culprits):
+            '''Chooses name if it conflicts with nothing chosen so far,
+            otherwise adds the levels of the choices it conflicts with
+            to culprits.'''
+            blockers = list(forbidden.get(name, [])) + [
+                conflict for conflict in self.get_conflicts(name)
+                if conflict in levels]
+            if blockers:
+                for blocker in blockers:
+                    culprits.add(levels[blocker])
+                    if blocker in self.get_conflicts(name):
+                        self.failed_conflicts.append((name, blocker))
+                    else:
+                        self.failed_conflicts.append((blocker, name))
+                return False
+            chosen.append(name)
+            levels[name] = level
+            for conflict in self.get_conflicts(name):
+                forbidden.setdefault(conflict, []).append(name)
+            for requirement in self.get_requirements(name):
+                agendas[len(requirement) > 1].append((requirement, level))
+            return True
+
+        indices = [0, 0]
+        while True:
+            if indices[0] < len(agendas[0]):
+                which = 0
+            elif indices[1] < len(agendas[1]):
+                which = 1
+            else:
+                return chosen
+            requirement, origin = agendas[which][indices[which]]
+            if any([name in levels for name in requirement]):
+                indices[which] += 1
+                continue
+            stack.append([which, tuple(indices),
+                          tuple([len(agenda) for agenda in agendas]),
+                          len(chosen), list(requirement), set([origin])])
+            while True:
+                level = len(stack) - 1
+                point = stack[-1]
+                undo(point)
+                alternatives, culprits = point[4], point[5]
+                while alternatives:
+                    if choose(alternatives.pop(0), level, culprits):
+                        break
+                else:
+                    # No alternative is left, so jump back to the most
+                    # recent choice that caused one of the conflicts,
+                    # skipping the choices that had nothing to do with
+                    # them
+                    culprits.discard(level)
+                    target = max(culprits)
+                    if target < 0:
+                        return None
+                    del stack[target + 1:]
+                    culprits.discard(target)
+                    stack[target][5].update(culprits)
+                    continue
+                indices = list(point[1])
+                indices[point[0]] += 1
+                break
+
+    def get_graph(self, chosen):
+        '''Returns a Graph of the recipes in chosen, with each dependency
+        pointing at whichever of its alternatives was chosen.'''
+        chosen_set = set(chosen)
+        graph = Graph()
+        recipe_names = [name for name in chosen
+                        if self.get_recipe(name) is not None]
+        for name in recipe_names:
+            graph.add(name, name)
+            for requirement in self.get_requirements(name):
+                depend = [alt for alt in requirement if alt in chosen_set][0]
+                if self.get_recipe(depend) is not None:
+                    graph.add(name, depend)
+        for name in recipe_names:
+            for depend in self.get_recipe(name).opt_depends:
+                graph.add_optional(name, depend)
+        return graph
+
+
+def _load_recipe(ctx, name):
+    try:
+        return ctx.recipe_index.get(name)
+    except IOError:
+        info('No recipe named {}; will attempt to install with pip'
+             .format(name))
+        return None
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except:
+        warning('Failed to import recipe named {}; the recipe exists '
+                'but appears broken.'.format(name))
+        warning('Exception was:')
+        raise
+
+
+def _resolve_recipes(resolver, names):
+    '''Returns the build order and python modules for the given names,
+    exiting if they cannot be satisfied.'''
+    chosen = resolver.resolve(names)
+    if chosen is None:
+        for recipe, conflict in sorted(set(resolver.failed_conflicts)):
+            warning('{} conflicts with {}, but both have been included '
+                    'or pulled into the requirements.'.format(
+                        recipe, conflict))
+        warning('Didn\'t find any valid dependency graphs, exiting.')
+        exit(1)
+    python_modules = [name for name in chosen
+                      if resolver.get_recipe(name) is None]
+    build_order = list(resolver.get_graph(chosen).find_order())
+    info('Found a valid recipe set: {}'.format(build_order))
+    return build_order, python_modules
+
+
+class ResolutionCache(object):
+    '''The results of :func:`get_recipe_order_and_bootstrap`, kept in
+    ``resolution_cache.json`` in the storage dir so that repeated builds
+    of the same requirements skip the resolution.
+
+    Each result is stored under the requirements and the requested
+    bootstrap, along with the names of every recipe looked at while
+    resolving them and a hash of their recipe files (or of their
+    absence, for python modules) and of the bootstrap modules. It is
+    only reused while that hash is unchanged, so editing, adding or
+    removing any of these recipes, e.g. in the local recipes dir,
+    resolves the requirements again.
+    '''
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    @property
+    def filename(self):
+        return join(self.ctx.storage_dir, 'resolution_cache.json')
+
+    @staticmethod
+    def get_key(names, bs):
+        # Duplicates are dropped but the order is kept, as it decides
+        # which alternatives are preferred
+        requirements = []
+        for name in names:
+            name = name.strip().lower()
+            if name not in requirements:
+                requirements.append(name)
+        return json.dumps([requirements, bs.name if bs else None])
+
+    def hash_recipes(self, recipe_names):
+        '''Returns a hash of the recipe files of recipe_names, and of
+        every bootstrap module, as these give the bootstrap recipes.'''
+        files = []
+        for name in sorted(recipe_names):
+            files.append((name, self.ctx.recipe_index.get_recipe_file(name)))
+        bootstraps_dir = join(dirname(__file__), 'bootstraps')
+        for name in sorted(Bootstrap.list_bootstraps()):
+            files.append((name, join(bootstraps_dir, name, '__init__.py')))
+
+        recipes_hash = hashlib.sha1()
+        for name, filename in files:
+            recipes_hash.update(name.encode('utf-8'))
+            if filename is None or not exists(filename):
+                recipes_hash.update(b'-')
+                continue
+            recipes_hash.update(filename.encode('utf-8'))
+            with open(filename, 'rb') as fileh:
+                recipes_hash.update(
+                    hashlib.sha1(fileh.read()).hexdigest().encode('utf-8'))
+        return recipes_hash.hexdigest()
+
+    def load(self):
+        if not exists(self.filename):
+            return {}
+        try:
+            with open(self.filename) as fileh:
+                cache = json.load(fileh)
+        except ValueError:
+            return {}
+        if cache.get('version') != RESOLUTION_CACHE_VERSION:
+            return {}
+        return cache['results']
+
+    def get(self, names, bs):
+        '''Returns the cached (build_order, python_modules, bootstrap
+        name) for names and bs, or None if there is no valid result.'''
+        entry = self.load().get(self.get_key(names, bs))
+        if entry is None:
+            return None
+        if entry['hash'] != self.hash_recipes(entry['recipes']):
+            info('The recipes have changed since these requirements were '
+                 'last resolved')
+            return None
+        return (entry['build_order'], entry['python_modules'],
+                entry['bootstrap'])
+
+    def set(self, names, bs, recipe_names, result):
+        build_order, python_modules, chosen_bs = result
+        results = self.load()
+        results[self.get_key(names, bs)] = {
+            'recipes': sorted(recipe_names),
+            'hash': self.hash_recipes(recipe_names),
+            'build_order': build_order,
+            'python_modules': python_modules,
+            'bootstrap': chosen_bs.name}
+        ensure_dir(self.ctx.storage_dir)
+        # Written to a temporary file first, so other processes never
+        # read a partial cache
+        temp_filename = '{}.{}'.format(self.filename, getpid())
+        with open(temp_filename, 'w') as fileh:
+            json.dump({'version': RESOLUTION_CACHE_VERSION,
+                       'results': results}, fileh, indent=1, sort_keys=True)
+        rename(temp_filename, self.filename)
 
 
 def get_recipe_order_and_bootstrap(ctx, names, bs=None):
@@ -119,65 +379,37 @@ def get_recipe_order_and_bootstrap(ctx, names, bs=None):
     works out the dependency graph (including bootstrap recipes if
     necessary). Finally, if no bootstrap was initially selected,
     chooses one that supports all the recipes.
+
+    The result is cached, see :class:`ResolutionCache`.
     '''
-    graph = Graph()
-    recipes_to_load = set(names)
+    cache = ResolutionCache(ctx)
+    cached = cache.get(names, bs)
+    if cached is not None:
+        build_order, python_modules, bs_name = cached
+        info('Using the cached recipe set for these requirements: {}'
+             .format(build_order))
+        if bs is None:
+            bs = Bootstrap.get_bootstrap(bs_name, ctx)
+            info('{} bootstrap was chosen for these requirements before.'
+                 .format(bs.name))
+        return build_order, python_modules, bs
+
+    result = _get_recipe_order_and_bootstrap(ctx, names, bs)
+    cache.set(names, bs, result[3], result[:3])
+    return result[:3]
+
+
+def _get_recipe_order_and_bootstrap(ctx, names, bs):
+    '''Resolves the requirements as described in
+    :func:`get_recipe_order_and_bootstrap`, also returning the names of
+    every recipe that was looked at.'''
+    resolver = RecipeResolver(lambda name: _load_recipe(ctx, name))
+    names = list(names)
     if bs is not None and bs.recipe_depends:
         info_notify('Bootstrap requires recipes {}'.format(bs.recipe_depends))
-        recipes_to_load = recipes_to_load.union(set(bs.recipe_depends))
-    recipes_to_load = list(recipes_to_load)
-    recipe_loaded = []
-    python_modules = []
-    while recipes_to_load:
-        name = recipes_to_load.pop(0)
-        if name in recipe_loaded or isinstance(name, (list, tuple)):
-            continue
-        try:
-            recipe = Recipe.get_recipe(name, ctx)
-        except IOError:
-            info('No recipe named {}; will attempt to install with pip'
-                 .format(name))
-            python_modules.append(name)
-            continue
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except:
-            warning('Failed to import recipe named {}; the recipe exists '
-                    'but appears broken.'.format(name))
-            warning('Exception was:')
-            raise
-        graph.add(name, name)
-        info('Loaded recipe {} (depends on {}{})'.format(
-            name, recipe.depends,
-            ', conflicts {}'.format(recipe.conflicts) if recipe.conflicts
-            else ''))
-        for depend in recipe.depends:
-            graph.add(name, depend)
-            recipes_to_load += recipe.depends
-        for conflict in recipe.conflicts:
-            if graph.conflicts(conflict):
-                warning(
-                    ('{} conflicts with {}, but both have been '
-                     'included or pulled into the requirements.'
-                     .format(recipe.name, conflict)))
-                warning(
-                    'Due to this conflict the build cannot continue, exiting.')
-                exit(1)
-        recipe_loaded.append(name)
-    graph.remove_remaining_conflicts(ctx)
-    if len(graph.graphs) > 1:
-        info('Found multiple valid recipe sets:')
-        for g in graph.graphs:
-            info('    {}'.format(g.keys()))
-        info_notify('Using the first of these: {}'
-                    .format(graph.graphs[0].keys()))
-    elif len(graph.graphs) == 0:
-        warning('Didn\'t find any valid dependency graphs, exiting.')
-        exit(1)
-    else:
-        info('Found a single valid recipe set (this is good)')
+        names += [name for name in bs.recipe_depends if name not in names]
 
-    build_order = list(graph.find_order(0))
+    build_order, python_modules = _resolve_recipes(resolver, names)
     if bs is None:  # It would be better to check against possible
                     # orders other than the first one, but in practice
                     # there will rarely be clashes, and the user can
@@ -192,40 +424,15 @@ def get_recipe_order_and_bootstrap(ctx, names, bs=None):
             exit(1)
         info('{} bootstrap appears compatible with the required recipes.'
              .format(bs.name))
-        info('Checking this...')
-        recipes_to_load = bs.recipe_depends
-        # This code repeats the code from earlier! Should move to a function:
-        while recipes_to_load:
-            name = recipes_to_load.pop(0)
-            if name in recipe_loaded or isinstance(name, (list, tuple)):
-                continue
-            try:
-                recipe = Recipe.get_recipe(name, ctx)
-            except ImportError:
-                info('No recipe named {}; will attempt to install with pip'
-                     .format(name))
-                python_modules.append(name)
-                continue
-            graph.add(name, name)
-            info('Loaded recipe {} (depends on {}{})'.format(
-                name, recipe.depends,
-                ', conflicts {}'.format(recipe.conflicts) if recipe.conflicts
-                else ''))
-            for depend in recipe.depends:
-                graph.add(name, depend)
-                recipes_to_load += recipe.depends
-            for conflict in recipe.conflicts:
-                if graph.conflicts(conflict):
-                    warning(
-                        ('{} conflicts with {}, but both have been '
-                         'included or pulled into the requirements.'
-                         .format(recipe.name, conflict)))
-                    warning('Due to this conflict the build cannot continue, '
-                            'exiting.')
-                    exit(1)
-            recipe_loaded.append(name)
-        graph.remove_remaining_conflicts(ctx)
-        build_order = list(graph.find_order(0))
-    return build_order, python_modules, bs
-
-    # Do a final check that the new bs doesn't pull in any conflicts
+        # Resolve again only if the bootstrap adds recipes, as their
+        # own dependencies must then be checked for conflicts too; the
+        # recipes already loaded are reused
+        added = [name for name in bs.recipe_depends
+                 if name not in build_order and name not in python_modules]
+        if added:
+            info('Checking this with the recipes it adds: {}'.format(added))
+            names += [name for name in bs.recipe_depends if name not in names]
+            build_order, python_modules = _resolve_recipes(resolver, names)
+    # The bootstrap choice also looked at the recipes of every bootstrap
+    looked_at = set(resolver.recipes) | ctx.recipe_index.conflicts.loaded
+    return build_order, python_modules, bs, looked_at
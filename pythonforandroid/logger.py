@@ -2,15 +2,14 @@
 import logging
 import os
 import re
-import sh
+import threading
 from sys import stdout, stderr
 from math import log10
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from colorama import Style as Colo_Style, Fore as Colo_Fore
 
+from pythonforandroid.tracing import tracer
 
-# monkey patch to show full output
-sh.ErrorReturnCode.truncate_cap = 999999
 
 
 class LevelDifferentiatingFormatter(logging.Formatter):
@@ -58,19 +57,25 @@ class colorama_shim(object):
 
 Null_Style = Null_Fore = colorama_shim()
 
-if stdout.isatty():
-    Out_Style = Colo_Style
-    Out_Fore = Colo_Fore
-else:
-    Out_Style = Null_Style
-    Out_Fore = Null_Fore
 
-if stderr.isatty():
-    Err_Style = Colo_Style
-    Err_Fore = Colo_Fore
-else:
-    Err_Style = Null_Style
-    Err_Fore = Null_Fore
+class terminal_colors(object):
+    '''The colorama codes if stream is a terminal, otherwise empty
+    strings. This is checked each time, as the file descriptors of the
+    streams are replaced when the build daemon runs a command.'''
+
+    def __init__(self, stream, colors):
+        self._stream = stream
+        self._colors = colors
+
+    def __getattr__(self, key):
+        if self._stream.isatty():
+            return getattr(self._colors, key)
+        return Null_Style._dict[key]
+
+Out_Style = terminal_colors(stdout, Colo_Style)
+Out_Fore = terminal_colors(stdout, Colo_Fore)
+Err_Style = terminal_colors(stderr, Colo_Style)
+Err_Fore = terminal_colors(stderr, Colo_Fore)
 
 
 def info_main(*args):
@@ -115,9 +120,55 @@ def get_console_width():
     return 100
 
 
+class DownloadProgress(object):
+    '''Tracks every download that is currently running, and shows their
+    progress together on a single console line.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.downloads = OrderedDict()
+        self.columns = None
+
+    def update(self, name, received, size):
+        with self.lock:
+            if not self.downloads:
+                self.columns = get_console_width()
+            self.downloads[name] = (received, size)
+            self._show()
+
+    def finish(self, name):
+        with self.lock:
+            self.downloads.pop(name, None)
+            self._show()
+
+    def _show(self):
+        columns = self.columns or get_console_width()
+        progressions = []
+        for name, (received, size) in self.downloads.items():
+            if size <= 0:
+                progression = '{0} bytes'.format(received)
+            else:
+                progression = '{0:.2f}%'.format(
+                    min(received, size) * 100. / float(size))
+            if len(self.downloads) > 1:
+                progression = '{} {}'.format(name, progression)
+            progressions.append(progression)
+        if progressions:
+            msg = '- Download {}'.format(', '.join(progressions))
+        else:
+            msg = ''
+        stdout.write('{:<{width}}\r'.format(
+            shorten_string(msg, columns - 1), width=(columns - 1)))
+        stdout.flush()
+
+download_progress = DownloadProgress()
+
+
 def shprint(command, *args, **kwargs):
     '''Runs the command (which should be an sh.Command instance), while
     logging the output.'''
+    # sh is slow to import, and is imported by whatever made the command
+    import sh
     kwargs["_iter"] = True
     kwargs["_out_bufsize"] = 1
     kwargs["_err_to_out"] = True
@@ -140,67 +191,69 @@ def shprint(command, *args, **kwargs):
     else:
         logger.debug('{}{}'.format(string, Err_Style.RESET_ALL))
 
-    need_closing_newline = False
-    try:
-        msg_hdr = '           working: '
-        msg_width = columns - len(msg_hdr) - 1
-        output = command(*args, **kwargs)
-        for line in output:
-            if logger.level > logging.DEBUG:
-                msg = line.replace(
-                    '\n', ' ').replace(
-                        '\t', ' ').replace(
-                            '\b', ' ').rstrip()
-                if msg:
-                    stdout.write(u'{}\r{}{:<{width}}'.format(
-                        Err_Style.RESET_ALL, msg_hdr,
-                        shorten_string(msg, msg_width), width=msg_width))
-                    stdout.flush()
-                    need_closing_newline = True
-            else:
-                logger.debug(''.join(['\t', line.rstrip()]))
-        if need_closing_newline:
-            stdout.write('{}\r{:>{width}}\r'.format(
-                Err_Style.RESET_ALL, ' ', width=(columns - 1)))
-            stdout.flush()
-    except sh.ErrorReturnCode as err:
-        if need_closing_newline:
-            stdout.write('{}\r{:>{width}}\r'.format(
-                Err_Style.RESET_ALL, ' ', width=(columns - 1)))
-            stdout.flush()
-        if tail_n or filter_in or filter_out:
-            def printtail(out, name, forecolor, tail_n=0,
-                          re_filter_in=None, re_filter_out=None):
-                lines = out.splitlines()
-                if re_filter_in is not None:
-                    lines = [l for l in lines if re_filter_in.search(l)]
-                if re_filter_out is not None:
-                    lines = [l for l in lines if not re_filter_out.search(l)]
-                if tail_n == 0 or len(lines) <= tail_n:
-                    info('{}:\n{}\t{}{}'.format(
-                        name, forecolor, '\t\n'.join(lines), Out_Fore.RESET))
+    with tracer.span(command_string, 'command',
+                     command=' '.join([command_string] + list(args))):
+        need_closing_newline = False
+        try:
+            msg_hdr = '           working: '
+            msg_width = columns - len(msg_hdr) - 1
+            output = command(*args, **kwargs)
+            for line in output:
+                if logger.level > logging.DEBUG:
+                    msg = line.replace(
+                        '\n', ' ').replace(
+                            '\t', ' ').replace(
+                                '\b', ' ').rstrip()
+                    if msg:
+                        stdout.write(u'{}\r{}{:<{width}}'.format(
+                            Err_Style.RESET_ALL, msg_hdr,
+                            shorten_string(msg, msg_width), width=msg_width))
+                        stdout.flush()
+                        need_closing_newline = True
                 else:
-                    info('{} (last {} lines of {}):\n{}\t{}{}'.format(
-                        name, tail_n, len(lines),
-                        forecolor, '\t\n'.join(lines[-tail_n:]),
-                        Out_Fore.RESET))
-            printtail(err.stdout, 'STDOUT', Out_Fore.YELLOW, tail_n,
-                      re.compile(filter_in) if filter_in else None,
-                      re.compile(filter_out) if filter_out else None)
-            printtail(err.stderr, 'STDERR', Err_Fore.RED)
-        if is_critical:
-            env = kwargs.get("env")
-            if env is not None:
-                info("{}ENV:{}\n{}\n".format(
-                    Err_Fore.YELLOW, Err_Fore.RESET, "\n".join(
-                        "set {}={}".format(n, v) for n, v in env.items())))
-            info("{}COMMAND:{}\ncd {} && {} {}\n".format(
-                Err_Fore.YELLOW, Err_Fore.RESET, os.getcwd(), command,
-                ' '.join(args)))
-            warning("{}ERROR: {} failed!{}".format(
-                Err_Fore.RED, command, Err_Fore.RESET))
-            exit(1)
-        else:
-            raise
+                    logger.debug(''.join(['\t', line.rstrip()]))
+            if need_closing_newline:
+                stdout.write('{}\r{:>{width}}\r'.format(
+                    Err_Style.RESET_ALL, ' ', width=(columns - 1)))
+                stdout.flush()
+        except sh.ErrorReturnCode as err:
+            if need_closing_newline:
+                stdout.write('{}\r{:>{width}}\r'.format(
+                    Err_Style.RESET_ALL, ' ', width=(columns - 1)))
+                stdout.flush()
+            if tail_n or filter_in or filter_out:
+                def printtail(out, name, forecolor, tail_n=0,
+                              re_filter_in=None, re_filter_out=None):
+                    lines = out.splitlines()
+                    if re_filter_in is not None:
+                        lines = [l for l in lines if re_filter_in.search(l)]
+                    if re_filter_out is not None:
+                        lines = [l for l in lines if not re_filter_out.search(l)]
+                    if tail_n == 0 or len(lines) <= tail_n:
+                        info('{}:\n{}\t{}{}'.format(
+                            name, forecolor, '\t\n'.join(lines), Out_Fore.RESET))
+                    else:
+                        info('{} (last {} lines of {}):\n{}\t{}{}'.format(
+                            name, tail_n, len(lines),
+                            forecolor, '\t\n'.join(lines[-tail_n:]),
+                            Out_Fore.RESET))
+                printtail(err.stdout, 'STDOUT', Out_Fore.YELLOW, tail_n,
+                          re.compile(filter_in) if filter_in else None,
+                          re.compile(filter_out) if filter_out else None)
+                printtail(err.stderr, 'STDERR', Err_Fore.RED)
+            if is_critical:
+                env = kwargs.get("env")
+                if env is not None:
+                    info("{}ENV:{}\n{}\n".format(
+                        Err_Fore.YELLOW, Err_Fore.RESET, "\n".join(
+                            "set {}={}".format(n, v) for n, v in env.items())))
+                info("{}COMMAND:{}\ncd {} && {} {}\n".format(
+                    Err_Fore.YELLOW, Err_Fore.RESET, os.getcwd(), command,
+                    ' '.join(args)))
+                warning("{}ERROR: {} failed!{}".format(
+                    Err_Fore.RED, command, Err_Fore.RESET))
+                exit(1)
+            else:
+                raise
 
     return output
@@ -1,23 +1,34 @@
-from os.path import join, dirname, isdir, exists, isfile
+from os.path import (join, dirname, isdir, exists, isfile, basename,
+                     realpath, relpath)
 import importlib
 import zipfile
+import hashlib
+import json
 import glob
 from six import PY2
 
 import sh
 import shutil
-from os import listdir, unlink, environ, mkdir
-from sys import stdout
+from os import listdir, unlink, environ, mkdir, walk
+from multiprocessing import cpu_count
 try:
     from urlparse import urlparse
 except ImportError:
     from urllib.parse import urlparse
-from pythonforandroid.logger import (logger, info, warning, shprint, info_main)
+from pythonforandroid.logger import (logger, info, warning, error, shprint,
+                                     info_main, download_progress)
 from pythonforandroid.util import (urlretrieve, current_directory, ensure_dir)
+from pythonforandroid.archives import is_archive, extract_archive
+from pythonforandroid import gitcache, recipeindex
+from pythonforandroid.cythoncache import cythonize_tree
+from pythonforandroid.stripping import strip_tree
 
 # this import is necessary to keep imp.load_source from complaining :)
 import pythonforandroid.recipes
 
+# monkey patch to show full output
+sh.ErrorReturnCode.truncate_cap = 999999
+
 
 if PY2:
     import imp
@@ -37,6 +48,10 @@ else:
             return SourceFileLoader(module, filename).load_module()
 
 
+DIGEST_NAMES = ('md5', 'sha256')
+'''The digests computed for every download, and recorded in its marker.'''
+
+
 class Recipe(object):
     url = None
     '''The address from which the recipe may be downloaded. This is not
@@ -58,10 +73,14 @@ class Recipe(object):
 
     md5sum = None
     '''The md5sum of the source from the :attr:`url`. Non-essential, but
-    you should try to include this, it is used to check that the download
-    finished correctly.
+    you should try to include this (or :attr:`sha256sum`), it is used to
+    check that the download finished correctly.
     '''
 
+    sha256sum = None
+    '''The sha256sum of the source from the :attr:`url`, used like
+    :attr:`md5sum`.'''
+
     depends = []
     '''A list containing the names of any recipes that this recipe depends on.
     '''
@@ -80,6 +99,26 @@ class Recipe(object):
     string patch file and a callable, which will receive the kwargs `arch` and
     `recipe`, which should return True if the patch should be applied.'''
 
+    build_cache = False
+    '''Whether the outputs of the recipe build may be stored in, and
+    restored from, the build artifact cache (see
+    :mod:`pythonforandroid.artifacts`). This is only safe if
+    :meth:`build_arch` does nothing but install files into the staging
+    dir (see :meth:`get_staging_dir`) and the recipe's objects dir, as
+    PythonRecipe does.'''
+
+    clean_build_on_change = False
+    '''If True, the build dir is unpacked again when the build
+    environment or the dependencies of the recipe have changed since it
+    was built there (see :mod:`pythonforandroid.fingerprints`). This is
+    for recipes (such as python2) whose :meth:`build_arch` always runs,
+    but skips compiling if what was compiled before is still in the
+    build dir.'''
+
+    download_attempts = 3
+    '''The number of times the download is attempted if it doesn't match
+    :attr:`md5sum` or :attr:`sha256sum`.'''
+
     archs = ['armeabi']  # Not currently implemented properly
 
     @property
@@ -93,7 +132,8 @@ class Recipe(object):
 
     def download_file(self, url, target, cwd=None):
         """
-        (internal) Download an ``url`` to a ``target``.
+        (internal) Download an ``url`` to a ``target``. If this downloads
+        a file, returns a dict of its digests (see :data:`DIGEST_NAMES`).
         """
         if not url:
             return
@@ -104,37 +144,24 @@ class Recipe(object):
 
         parsed_url = urlparse(url)
         if parsed_url.scheme in ('http', 'https'):
-            def report_hook(index, blksize, size):
-                if size <= 0:
-                    progression = '{0} bytes'.format(index * blksize)
-                else:
-                    progression = '{0:.2f}%'.format(
-                        index * blksize * 100. / float(size))
-                stdout.write('- Download {}\r'.format(progression))
-                stdout.flush()
+            def report_hook(received, size):
+                download_progress.update(self.name, received, size)
 
             if exists(target):
                 unlink(target)
 
-            urlretrieve(url, target, report_hook)
-            return target
+            # An interrupted download is resumed from its .part file
+            try:
+                return urlretrieve(url, target, report_hook, DIGEST_NAMES,
+                                   self.ctx.download_segments)
+            finally:
+                download_progress.finish(self.name)
         elif parsed_url.scheme in ('git', 'git+ssh', 'git+http', 'git+https'):
-            if isdir(target):
-                with current_directory(target):
-                    shprint(sh.git, 'fetch', '--tags')
-                    if self.version:
-                        shprint(sh.git, 'checkout', self.version)
-                    shprint(sh.git, 'pull')
-                    shprint(sh.git, 'pull', '--recurse-submodules')
-                    shprint(sh.git, 'submodule', 'update', '--recursive')
-            else:
-                if url.startswith('git+'):
-                    url = url[4:]
-                shprint(sh.git, 'clone', '--recursive', url, target)
-                if self.version:
-                    with current_directory(target):
-                        shprint(sh.git, 'checkout', self.version)
-                        shprint(sh.git, 'submodule', 'update', '--recursive')
+            if url.startswith('git+'):
+                url = url[4:]
+            # The checkout borrows the objects of a shared mirror of the
+            # remote, see pythonforandroid.gitcache
+            gitcache.checkout(self.ctx, url, self.version, target)
             return target
 
     def extract_source(self, source, cwd):
@@ -297,6 +324,35 @@ class Recipe(object):
 
         return join(self.get_build_container_dir(arch), self.name)
 
+    def get_staging_dir(self, arch):
+        '''The dir the build installs its outputs into, laid out as the
+        python-install dir, before they are copied there by
+        :meth:`install_staging_dir`. Each build of the recipe starts
+        with an empty staging dir, so that its outputs are known without
+        looking at the python-install dir, which every recipe writes
+        to.'''
+        return join(self.get_build_container_dir(arch.arch),
+                    'staging_{}'.format(self.name))
+
+    def clean_staging_dir(self, arch):
+        staging_dir = self.get_staging_dir(arch)
+        if exists(staging_dir):
+            shutil.rmtree(staging_dir)
+        ensure_dir(staging_dir)
+
+    def install_staging_dir(self, arch):
+        '''Copies the files of the staging dir to the python-install
+        dir.'''
+        staging_dir = self.get_staging_dir(arch)
+        python_install_dir = self.ctx.get_python_install_dir(arch)
+        for root, dirnames, filenames in walk(staging_dir):
+            target_dir = join(python_install_dir,
+                              relpath(root, staging_dir))
+            ensure_dir(target_dir)
+            for filename in filenames:
+                shutil.copy2(join(root, filename),
+                             join(target_dir, filename))
+
     def get_recipe_dir(self):
         # AND: Redundant, an equivalent property is already set by get_recipe
         return join(self.ctx.root_dir, 'recipes', self.name)
@@ -319,44 +375,97 @@ class Recipe(object):
 
         url = self.versioned_url
 
-        shprint(sh.mkdir, '-p', join(self.ctx.packages_path, self.name))
-
-        with current_directory(join(self.ctx.packages_path, self.name)):
-            filename = shprint(sh.basename, url).stdout[:-1].decode('utf-8')
-
-            do_download = True
-
-            marker_filename = '.mark-{}'.format(filename)
-            if exists(filename) and isfile(filename):
-                if not exists(marker_filename):
-                    shprint(sh.rm, filename)
-                elif self.md5sum:
-                    current_md5 = shprint(sh.md5sum, filename)
-                    print('downloaded md5: {}'.format(current_md5))
-                    print('expected md5: {}'.format(self.md5sum))
-                    print('md5 not handled yet, exiting')
-                    exit(1)
-                else:
-                    do_download = False
-                    info('{} download already cached, skipping'
-                         .format(self.name))
-
-            # Should check headers here!
-            warning('Should check headers here! Skipping for now.')
-
-            # If we got this far, we will download
-            if do_download:
-                print('Downloading {} from {}'.format(self.name, url))
-
-                shprint(sh.rm, '-f', marker_filename)
-                self.download_file(url, filename)
-                shprint(sh.touch, marker_filename)
-
-                if self.md5sum is not None:
-                    print('downloaded md5: {}'.format(current_md5))
-                    print('expected md5: {}'.format(self.md5sum))
-                    print('md5 not handled yet, exiting')
-                    exit(1)
+        # Paths are kept absolute rather than changing directory, as
+        # several recipes may be downloaded at once
+        packages_dir = join(self.ctx.packages_path, self.name)
+        ensure_dir(packages_dir)
+
+        filename = join(packages_dir, basename(url.rstrip('/')))
+
+        do_download = True
+
+        # The marker records the digests of the download, and is only
+        # written once the download has completed and been verified, so
+        # a partial download is never used
+        marker_filename = join(packages_dir,
+                               '.mark-{}'.format(basename(filename)))
+        expected_digests = self.get_expected_digests()
+        if exists(filename) and isfile(filename):
+            if not exists(marker_filename):
+                unlink(filename)
+            elif not expected_digests or self.check_digests(
+                    self.read_download_marker(marker_filename, filename),
+                    expected_digests):
+                do_download = False
+                info('{} download already cached, skipping'
+                     .format(self.name))
+            else:
+                warning('{} download doesn\'t match the expected digests, '
+                        'downloading it again'.format(self.name))
+                unlink(filename)
+
+        # Should check headers here!
+        warning('Should check headers here! Skipping for now.')
+
+        # If we got this far, we will download
+        if do_download:
+            print('Downloading {} from {}'.format(self.name, url))
+
+            if exists(marker_filename):
+                unlink(marker_filename)
+            for attempt in range(self.download_attempts):
+                digests = self.download_file(url, filename)
+                if not isfile(filename):
+                    # e.g. a git clone, which is not checked
+                    digests = {}
+                    break
+                if self.check_digests(digests, expected_digests):
+                    break
+                warning('{} download doesn\'t match the expected digests '
+                        '(expected {}, downloaded {})'.format(
+                            self.name, expected_digests, digests))
+                unlink(filename)
+            else:
+                error('{} download failed to match the expected digests {} '
+                      'times, exiting.'.format(self.name,
+                                               self.download_attempts))
+                exit(1)
+
+            with open(marker_filename, 'w') as fileh:
+                json.dump(digests, fileh)
+
+    def get_expected_digests(self):
+        '''(internal) Returns a dict of the digests the download must
+        have, from :attr:`md5sum` and :attr:`sha256sum`.'''
+        return dict([(name, digest.lower()) for name, digest in
+                     (('md5', self.md5sum), ('sha256', self.sha256sum))
+                     if digest])
+
+    def check_digests(self, digests, expected_digests):
+        '''(internal) Whether the digests of a download are the expected
+        ones.'''
+        return all([digests.get(name) == digest
+                    for name, digest in expected_digests.items()])
+
+    def read_download_marker(self, marker_filename, filename):
+        '''(internal) Returns the digests of the download recorded in its
+        marker. Markers written before digests were recorded are updated
+        by hashing the download once.'''
+        try:
+            with open(marker_filename) as fileh:
+                return json.load(fileh)
+        except ValueError:
+            pass
+        hashes = dict([(name, hashlib.new(name)) for name in DIGEST_NAMES])
+        with open(filename, 'rb') as fileh:
+            for block in iter(lambda: fileh.read(1024 * 64), b''):
+                for file_hash in hashes.values():
+                    file_hash.update(block)
+        digests = dict([(name, file_hash.hexdigest())
+                        for name, file_hash in hashes.items()])
+        with open(marker_filename, 'w') as fileh:
+            json.dump(digests, fileh)
+        return digests
 
     def unpack(self, arch):
         info_main('Unpacking {} for {}'.format(self.name, arch))
@@ -365,63 +474,37 @@ class Recipe(object):
 
         user_dir = environ.get('P4A_{}_DIR'.format(self.name.lower()))
         if user_dir is not None:
-            info('P4A_{}_DIR exists, symlinking instead'.format(
+            info('P4A_{}_DIR exists, checking out its current commit'.format(
                 self.name.lower()))
-            # AND: Currently there's something wrong if I use ln, fix this
-            warning('Using git clone instead of symlink...fix this!')
             if exists(self.get_build_dir(arch)):
                 return
-            shprint(sh.rm, '-rf', build_dir)
-            shprint(sh.mkdir, '-p', build_dir)
-            shprint(sh.rmdir, build_dir)
             ensure_dir(build_dir)
-            shprint(sh.git, 'clone', user_dir, self.get_build_dir(arch))
+            version = str(sh.git('rev-parse', 'HEAD', _cwd=user_dir,
+                                 _tty_out=False)).strip()
+            gitcache.checkout(self.ctx, realpath(user_dir), version,
+                              self.get_build_dir(arch))
             return
 
         if self.url is None:
             info('Skipping {} unpack as no URL is set'.format(self.name))
             return
 
-        filename = shprint(
-            sh.basename, self.versioned_url).stdout[:-1].decode('utf-8')
+        filename = basename(self.versioned_url)
 
         with current_directory(build_dir):
             directory_name = self.get_build_dir(arch)
 
-            # AND: Could use tito's get_archive_rootdir here
             if not exists(directory_name) or not isdir(directory_name):
                 extraction_filename = join(
                     self.ctx.packages_path, self.name, filename)
                 if isfile(extraction_filename):
-                    if extraction_filename.endswith('.tar.gz') or \
-                       extraction_filename.endswith('.tgz'):
-                        sh.tar('xzf', extraction_filename)
-                        root_directory = shprint(
-                            sh.tar, 'tzf', extraction_filename).stdout.decode(
-                                'utf-8').split('\n')[0].split('/')[0]
-                        if root_directory != directory_name:
-                            shprint(sh.mv, root_directory, directory_name)
-                    elif (extraction_filename.endswith('.tar.bz2') or
-                          extraction_filename.endswith('.tbz2')):
-                        info('Extracting {} at {}'
-                             .format(extraction_filename, filename))
-                        sh.tar('xjf', extraction_filename)
-                        root_directory = sh.tar(
-                            'tjf', extraction_filename).stdout.decode(
-                                'utf-8').split('\n')[0].split('/')[0]
-                        if root_directory != directory_name:
-                            shprint(sh.mv, root_directory, directory_name)
-                    elif extraction_filename.endswith('.zip'):
-                        sh.unzip(extraction_filename)
-                        import zipfile
-                        fileh = zipfile.ZipFile(extraction_filename, 'r')
-                        root_directory = fileh.filelist[0].filename.strip('/')
-                        if root_directory != directory_name:
-                            shprint(sh.mv, root_directory, directory_name)
-                    else:
+                    if not is_archive(extraction_filename):
                         raise Exception(
                             'Could not extract {} download, it must be .zip, '
-                            '.tar.gz or .tar.bz2')
+                            '.tar.gz, .tar.bz2 or .tar.xz'.format(filename))
+                    info('Extracting {} to {}'.format(
+                        extraction_filename, directory_name))
+                    extract_archive(extraction_filename, directory_name)
                 elif isdir(extraction_filename):
                     mkdir(directory_name)
                     for entry in listdir(extraction_filename):
@@ -484,8 +567,11 @@ class Recipe(object):
         '''Should perform any necessary test and return True only if it needs
         building again.
 
+        By default, this returns True unless the fingerprint of the build
+        inputs (see :mod:`pythonforandroid.fingerprints`) matches the one
+        recorded after the last successful build.
         '''
-        return True
+        return not self.ctx.fingerprints.matches(self, arch)
 
     def build_arch(self, arch):
         '''Run any build tasks for the Recipe. By default, this checks if
@@ -538,21 +624,11 @@ class Recipe(object):
 
     @classmethod
     def recipe_dirs(cls, ctx):
-        return [ctx.local_recipes,
-                join(ctx.storage_dir, 'recipes'),
-                join(ctx.root_dir, "recipes")]
+        return recipeindex.get_recipe_dirs(ctx)
 
     @classmethod
     def list_recipes(cls, ctx):
-        forbidden_dirs = ('__pycache__', )
-        for recipes_dir in cls.recipe_dirs(ctx):
-            if recipes_dir and exists(recipes_dir):
-                for name in listdir(recipes_dir):
-                    if name in forbidden_dirs:
-                        continue
-                    fn = join(recipes_dir, name)
-                    if isdir(fn):
-                        yield name
+        return recipeindex.list_recipes(ctx)
 
     @classmethod
     def get_recipe(cls, name, ctx):
@@ -564,6 +640,8 @@ class Recipe(object):
 
         recipe_file = None
         for recipes_dir in cls.recipe_dirs(ctx):
+            if not recipes_dir:
+                continue
             recipe_file = join(recipes_dir, name, '__init__.py')
             if exists(recipe_file):
                 break
@@ -618,6 +696,11 @@ class BootstrapNDKRecipe(Recipe):
     def get_jni_dir(self):
         return join(self.ctx.bootstrap.build_dir, 'jni')
 
+    def should_build(self, arch):
+        # The jni dir is shared by every dist using the bootstrap, and
+        # ndk-build only rebuilds what has changed anyway
+        return True
+
 
 class NDKRecipe(Recipe):
     '''A recipe class for any NDK project not included in the bootstrap.'''
@@ -631,7 +714,7 @@ class NDKRecipe(Recipe):
             if not exists(join(lib_dir, lib)):
                 return True
 
-        return False
+        return super(NDKRecipe, self).should_build(arch)
 
     def get_lib_dir(self, arch):
         return join(self.get_build_dir(arch.arch), 'obj', 'local', arch.arch)
@@ -669,6 +752,14 @@ class PythonRecipe(Recipe):
     setup_extra_args = []
     '''List of extra arugments to pass to setup.py'''
 
+    parallel_compile = False
+    '''If True, the C files of each extension module are compiled in
+    parallel by setup.py build_ext (see :meth:`set_parallel_compile_env`).
+    Set this to False for modules whose setup.py replaces the distutils
+    compiler in a way that doesn't allow it.'''
+
+    build_cache = True
+
     @property
     def hostpython_location(self):
         if not self.call_hostpython_via_targetpython:
@@ -677,16 +768,42 @@ class PythonRecipe(Recipe):
                 'hostpython')
         return self.ctx.hostpython
 
+    def set_parallel_compile_env(self, env):
+        '''Sets up env so that a setup.py run with it compiles the C files
+        of each extension module in parallel, if the recipe allows it.
+        The distutils compiler is patched by the sitecustomize module of
+        tools/parallelcompile, which keeps the number of compiles running
+        at once within ctx.compile_jobs over every recipe being built.'''
+        if not self.parallel_compile:
+            return
+        jobs = self.ctx.compile_jobs or cpu_count()
+        if jobs <= 1:
+            return
+        slots_dir = join(self.ctx.storage_dir, 'compile_slots')
+        ensure_dir(slots_dir)
+        env['P4A_COMPILE_JOBS'] = str(jobs)
+        env['P4A_COMPILE_SLOTS'] = slots_dir
+        # numpy.distutils has its own parallel compile, which replaces
+        # the patched one
+        env['NPY_NUM_BUILD_JOBS'] = str(jobs)
+        pythonpath = [join(self.ctx.root_dir, 'tools', 'parallelcompile')]
+        if env.get('PYTHONPATH'):
+            pythonpath.append(env['PYTHONPATH'])
+        env['PYTHONPATH'] = ':'.join(pythonpath)
+
     def should_build(self, arch):
-        print('name is', self.site_packages_name, type(self))
         name = self.site_packages_name
         if name is None:
             name = self.name
-        if self.ctx.has_package(name):
-            info('Python package already exists in site-packages')
-            return False
-        info('{} apparently isn\'t already in site-packages'.format(name))
-        return True
+        if not self.ctx.has_package(name, arch):
+            info('{} apparently isn\'t already in site-packages'.format(name))
+            return True
+        if super(PythonRecipe, self).should_build(arch):
+            info('Python package already exists in site-packages, but its '
+                 'build inputs have changed')
+            return True
+        info('Python package already exists in site-packages')
+        return False
 
     def build_arch(self, arch):
         '''Install the Python module by calling setup.py install with
@@ -705,13 +822,19 @@ class PythonRecipe(Recipe):
 
         info('Installing {} into site-packages'.format(self.name))
 
+        # The module is installed into the staging dir, laid out as the
+        # python-install dir, then copied to the python-install dir
+        self.clean_staging_dir(arch)
+        staging_args = ['--root={}'.format(self.get_staging_dir(arch)),
+                        '--prefix=/',
+                        '--install-lib=lib/python2.7/site-packages']
         with current_directory(self.get_build_dir(arch.arch)):
             # hostpython = sh.Command(self.ctx.hostpython)
             hostpython = sh.Command(self.hostpython_location)
 
             if self.call_hostpython_via_targetpython:
-                shprint(hostpython, 'setup.py', 'install', '-O2', _env=env,
-                        *self.setup_extra_args)
+                shprint(hostpython, 'setup.py', 'install', '-O2',
+                        *(staging_args + self.setup_extra_args), _env=env)
             else:
                 hppath = join(dirname(self.hostpython_location), 'Lib',
                               'site-packages')
@@ -722,10 +845,9 @@ class PythonRecipe(Recipe):
                 else:
                     hpenv['PYTHONPATH'] = hppath
                 shprint(hostpython, 'setup.py', 'install', '-O2',
-                        '--root={}'.format(self.ctx.get_python_install_dir()),
-                        '--install-lib=lib/python2.7/site-packages',
-                        _env=hpenv, *self.setup_extra_args)
+                        *(staging_args + self.setup_extra_args), _env=hpenv)
                 # AND: Hardcoded python2.7 needs fixing
+            self.install_staging_dir(arch)
 
             # If asked, also install in the hostpython build dir
             if self.install_in_hostpython:
@@ -738,6 +860,8 @@ class PythonRecipe(Recipe):
 class CompiledComponentsPythonRecipe(PythonRecipe):
     pre_build_ext = False
 
+    parallel_compile = True
+
     build_cmd = 'build_ext'
 
     def build_arch(self, arch):
@@ -752,6 +876,7 @@ class CompiledComponentsPythonRecipe(PythonRecipe):
         info('Building compiled components in {}'.format(self.name))
 
         env = self.get_recipe_env(arch)
+        self.set_parallel_compile_env(env)
         with current_directory(self.get_build_dir(arch.arch)):
             hostpython = sh.Command(self.hostpython_location)
             if self.call_hostpython_via_targetpython:
@@ -767,14 +892,20 @@ class CompiledComponentsPythonRecipe(PythonRecipe):
                 shprint(hostpython, 'setup.py', self.build_cmd, '-v', _env=env,
                         *self.setup_extra_args)
             build_dir = glob.glob('build/lib.*')[0]
-            shprint(sh.find, build_dir, '-name', '"*.o"', '-exec',
-                    env['STRIP'], '{}', ';', _env=env)
+            strip_tree(self.ctx, env['STRIP'].split(), [build_dir], '*.o',
+                       env)
 
 
 class CythonRecipe(PythonRecipe):
     pre_build_ext = False
+    '''Whether to run setup.py build_ext (which is expected to fail)
+    before cythonizing, for setup.py scripts generating files the .pyx
+    files need, such as .pxi files.'''
+
     cythonize = True
 
+    parallel_compile = True
+
     def build_arch(self, arch):
         '''Build any cython components, then install the Python module by
         calling setup.py install with the target Python dir.
@@ -788,27 +919,31 @@ class CythonRecipe(PythonRecipe):
         env = self.get_recipe_env(arch)
         with current_directory(self.get_build_dir(arch.arch)):
             hostpython = sh.Command(self.ctx.hostpython)
-            info('Trying first build of {} to get cython files: this is '
-                 'expected to fail'.format(self.name))
-            try:
-                shprint(hostpython, 'setup.py', 'build_ext', _env=env,
-                        *self.setup_extra_args)
-            except sh.ErrorReturnCode_1:
-                print()
-                info('{} first build failed (as expected)'.format(self.name))
+            if self.pre_build_ext:
+                info('Trying first build of {} to get cython files: this '
+                     'is expected to fail'.format(self.name))
+                try:
+                    shprint(hostpython, 'setup.py', 'build_ext', _env=env,
+                            *self.setup_extra_args)
+                except sh.ErrorReturnCode_1:
+                    print()
+                    info('{} first build failed (as expected)'.format(
+                        self.name))
 
             info('Running cython where appropriate')
-            shprint(sh.find, self.get_build_dir(arch.arch), '-iname', '*.pyx',
-                    '-exec', self.ctx.cython, '{}', ';', _env=env)
+            cythonize_tree(self.ctx, self.get_build_dir(arch.arch), env,
+                           jobs=self.ctx.compile_jobs or None)
             info('ran cython')
 
+            self.set_parallel_compile_env(env)
+
             shprint(hostpython, 'setup.py', 'build_ext', '-v', _env=env,
                     _tail=20, _critical=True, *self.setup_extra_args)
 
             print('stripping')
             build_lib = glob.glob('./build/lib*')
-            shprint(sh.find, build_lib[0], '-name', '*.o', '-exec',
-                    env['STRIP'], '{}', ';', _env=env)
+            strip_tree(self.ctx, env['STRIP'].split(), build_lib[:1], '*.o',
+                       env)
             print('stripped!?')
             # exit(1)
 
@@ -832,9 +967,9 @@ class CythonRecipe(PythonRecipe):
         env['LDFLAGS'] = env['LDFLAGS'] + ' -L{}'.format(
             self.ctx.get_libs_dir(arch.arch) +
             '-L{}'.format(self.ctx.libs_dir))
-        env['LDSHARED'] = join(self.ctx.root_dir, 'tools', 'liblink')
+        env['LDSHARED'] = join(self.ctx.root_dir, 'tools', 'liblink.sh')
         env['LIBLINK'] = 'NOTNONE'
-        env['NDKPLATFORM'] = self.ctx.ndk_platform
+        env['NDKPLATFORM'] = arch.ndk_platform
 
         # Every recipe uses its own liblink path, object files are
         # collected and biglinked later
@@ -0,0 +1,324 @@
+'''An index of the metadata of the recipes (their version, url,
+dependencies and conflicts), used to resolve the requirements, choose
+a bootstrap and list the recipes without importing every recipe
+module, which imports the whole toolchain.
+
+The metadata is read from the class attributes of the recipe class by
+parsing its ``__init__.py`` with :mod:`ast`. This works as long as the
+recipe class only inherits from the base classes of
+:mod:`pythonforandroid.recipe` (or from other classes of the same
+file) and gives these attributes as literals, which is the case for
+almost every recipe. Any other recipe is imported as before.
+
+The index is kept in ``recipe_index.json`` in the storage dir, and the
+entry of each recipe file is parsed again whenever the file's mtime or
+size changes.
+'''
+
+from os.path import join, exists, isdir, realpath, dirname
+from os import listdir, stat, rename, getpid
+import ast
+import json
+
+from pythonforandroid.util import ensure_dir
+
+
+INDEX_VERSION = 1
+
+METADATA_ATTRIBUTES = ('version', 'url', 'depends', 'conflicts',
+                       'opt_depends')
+
+# The defaults of the attributes above, from the Recipe class
+DEFAULT_METADATA = {'version': None,
+                    'url': None,
+                    'depends': [],
+                    'conflicts': [],
+                    'opt_depends': []}
+
+# The classes of pythonforandroid.recipe that leave the attributes above
+# to their defaults
+BASE_CLASSES = ('object', 'Recipe', 'IncludedFilesBehaviour',
+                'BootstrapNDKRecipe', 'NDKRecipe', 'PythonRecipe',
+                'CompiledComponentsPythonRecipe', 'CythonRecipe')
+
+
+def get_recipe_dirs(ctx):
+    '''The dirs recipes are looked for in, in order of precedence.'''
+    return [ctx.local_recipes,
+            join(ctx.storage_dir, 'recipes'),
+            join(ctx.root_dir, "recipes")]
+
+
+def list_recipes(ctx):
+    '''Yields the names of the recipes in the recipe dirs.'''
+    forbidden_dirs = ('__pycache__', )
+    for recipes_dir in get_recipe_dirs(ctx):
+        if recipes_dir and exists(recipes_dir):
+            for name in listdir(recipes_dir):
+                if name in forbidden_dirs:
+                    continue
+                fn = join(recipes_dir, name)
+                if isdir(fn):
+                    yield name
+
+
+def _base_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _class_metadata(classes, name, seen=()):
+    '''Returns the metadata attributes set by the class name, and the
+    classes of the file it inherits from, or None if they cannot be
+    known without importing the file.'''
+    if name in seen:
+        return None
+    node = classes[name]
+    metadata = {}
+    # Bases later in the list are further down the mro
+    for base in reversed(node.bases):
+        base_name = _base_name(base)
+        if base_name in classes:
+            base_metadata = _class_metadata(classes, base_name,
+                                            seen + (name, ))
+            if base_metadata is None:
+                return None
+            metadata.update(base_metadata)
+        elif base_name not in BASE_CLASSES:
+            return None
+
+    for statement in node.body:
+        if isinstance(statement, ast.Assign):
+            targets = statement.targets
+        elif isinstance(statement, (ast.FunctionDef, ast.ClassDef)):
+            targets = [ast.Name(id=statement.name)]
+        else:
+            continue
+        for target in targets:
+            if not isinstance(target, ast.Name):
+                continue
+            if target.id not in METADATA_ATTRIBUTES:
+                continue
+            if not isinstance(statement, ast.Assign):
+                return None  # e.g. a property
+            try:
+                metadata[target.id] = ast.literal_eval(statement.value)
+            except ValueError:
+                return None
+    return metadata
+
+
+def parse_recipe_file(filename):
+    '''Returns the metadata of the recipe in filename, or None if it
+    cannot be read without importing the file.'''
+    with open(filename, 'rb') as fileh:
+        source = fileh.read()
+    try:
+        tree = ast.parse(source, filename)
+    except SyntaxError:
+        return None
+
+    classes = {}
+    recipe_class = None
+    for statement in tree.body:
+        if isinstance(statement, ast.ClassDef):
+            classes[statement.name] = statement
+        elif isinstance(statement, ast.Assign):
+            for target in statement.targets:
+                if isinstance(target, ast.Name) and target.id == 'recipe':
+                    value = statement.value
+                    if (isinstance(value, ast.Call) and
+                            isinstance(value.func, ast.Name) and
+                            not value.args and not value.keywords):
+                        recipe_class = value.func.id
+                    else:
+                        recipe_class = None
+                elif (isinstance(target, ast.Attribute) and
+                      _base_name(target.value) == 'recipe'):
+                    return None  # e.g. recipe.depends = [...]
+
+    if recipe_class not in classes:
+        return None
+    metadata = _class_metadata(classes, recipe_class)
+    if metadata is None:
+        return None
+    result = dict(DEFAULT_METADATA)
+    result.update(metadata)
+    return result
+
+
+class RecipeInfo(object):
+    '''The metadata of a recipe, with the same attributes as the recipe
+    itself.'''
+
+    def __init__(self, name, recipe_dir, metadata):
+        self.name = name
+        self.recipe_dir = recipe_dir
+        for attribute in METADATA_ATTRIBUTES:
+            setattr(self, attribute, metadata[attribute])
+
+    @property
+    def versioned_url(self):
+        if self.url is None:
+            return None
+        return self.url.format(version=self.version)
+
+
+class ConflictMatrix(object):
+    '''Which recipes conflict with each other, as a bitset of the
+    recipes each one conflicts with, so that whole sets of recipes can
+    be checked against each other at once.
+
+    Recipes are given an id (a bit) as they are first met, and a
+    conflict declared by either recipe of a pair is recorded on both.
+    Names without a recipe (python modules) conflict with nothing.
+    The row of a recipe is only complete once the recipes conflicting
+    with it have been loaded too, which :meth:`conflict` takes care of.
+    The matrix lives as long as its index, so the recipes are only read
+    once per process.
+    '''
+
+    def __init__(self, recipe_index):
+        self.recipe_index = recipe_index
+        self.ids = {}  # name -> bit number
+        self.loaded = set()  # names whose own conflicts have been added
+        self.rows = []  # bit number -> bitset of conflicting recipes
+
+    def get_id(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.rows)
+            self.rows.append(0)
+        return self.ids[name]
+
+    def load(self, name):
+        if name in self.loaded:
+            return
+        self.loaded.add(name)
+        bit = self.get_id(name)
+        try:
+            conflicts = self.recipe_index.get(name).conflicts
+        except IOError:
+            conflicts = []
+        for conflict in conflicts:
+            other = self.get_id(conflict)
+            self.rows[bit] |= 1 << other
+            self.rows[other] |= 1 << bit
+
+    def get_mask(self, names):
+        '''Returns the bitset of the given names.'''
+        mask = 0
+        for name in names:
+            self.load(name)
+            mask |= 1 << self.ids[name]
+        return mask
+
+    def get_conflicts_mask(self, names):
+        '''Returns the bitset of the recipes conflicting with any of the
+        given names.'''
+        mask = 0
+        for name in names:
+            self.load(name)
+            mask |= self.rows[self.ids[name]]
+        return mask
+
+    def conflict(self, names, other_names):
+        '''Returns whether any of names conflicts with any of
+        other_names.'''
+        # other_names are loaded first, so that the conflicts they
+        # declare are in the rows of names
+        other_mask = self.get_mask(other_names)
+        return bool(self.get_conflicts_mask(names) & other_mask)
+
+
+class RecipeIndex(object):
+    '''The recipe metadata index of a build context, see the module
+    docstring.'''
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.entries = None  # recipe file -> entry
+        self.infos = {}  # name -> RecipeInfo or Recipe
+        self.conflicts = ConflictMatrix(self)
+
+    def reset(self):
+        '''Forgets which recipe each name refers to, e.g. after changing
+        the local recipes dir. The parsed recipe files are kept.'''
+        self.infos = {}
+        self.conflicts = ConflictMatrix(self)
+
+    @property
+    def filename(self):
+        return join(self.ctx.storage_dir, 'recipe_index.json')
+
+    def load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if not exists(self.filename):
+            return
+        try:
+            with open(self.filename) as fileh:
+                index = json.load(fileh)
+        except ValueError:
+            return
+        if index.get('version') == INDEX_VERSION:
+            self.entries = index['recipes']
+
+    def save(self):
+        ensure_dir(self.ctx.storage_dir)
+        # Written to a temporary file first, so other processes never
+        # read a partial index
+        temp_filename = '{}.{}'.format(self.filename, getpid())
+        with open(temp_filename, 'w') as fileh:
+            json.dump({'version': INDEX_VERSION, 'recipes': self.entries},
+                      fileh, indent=1, sort_keys=True)
+        rename(temp_filename, self.filename)
+
+    def get_recipe_file(self, name):
+        for recipes_dir in get_recipe_dirs(self.ctx):
+            if not recipes_dir:
+                continue
+            recipe_file = join(recipes_dir, name, '__init__.py')
+            if exists(recipe_file):
+                return recipe_file
+        return None
+
+    def get_metadata(self, recipe_file):
+        '''Returns the metadata of the recipe in recipe_file, parsing it
+        if it is not in the index or has changed since.'''
+        self.load()
+        key = realpath(recipe_file)
+        file_stat = stat(key)
+        entry = self.entries.get(key)
+        if (entry is None or entry['mtime'] != file_stat.st_mtime or
+                entry['size'] != file_stat.st_size):
+            entry = {'mtime': file_stat.st_mtime,
+                     'size': file_stat.st_size,
+                     'metadata': parse_recipe_file(key)}
+            self.entries[key] = entry
+            self.save()
+        return entry['metadata']
+
+    def get(self, name):
+        '''Returns the metadata of the recipe with the given name, as a
+        RecipeInfo, or as the Recipe itself if it had to be imported.
+        Like :meth:`Recipe.get_recipe`, this raises IOError if there is
+        no such recipe.'''
+        if name in self.infos:
+            return self.infos[name]
+        recipe_file = self.get_recipe_file(name)
+        if recipe_file is None:
+            raise IOError('Recipe folder does not exist')
+        metadata = self.get_metadata(recipe_file)
+        if metadata is None:
+            # Imported here, as the recipe machinery is only needed for
+            # recipes that can't be read from the index
+            from pythonforandroid.recipe import Recipe
+            info = Recipe.get_recipe(name, self.ctx)
+        else:
+            info = RecipeInfo(name, dirname(recipe_file), metadata)
+        self.infos[name] = info
+        return info
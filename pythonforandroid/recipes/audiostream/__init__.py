@@ -11,6 +11,9 @@ class AudiostreamRecipe(CythonRecipe):
     name = 'audiostream'
     depends = ['python2', ('sdl', 'sdl2'), 'pyjnius']
 
+    # setup.py may generate files the .pyx files need
+    pre_build_ext = True
+
     def get_recipe_env(self, arch):
         if 'sdl' in self.ctx.recipe_build_order:
             sdl_include = 'sdl'
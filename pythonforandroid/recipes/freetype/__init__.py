@@ -13,9 +13,9 @@ class FreetypeRecipe(Recipe):
     depends = ['harfbuzz']
 
     def should_build(self, arch):
-        if exists(join(self.get_build_dir(arch.arch), 'objs', '.libs', 'libfreetype.so')):
-            return False
-        return True
+        if not exists(join(self.get_build_dir(arch.arch), 'objs', '.libs', 'libfreetype.so')):
+            return True
+        return super(FreetypeRecipe, self).should_build(arch)
 
     def build_arch(self, arch):
         env = self.get_recipe_env(arch)
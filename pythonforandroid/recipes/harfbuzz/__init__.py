@@ -11,9 +11,9 @@ class HarfbuzzRecipe(Recipe):
     url = 'http://www.freedesktop.org/software/harfbuzz/release/harfbuzz-{version}.tar.bz2'
 
     def should_build(self, arch):
-        if exists(join(self.get_build_dir(arch.arch), 'src', '.libs', 'libharfbuzz.so')):
-            return False
-        return True
+        if not exists(join(self.get_build_dir(arch.arch), 'src', '.libs', 'libharfbuzz.so')):
+            return True
+        return super(HarfbuzzRecipe, self).should_build(arch)
 
     def build_arch(self, arch):
 
@@ -1,9 +1,13 @@
 
 from pythonforandroid.toolchain import Recipe, shprint, current_directory, info, warning
 from os.path import join, exists
-from os import chdir
+from os import chdir, environ
 import sh
 
+# The variables of the host environment that affect the build
+HOST_ENV_VARIABLES = ('CC', 'CXX', 'CFLAGS', 'CPPFLAGS', 'CXXFLAGS',
+                      'LDFLAGS', 'LIBS')
+
 
 class Hostpython2Recipe(Recipe):
     version = '2.7.2'
@@ -12,6 +16,21 @@ class Hostpython2Recipe(Recipe):
 
     conflicts = ['hostpython3']
 
+    # The build dir is unpacked and compiled again if the build
+    # environment changes, see should_build
+    clean_build_on_change = True
+
+    def get_recipe_env(self, arch=None):
+        # hostpython is built for the host with the host's environment,
+        # so only this (not the arch's) should affect its fingerprint
+        return dict([(name, environ[name]) for name in HOST_ENV_VARIABLES
+                     if name in environ])
+
+    def should_build(self, arch):
+        # build_arch must always run, as it sets ctx.hostpython; it skips
+        # the compilation itself if this was already done
+        return True
+
     def get_build_container_dir(self, arch=None):
         choices = self.check_recipe_choices()
         dir_name = '-'.join([self.name] + choices)
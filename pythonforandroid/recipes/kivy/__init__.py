@@ -13,6 +13,9 @@ class KivyRecipe(CythonRecipe):
 
     depends = [('sdl2', 'pygame'), 'pyjnius']
 
+    # setup.py generates the .pxi files the .pyx files include
+    pre_build_ext = True
+
     def get_recipe_env(self, arch):
         env = super(KivyRecipe, self).get_recipe_env(arch)
         if 'sdl2' in self.ctx.recipe_build_order:
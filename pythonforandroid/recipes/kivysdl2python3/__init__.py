@@ -12,6 +12,9 @@ class KivySDL2Recipe(CythonRecipe):
     site_packages_name = 'kivy'
 
     depends = ['sdl2', 'python2', 'pyjniussdl2']
+
+    # setup.py generates the .pxi files the .pyx files include
+    pre_build_ext = True
     patches = ['android_sdl2_compat.patch']
 
     def get_recipe_env(self, arch):
@@ -9,7 +9,9 @@ class OpenSSLRecipe(Recipe):
     url = 'https://www.openssl.org/source/openssl-{version}.tar.gz'
 
     def should_build(self, arch):
-        return not exists(join(self.get_build_dir(arch.arch), 'libssl.a'))
+        if not exists(join(self.get_build_dir(arch.arch), 'libssl.a')):
+            return True
+        return super(OpenSSLRecipe, self).should_build(arch)
 
     def build_arch(self, arch):
         env = self.get_recipe_env(arch)
@@ -2,6 +2,7 @@
 from pythonforandroid.recipe import Recipe
 from pythonforandroid.util import current_directory, ensure_dir
 from pythonforandroid.logger import debug, shprint, info
+from pythonforandroid.stripping import strip_tree
 from os.path import exists, join
 import sh
 import glob
@@ -22,9 +23,9 @@ class PygameRecipe(Recipe):
         env = super(PygameRecipe, self).get_recipe_env(arch)
         env['LDFLAGS'] = env['LDFLAGS'] + ' -L{}'.format(
             self.ctx.get_libs_dir(arch.arch))
-        env['LDSHARED'] = join(self.ctx.root_dir, 'tools', 'liblink')
+        env['LDSHARED'] = join(self.ctx.root_dir, 'tools', 'liblink.sh')
         env['LIBLINK'] = 'NOTNONE'
-        env['NDKPLATFORM'] = self.ctx.ndk_platform
+        env['NDKPLATFORM'] = arch.ndk_platform
 
         # Every recipe uses its own liblink path, object files are collected and biglinked later
         liblink_path = join(self.get_build_container_dir(arch.arch), 'objects_{}'.format(self.name))
@@ -55,7 +56,7 @@ class PygameRecipe(Recipe):
         env['LDFLAGS'] = env['LDFLAGS'] + ' -L{libs_path} -L{src_path}/obj/local/{arch} -lm -lz'.format(
             libs_path=self.ctx.libs_dir, src_path=self.ctx.bootstrap.build_dir, arch=env['ARCH'])
 
-        env['LDSHARED'] = join(self.ctx.root_dir, 'tools', 'liblink')
+        env['LDSHARED'] = join(self.ctx.root_dir, 'tools', 'liblink.sh')
 
         with current_directory(self.get_build_dir(arch.arch)):
             info('hostpython is ' + self.ctx.hostpython)
@@ -67,8 +68,8 @@ class PygameRecipe(Recipe):
             build_lib = glob.glob('./build/lib*')
             assert len(build_lib) == 1
             print('stripping pygame')
-            shprint(sh.find, build_lib[0], '-name', '*.o', '-exec',
-                    env['STRIP'], '{}', ';')
+            strip_tree(self.ctx, env['STRIP'].split(), build_lib, '*.o',
+                       env)
 
         python_install_path = join(self.ctx.build_dir, 'python-install')
         # AND: Should do some deleting here!
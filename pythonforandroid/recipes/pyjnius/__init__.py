@@ -12,6 +12,9 @@ class PyjniusRecipe(CythonRecipe):
     depends = ['python2', ('sdl2', 'sdl'), 'six']
     site_packages_name = 'jnius'
 
+    # setup.py generates the .pxi files the .pyx files include
+    pre_build_ext = True
+
     patches = [('sdl2_jnienv_getter.patch', will_build('sdl2'))]
 
     def postbuild_arch(self, arch):
@@ -1,6 +1,7 @@
 
 from pythonforandroid.toolchain import Recipe, shprint, current_directory, info
 from pythonforandroid.patching import is_linux, is_darwin, is_api_gt
+from pythonforandroid.snapshots import snapshot_tree, unshare
 from os.path import exists, join, realpath
 import sh
 
@@ -33,20 +34,36 @@ class Python2Recipe(Recipe):
                ('patches/fix-distutils-darwin.patch', is_linux),
                ('patches/fix-ftime-removal.patch', is_api_gt(19))]
 
+    # The build dir is unpacked and compiled again if the build
+    # environment or dependencies change, see should_build
+    clean_build_on_change = True
+
+    def should_build(self, arch):
+        # build_arch must always run, as it installs python into the dist
+        # and sets ctx.hostpython; it skips the compilation itself if
+        # this was already done
+        return True
+
     def build_arch(self, arch):
 
         if not exists(join(self.get_build_dir(arch.arch), 'libpython2.7.so')):
             self.do_python_build(arch)
+            # A new python build replaces any old one in the dist
+            shprint(sh.rm, '-rf', self.ctx.get_python_install_dir(arch))
+            shprint(sh.rm, '-f', join(self.ctx.get_libs_dir(arch.arch),
+                                      'libpython2.7.so'))
 
-        if not exists(self.ctx.get_python_install_dir()):
-            shprint(sh.cp, '-a', join(self.get_build_dir(arch.arch), 'python-install'),
-                    self.ctx.get_python_install_dir())
+        if not exists(self.ctx.get_python_install_dir(arch)):
+            snapshot_tree(join(self.get_build_dir(arch.arch), 'python-install'),
+                          self.ctx.get_python_install_dir(arch))
 
         # This should be safe to run every time
         info('Copying hostpython binary to targetpython folder')
-        shprint(sh.cp, self.ctx.hostpython,
-                join(self.ctx.get_python_install_dir(), 'bin', 'python.host'))
-        self.ctx.hostpython = join(self.ctx.get_python_install_dir(), 'bin', 'python.host')
+        python_host = join(self.ctx.get_python_install_dir(arch), 'bin', 'python.host')
+        if exists(python_host):
+            unshare(python_host)
+        shprint(sh.cp, self.ctx.hostpython, python_host)
+        self.ctx.hostpython = join(self.ctx.get_python_install_dir(arch), 'bin', 'python.host')
 
         if not exists(join(self.ctx.get_libs_dir(arch.arch), 'libpython2.7.so')):
             shprint(sh.cp, join(self.get_build_dir(arch.arch), 'libpython2.7.so'), self.ctx.get_libs_dir(arch.arch))
@@ -13,6 +13,15 @@ class Python3Recipe(Recipe):
     depends = ['hostpython3']  
     conflicts = ['python2']
 
+    # The build dir is unpacked and compiled again if the build
+    # environment or dependencies change, see should_build
+    clean_build_on_change = True
+
+    def should_build(self, arch):
+        # build_arch must always run, as it sets ctx.hostpython; it skips
+        # the compilation itself if this was already done
+        return True
+
     def prebuild_arch(self, arch):
         build_dir = self.get_build_container_dir(arch.arch)
         if exists(join(build_dir, '.patched')):
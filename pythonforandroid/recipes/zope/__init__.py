@@ -17,7 +17,7 @@ class ZopeRecipe(PythonRecipe):
         # These are in the old zope recipe but seem like they shouldn't actually be necessary
         env['LDFLAGS'] = env['LDFLAGS'] + ' -L{}'.format(
             self.ctx.get_libs_dir(arch.arch))
-        env['LDSHARED'] = join(self.ctx.root_dir, 'tools', 'liblink')
+        env['LDSHARED'] = join(self.ctx.root_dir, 'tools', 'liblink.sh')
 
     def postbuild_arch(self, arch):
         super(ZopeRecipe, self).postbuild_arch(arch)
@@ -0,0 +1,166 @@
+'''Runs build jobs (such as the per-recipe build steps) concurrently,
+following the edges of the recipe dependency graph.
+
+Recipes change the working directory (via
+:func:`~pythonforandroid.util.current_directory`) and set attributes
+on the build context as they go, so each job is run in a forked child
+process rather than a thread. Any simple attributes the child sets on
+the context (e.g. ``ctx.hostpython``) are sent back to the parent
+when the job finishes, so that recipes built later see them.
+'''
+
+from os import fork, pipe, read, write, close, waitpid, _exit
+from select import select
+import pickle
+import traceback
+import sys
+
+from six import string_types
+
+from pythonforandroid.logger import (info, info_notify, warning, error)
+from pythonforandroid.graph import Graph
+
+
+def get_recipe_dependencies(recipes):
+    '''Returns a dict mapping each recipe name to the set of names of the
+    recipes in ``recipes`` that must be built before it. Alternative
+    dependencies are resolved to whichever alternative is being built,
+    and optional dependencies are included if they are being built.
+    '''
+    names = set([recipe.name for recipe in recipes])
+    graph = Graph()
+    for recipe in recipes:
+        graph.add(recipe.name, recipe.name)
+        for depend in recipe.depends:
+            if isinstance(depend, (tuple, list)):
+                depend = [alt for alt in depend if alt in names]
+                if not depend:
+                    continue
+                depend = depend[0]
+            if depend in names:
+                graph.add(recipe.name, depend)
+        for depend in recipe.opt_depends:
+            if depend in names:
+                graph.add(recipe.name, depend)
+    return graph.graph
+
+
+def _ctx_state(ctx):
+    '''The attributes of ctx that can be passed back from a child
+    process.'''
+    simple_types = string_types + (int, float, bool, type(None))
+    return dict([(key, value) for key, value in vars(ctx).items()
+                 if isinstance(value, simple_types)])
+
+
+class JobScheduler(object):
+    '''Runs a function for every item of a dict, each in its own worker
+    process, starting each one as soon as all of the jobs it depends on
+    have finished and using at most ``jobs`` worker processes at once.
+
+    ``dependencies`` maps the name of each item to the set of names of
+    the items that must be finished before it is started.
+    '''
+
+    def __init__(self, ctx, items, dependencies, jobs=1):
+        self.ctx = ctx
+        self.items = items
+        self.dependencies = dependencies
+        self.jobs = max(1, jobs)
+
+    def run(self, func):
+        '''Calls ``func(item)`` for every item, each in its own worker
+        process.'''
+        info_notify('Running jobs with up to {} workers'.format(self.jobs))
+        # The number of unfinished dependencies of each job, and the jobs
+        # depending on each, so that finishing a job only has to look at
+        # its dependents to find the jobs it makes ready
+        waiting = dict([(name, len(deps))
+                        for name, deps in self.dependencies.items()])
+        dependents = dict([(name, []) for name in self.dependencies])
+        for name, deps in self.dependencies.items():
+            for dep in deps:
+                dependents[dep].append(name)
+        ready = sorted([name for name, count in waiting.items()
+                        if count == 0])
+        finished = set()
+        running = {}  # read fd -> (name, pid, received data)
+        failed = []
+        while len(finished) < len(self.dependencies):
+            if not failed:
+                while ready and len(running) < self.jobs:
+                    name = ready.pop(0)
+                    pid, fd = self._start(func, name)
+                    running[fd] = (name, pid, [])
+            if not running:
+                if failed:
+                    break
+                raise ValueError('Dependency cycle detected! {}'.format(
+                    self.dependencies))
+
+            readable, _, _ = select(list(running.keys()), [], [])
+            for fd in readable:
+                chunk = read(fd, 65536)
+                if chunk:
+                    running[fd][2].append(chunk)
+                    continue
+                close(fd)
+                name, pid, data = running.pop(fd)
+                _, status = waitpid(pid, 0)
+                if status != 0 or not data:
+                    error('Job for {} failed'.format(name))
+                    failed.append(name)
+                    continue
+                self.ctx.__dict__.update(pickle.loads(b''.join(data)))
+                finished.add(name)
+                for dependent in dependents[name]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        ready.append(dependent)
+                ready.sort()
+                info('Finished job for {} ({}/{})'.format(
+                    name, len(finished), len(self.dependencies)))
+
+        if failed:
+            warning('Jobs failed for: {}'.format(', '.join(failed)))
+            warning('Due to this failure the build cannot continue, exiting.')
+            exit(1)
+
+    def _start(self, func, name):
+        info('Starting job for {}'.format(name))
+        read_fd, write_fd = pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = fork()
+        if pid:
+            close(write_fd)
+            return pid, read_fd
+
+        close(read_fd)
+        status = 1
+        try:
+            before = _ctx_state(self.ctx)
+            func(self.items[name])
+            after = _ctx_state(self.ctx)
+            updates = dict([(key, value) for key, value in after.items()
+                            if key not in before or before[key] != value])
+            data = pickle.dumps(updates, 2)
+            while data:
+                data = data[write(write_fd, data):]
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            _exit(status)
+
+
+class RecipeScheduler(JobScheduler):
+    '''A :class:`JobScheduler` running a function for each recipe, in an
+    order that respects the dependencies between them.'''
+
+    def __init__(self, ctx, recipes, jobs=1):
+        super(RecipeScheduler, self).__init__(
+            ctx, dict([(recipe.name, recipe) for recipe in recipes]),
+            get_recipe_dependencies(recipes), jobs)
@@ -0,0 +1,100 @@
+'''Cheap copies (snapshots) of dir trees, used for the python-install
+dirs, which are copied from the python build to each dist's build
+dirs and then into the dist itself.
+
+A snapshot is made with reflinks (copy-on-write clones of the files)
+where the filesystem supports them, which costs no more than creating
+the dir entries. Otherwise the files of the snapshot are hard links to
+those of the original, so a snapshot shares its files with the
+original until they are replaced. Anything changing a file of a
+snapshot in place must call :func:`unshare` on it first; files that
+are deleted, or replaced by writing a new file and renaming it, need
+nothing special.
+'''
+
+from os.path import join, exists, isdir, islink, relpath
+from os import walk, lstat, link, symlink, readlink, makedirs, rename
+import errno
+import shutil
+import subprocess
+
+from pythonforandroid.logger import info, debug
+
+# Whether reflinks work on each device, by the st_dev of the original
+_reflink_devices = {}
+
+
+def _reflink_tree(src, dst):
+    '''Copies src to dst with reflinks, returning False if the filesystem
+    (or cp) does not support them.'''
+    device = lstat(src).st_dev
+    if _reflink_devices.get(device) is False:
+        return False
+    try:
+        with open('/dev/null', 'w') as devnull:
+            subprocess.check_call(['cp', '-a', '--reflink=always', src, dst],
+                                  stdout=devnull, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        _reflink_devices[device] = False
+        if exists(dst):
+            shutil.rmtree(dst)
+        return False
+    _reflink_devices[device] = True
+    return True
+
+
+def _link_tree(src, dst):
+    '''Copies src to dst with hard links to its files, falling back to
+    copying those that can't be linked (e.g. across devices). Returns
+    the number of files copied rather than linked.'''
+    copied = 0
+    dirs = []
+    for root, dirnames, filenames in walk(src):
+        dst_root = join(dst, relpath(root, src))
+        makedirs(dst_root)
+        dirs.append((root, dst_root))
+        for name in dirnames + filenames:
+            path = join(root, name)
+            dst_path = join(dst_root, name)
+            if islink(path):
+                symlink(readlink(path), dst_path)
+                if name in dirnames:
+                    continue  # walk does not go into links to dirs
+            elif name in dirnames:
+                continue
+            else:
+                try:
+                    link(path, dst_path)
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EPERM,
+                                       errno.EMLINK):
+                        raise
+                    shutil.copy2(path, dst_path)
+                    copied += 1
+    # The dirs' times are set last, as creating their entries changes
+    # them
+    for root, dst_root in reversed(dirs):
+        shutil.copystat(root, dst_root)
+    return copied
+
+
+def snapshot_tree(src, dst):
+    '''Makes dst (which must not exist) a snapshot of the dir src, see
+    the module docstring.'''
+    if _reflink_tree(src, dst):
+        debug('Made {} as a reflinked copy of {}'.format(dst, src))
+        return
+    copied = _link_tree(src, dst)
+    info('Made {} with hard links to {}{}'.format(
+        dst, src, ' ({} files copied)'.format(copied) if copied else ''))
+
+
+def unshare(filename):
+    '''Makes sure filename is not shared with a snapshot (is not hard
+    linked), so that it can be changed in place.'''
+    stat = lstat(filename)
+    if islink(filename) or isdir(filename) or stat.st_nlink < 2:
+        return
+    temp_filename = filename + '.unshare'
+    shutil.copy2(filename, temp_filename)
+    rename(temp_filename, filename)
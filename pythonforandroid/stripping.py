@@ -0,0 +1,351 @@
+'''Strips binaries (the libraries of a dist, or the objects built by a
+recipe) in batches, several at once, with a cache of stripped files.
+
+Each strip command is given many files, and the batches are run in
+parallel, using up to ctx.compile_jobs (by default, one per CPU)
+commands at once. The output of strip only depends on its input and on
+the strip command, so ``strip_cache`` in the storage dir records, for
+each command, the hash of the output made from each file hash: files
+that already are the output of the command (e.g. stripped by an
+earlier build step, or files strip doesn't recognise) are left alone.
+Copies of the outputs are kept too, so that files stripped before are
+copied from there rather than stripped again; only the most recently
+used ones are kept, up to MAX_OUTPUTS_SIZE bytes, along with the
+MAX_ENTRIES most recently used hashes.
+
+The numbers of files stripped and of bytes saved, and the time spent,
+are logged for each build step, and in total at the end of the
+recipe builds and of the distribution (see :func:`log_totals`).
+'''
+
+from os.path import join, exists, isabs, isdir, realpath
+from os import walk, stat, rename, makedirs, getpid, listdir, unlink, utime
+from multiprocessing import cpu_count
+import fnmatch
+import hashlib
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from six import reraise
+
+from pythonforandroid.logger import info, warning, debug
+from pythonforandroid.snapshots import unshare
+from pythonforandroid.tracing import tracer
+from pythonforandroid.util import which
+
+# The most files given to one strip command
+MAX_BATCH_SIZE = 64
+
+# The most bytes of stripped files kept in the cache, and the most
+# hashes of files recorded, over all the strip commands
+MAX_OUTPUTS_SIZE = 256 * 1024 * 1024
+MAX_ENTRIES = 20000
+
+# What strip says about files that are not binaries it can strip, which
+# are recorded as their own output. Other failures (e.g. a full disk)
+# are not recorded, so the files are stripped again next time.
+UNRECOGNISED_FORMAT_ERRORS = (
+    'file format not recognized',
+    'unable to recognise the format',
+    'not recognized as a valid object file')
+
+# The stripping done since the last log_totals
+totals = {'files': 0, 'commands': 0, 'hits': 0, 'saved': 0, 'time': 0.}
+totals_lock = threading.Lock()
+
+
+def _hash_file(filename):
+    file_hash = hashlib.sha1()
+    with open(filename, 'rb') as fileh:
+        for block in iter(lambda: fileh.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def _write_atomically(filename, write):
+    '''Calls write(temp_filename) and renames the result to filename, so
+    other processes never see a partial file.'''
+    temp_filename = '{}.{}.{}'.format(filename, getpid(),
+                                      threading.current_thread().ident)
+    write(temp_filename)
+    rename(temp_filename, filename)
+
+
+def find_files(directories, pattern):
+    '''Returns the files under the given dirs whose names match pattern
+    (ignoring case, as find -iname).'''
+    filenames = []
+    for directory in directories:
+        for root, dirnames, names in walk(directory):
+            for name in sorted(names):
+                if fnmatch.fnmatch(name.lower(), pattern.lower()):
+                    filenames.append(join(root, name))
+    return filenames
+
+
+class StripCache(object):
+    '''The files made by a strip command, see the module docstring.'''
+
+    def __init__(self, ctx, command, env):
+        self.ctx = ctx
+        program = command[0]
+        if not isabs(program):
+            program = which(program, env.get('PATH', '')) or program
+        command_hash = hashlib.sha1()
+        command_hash.update(' '.join([realpath(program)] +
+                                     command[1:]).encode('utf-8'))
+        if exists(program):
+            program_stat = stat(program)
+            command_hash.update('{} {}'.format(
+                program_stat.st_size, program_stat.st_mtime).encode('utf-8'))
+        self.root_dir = join(ctx.storage_dir, 'strip_cache')
+        self.cache_dir = join(self.root_dir, command_hash.hexdigest())
+
+    def lookup(self, file_hash):
+        '''Returns the hash of the output of the command for a file with
+        this hash, or None if it isn't known.'''
+        input_filename = join(self.cache_dir, 'inputs', file_hash)
+        try:
+            with open(input_filename) as fileh:
+                output_hash = fileh.read().strip()
+            utime(input_filename, None)
+        except (IOError, OSError):
+            return None  # never recorded, or pruned meanwhile
+        return output_hash or None
+
+    def restore(self, output_hash, filename):
+        '''Replaces filename with the cached output with this hash.
+        Returns whether it was still in the cache.'''
+        output_filename = join(self.cache_dir, 'outputs', output_hash)
+        try:
+            _replace(filename, output_filename)
+            utime(output_filename, None)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def record(self, file_hash, output_hash):
+        '''Records output_hash as the hash of the output of the command
+        for the file with the hash file_hash.'''
+        self._make_dir('inputs')
+        for input_hash in set([file_hash, output_hash]):
+            # The output is recorded as its own output, to be left alone
+            _write_atomically(join(self.cache_dir, 'inputs', input_hash),
+                              lambda temp: self._write_hash(temp,
+                                                            output_hash))
+
+    def store(self, file_hash, filename):
+        '''Records filename as the output of the command for the file
+        with the hash file_hash, and keeps a copy of it.'''
+        output_hash = _hash_file(filename)
+        if output_hash != file_hash:
+            self._make_dir('outputs')
+            output_filename = join(self.cache_dir, 'outputs', output_hash)
+            if not exists(output_filename):
+                _write_atomically(
+                    output_filename,
+                    lambda temp: shutil.copyfile(filename, temp))
+        self.record(file_hash, output_hash)
+
+    def prune(self):
+        '''Deletes the least recently used outputs and hashes beyond
+        MAX_OUTPUTS_SIZE and MAX_ENTRIES, of every strip command.'''
+        outputs = []
+        inputs = []
+        if not isdir(self.root_dir):
+            return
+        for command_dir in listdir(self.root_dir):
+            for name, files in (('outputs', outputs), ('inputs', inputs)):
+                directory = join(self.root_dir, command_dir, name)
+                if not isdir(directory):
+                    continue
+                for filename in listdir(directory):
+                    if '.' in filename:
+                        continue  # being written by _write_atomically
+                    path = join(directory, filename)
+                    try:
+                        file_stat = stat(path)
+                    except OSError:
+                        continue  # pruned by another process
+                    files.append((file_stat.st_mtime, file_stat.st_size,
+                                  path))
+        size = sum([file_size for _, file_size, _ in outputs])
+        removed = []
+        for _, file_size, path in sorted(outputs):
+            if size <= MAX_OUTPUTS_SIZE:
+                break
+            removed.append(path)
+            size -= file_size
+        removed.extend([path for _, _, path in
+                        sorted(inputs)[:max(0, len(inputs) - MAX_ENTRIES)]])
+        for path in removed:
+            try:
+                unlink(path)
+            except OSError:
+                pass
+        if removed:
+            debug('Pruned {} files from the strip cache'.format(
+                len(removed)))
+
+    def _make_dir(self, name):
+        if not exists(join(self.cache_dir, name)):
+            try:
+                makedirs(join(self.cache_dir, name))
+            except OSError:
+                pass  # made by another process meanwhile
+
+    @staticmethod
+    def _write_hash(filename, output_hash):
+        with open(filename, 'w') as fileh:
+            fileh.write(output_hash)
+
+
+def _replace(filename, cached):
+    '''Replaces filename with a copy of cached, keeping its mode.'''
+    def write(temp_filename):
+        shutil.copyfile(cached, temp_filename)
+        shutil.copymode(filename, temp_filename)
+    _write_atomically(filename, write)
+
+
+def _run_strip(command, filenames, env):
+    process = subprocess.Popen(command + filenames, env=env,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output = process.communicate()[0].decode('utf-8', 'replace')
+    return process.returncode == 0, output
+
+
+def strip_files(ctx, command, filenames, env, jobs=None):
+    '''Strips the given files in place with command (a list, e.g.
+    ``[strip, '--strip-unneeded']``), see the module docstring. Files
+    that can't be stripped are left as they are.'''
+    if not filenames:
+        return
+    start = time.time()
+    cache = StripCache(ctx, command, env)
+    size_before = 0
+    queue = []  # (filename, hash) of the files to strip
+    stripped = 0
+    hits = 0
+    for filename in filenames:
+        size_before += stat(filename).st_size
+        file_hash = _hash_file(filename)
+        output_hash = cache.lookup(file_hash)
+        if output_hash == file_hash:
+            stripped += 1
+            continue
+        if output_hash is not None and cache.restore(output_hash, filename):
+            hits += 1
+            continue
+        queue.append((filename, file_hash))
+
+    if jobs is None:
+        jobs = ctx.compile_jobs or cpu_count()
+    jobs = max(1, jobs)
+    batch_size = max(1, min(MAX_BATCH_SIZE, -(-len(queue) // jobs)))
+    batches = [queue[i:i + batch_size]
+               for i in range(0, len(queue), batch_size)]
+    commands = [len(batches)]
+    batches_lock = threading.Lock()
+    failures = []
+
+    def strip_batch(batch):
+        # Files in the batch may be snapshots, shared with the build
+        # dirs, and strip may change them in place
+        for filename, _ in batch:
+            unshare(filename)
+        success, output = _run_strip(command, [name for name, _ in batch],
+                                     env)
+        if success:
+            for filename, file_hash in batch:
+                cache.store(file_hash, filename)
+            return
+        # strip goes on to the next files after one it fails on, so
+        # only the files it left unchanged are stripped again one by
+        # one, to find which ones it fails on
+        for filename, file_hash in batch:
+            if _hash_file(filename) != file_hash:
+                cache.store(file_hash, filename)
+                continue
+            success, output = _run_strip(command, [filename], env)
+            with batches_lock:
+                commands[0] += 1
+            if success:
+                cache.store(file_hash, filename)
+            elif any([error in output.lower()
+                      for error in UNRECOGNISED_FORMAT_ERRORS]):
+                # e.g. not an ELF file, which is recorded as its own
+                # output, to be left alone
+                debug('Not stripping {}: {}'.format(filename,
+                                                    output.strip()))
+                if _hash_file(filename) == file_hash:
+                    cache.record(file_hash, file_hash)
+            else:
+                warning('Failed to strip {}: {}'.format(filename,
+                                                        output.strip()))
+
+    def strip_worker():
+        while not failures:
+            with batches_lock:
+                if not batches:
+                    return
+                batch = batches.pop(0)
+            try:
+                strip_batch(batch)
+            except BaseException:
+                failures.append(sys.exc_info())
+
+    threads = [threading.Thread(target=strip_worker)
+               for _ in range(min(jobs, len(batches)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        reraise(*failures[0])
+    if queue:
+        cache.prune()
+
+    saved = size_before - sum([stat(filename).st_size
+                               for filename in filenames])
+    duration = time.time() - start
+    info('Stripped {} files with {} commands ({} from the cache, {} already '
+         'stripped) in {:.1f}s, saving {} bytes'.format(
+             len(filenames), commands[0], hits, stripped, duration, saved))
+    with totals_lock:
+        totals['files'] += len(filenames)
+        totals['commands'] += commands[0]
+        totals['hits'] += hits + stripped
+        totals['saved'] += saved
+        totals['time'] += duration
+
+
+def strip_tree(ctx, command, directories, pattern, env, jobs=None):
+    '''Strips the files under the given dirs whose names match
+    pattern, see :func:`strip_files`.'''
+    strip_files(ctx, command, find_files(directories, pattern), env,
+                jobs=jobs)
+
+
+def log_totals(stage):
+    '''Logs the stripping done since the last call, during the given
+    build stage, and adds it to the counters of the build summary when
+    tracing.'''
+    with totals_lock:
+        current = dict(totals)
+        totals.update({'files': 0, 'commands': 0, 'hits': 0, 'saved': 0,
+                       'time': 0.})
+    if not current['files']:
+        return
+    info('Stripping during {}: {} files, {} from the cache, saving {} bytes '
+         'in {:.1f}s'.format(stage, current['files'], current['hits'],
+                             current['saved'], current['time']))
+    tracer.count('strip files', current['files'])
+    tracer.count('strip commands', current['commands'])
+    tracer.count('strip cache hits', current['hits'])
+    tracer.count('strip bytes saved', current['saved'])
+    tracer.count('strip time (ms)', int(current['time'] * 1000))
@@ -12,46 +12,89 @@ import sys
 from sys import platform
 from os.path import (join, dirname, realpath, exists, expanduser)
 import os
-import glob
 import shutil
 import re
-import imp
+import importlib
 import logging
 import shlex
 from functools import wraps
 
 import argparse
-import sh
 
-
-from pythonforandroid.recipe import (Recipe, PythonRecipe, CythonRecipe,
-                                     CompiledComponentsPythonRecipe,
-                                     BootstrapNDKRecipe, NDKRecipe)
-from pythonforandroid.archs import (ArchARM, ArchARMv7_a, Archx86)
 from pythonforandroid.logger import (logger, info, warning, debug,
                                      Out_Style, Out_Fore, Err_Style, Err_Fore,
                                      info_notify, info_main, shprint,
                                      Null_Fore, Null_Style)
-from pythonforandroid.util import current_directory, ensure_dir
-from pythonforandroid.bootstrap import Bootstrap
-from pythonforandroid.distribution import Distribution, pretty_log_dists
-from pythonforandroid.graph import get_recipe_order_and_bootstrap
-from pythonforandroid.build import Context, build_recipes
+from pythonforandroid.util import get_storage_dir
+from pythonforandroid.recipeindex import RecipeIndex, list_recipes
+from pythonforandroid.tracing import tracer
+from pythonforandroid.stripping import log_totals as log_strip_totals
 
 user_dir = dirname(realpath(os.path.curdir))
 toolchain_dir = dirname(__file__)
 sys.path.insert(0, join(toolchain_dir, "tools", "external"))
 
-
-info(''.join(
-    [Err_Style.BRIGHT, Err_Fore.RED,
-     'This python-for-android revamp is an experimental alpha release!',
-     Err_Style.RESET_ALL]))
-info(''.join(
-    [Err_Fore.RED,
-     ('It should work (mostly), but you may experience '
-      'missing features or bugs.'),
-     Err_Style.RESET_ALL]))
+# The names recipes and bootstraps import from here (e.g. ``from
+# pythonforandroid.toolchain import Recipe, shprint``), and the modules
+# they come from. The build machinery is slow to import, so each command
+# imports what it uses itself, and these are only imported when first
+# used (see PEP 562), or straight away on Pythons that can't do this.
+LAZY_NAMES = {
+    'pythonforandroid.recipe': (
+        'Recipe', 'PythonRecipe', 'CythonRecipe',
+        'CompiledComponentsPythonRecipe', 'BootstrapNDKRecipe',
+        'NDKRecipe'),
+    'pythonforandroid.archs': ('ArchARM', 'ArchARMv7_a', 'Archx86'),
+    'pythonforandroid.util': ('current_directory', 'ensure_dir', 'which'),
+    'pythonforandroid.bootstrap': ('Bootstrap', ),
+    'pythonforandroid.distribution': ('Distribution', 'pretty_log_dists'),
+    'pythonforandroid.graph': ('get_recipe_order_and_bootstrap',
+                               'find_levels'),
+    'pythonforandroid.scheduler': ('get_recipe_dependencies', ),
+    'pythonforandroid.build': ('Context', 'build_recipes'),
+    'pythonforandroid.artifacts': ('ArtifactCache', ),
+    }
+
+
+def __getattr__(name):
+    for module, names in LAZY_NAMES.items():
+        if name in names:
+            value = getattr(importlib.import_module(module), name)
+            globals()[name] = value
+            return value
+    raise AttributeError('module {} has no attribute {}'.format(
+        __name__, name))
+
+if sys.version_info < (3, 7):
+    for _names in LAZY_NAMES.values():
+        for _name in _names:
+            __getattr__(_name)
+
+
+def print_banner():
+    info(''.join(
+        [Err_Style.BRIGHT, Err_Fore.RED,
+         'This python-for-android revamp is an experimental alpha release!',
+         Err_Style.RESET_ALL]))
+    info(''.join(
+        [Err_Fore.RED,
+         ('It should work (mostly), but you may experience '
+          'missing features or bugs.'),
+         Err_Style.RESET_ALL]))
+
+
+class StorageDirs(object):
+    '''The dirs of a build context, for the commands that only list what
+    is in them. Unlike :class:`~pythonforandroid.build.Context`, this
+    does not import the build machinery or create any dirs.'''
+
+    def __init__(self, local_recipes=None):
+        self.root_dir = realpath(dirname(__file__))
+        self.storage_dir = get_storage_dir()
+        self.build_dir = join(self.storage_dir, 'build')
+        self.dist_dir = join(self.storage_dir, 'dists')
+        self.local_recipes = local_recipes
+        self.recipe_index = RecipeIndex(self)
 
 
 def add_boolean_option(parser, names, no_names=None,
@@ -91,6 +134,7 @@ def require_prebuilt_dist(func):
 
     @wraps(func)
     def wrapper_func(self, args):
+        print_banner()
         ctx = self.ctx
         ctx.set_archs(self._archs)
         ctx.prepare_build_environment(user_sdk_dir=self.sdk_dir,
@@ -110,6 +154,7 @@ def dist_from_args(ctx, dist_args):
     '''Parses out any distribution-related arguments, and uses them to
     obtain a Distribution class instance for the build.
     '''
+    from pythonforandroid.distribution import Distribution
     return Distribution.get_distribution(
         ctx,
         name=dist_args.dist_name,
@@ -123,6 +168,9 @@ def dist_from_args(ctx, dist_args):
 def build_dist_from_args(ctx, dist, args_list):
     '''Parses out any bootstrap related arguments, and uses them to build
     a dist.'''
+    from pythonforandroid.bootstrap import Bootstrap
+    from pythonforandroid.graph import get_recipe_order_and_bootstrap
+    from pythonforandroid.build import build_recipes
     parser = argparse.ArgumentParser(
         description='Create a newAndroid project')
     parser.add_argument(
@@ -150,7 +198,14 @@ def build_dist_from_args(ctx, dist, args_list):
 
     build_recipes(build_order, python_modules, ctx)
 
-    ctx.bootstrap.run_distribute()
+    with tracer.span('run_distribute', 'build', bootstrap=bs.name):
+        ctx.bootstrap.run_distribute()
+    log_strip_totals('the distribution')
+
+    if tracer.enabled:
+        info_main('# Build summary (times in seconds)')
+        for line in tracer.summary_lines():
+            print(line)
 
     info_main('# Your distribution was created successfully, exiting.')
     info('Dist can be found at (for now) {}'
@@ -168,8 +223,12 @@ def split_argument_list(l):
 
 class ToolchainCL(object):
 
-    def __init__(self):
-        self._ctx = None
+    def __init__(self, ctx=None):
+        # A Context may be given to be reused, as by the build daemon
+        self._ctx = ctx
+        self._ctx_reused = ctx is not None
+        self._ctx_configured = False
+        self._dirs = None
 
         parser = argparse.ArgumentParser(
                 description="Tool for managing the Android / Python toolchain",
@@ -183,9 +242,11 @@ build_status  Informations about the current build
 create        Build an android project with all recipes
 clean_all     Delete all build components
 clean_builds  Delete all build caches
+clean_build_cache    Delete the cache of recipe build outputs
 clean_dists   Delete all compiled distributions
 clean_download_cache Delete any downloaded recipe packages
 clean_recipe_build   Delete the build files of a recipe
+daemon        Run a build daemon that later commands are passed to
 distributions List all distributions
 export_dist   Copies a created dist to an output directory
 logcat        Runs logcat from the detected SDK dir
@@ -216,6 +277,37 @@ build_dist
             '--ndk_version', dest='ndk_version', default='',
             help=('The version of the Android NDK. This is optional, '
                   'we try to work it out automatically from the ndk_dir.'))
+        parser.add_argument(
+            '--jobs', dest='jobs', default=1, type=int,
+            help=('The number of recipes that may be built at once. '
+                  'Recipes are started as soon as their dependencies '
+                  'have been built.'))
+        parser.add_argument(
+            '--download-jobs', '--download_jobs', dest='download_jobs',
+            default=4, type=int,
+            help='The number of recipe downloads that may run at once.')
+        parser.add_argument(
+            '--download-segments', '--download_segments',
+            dest='download_segments', default=1, type=int,
+            help=('The number of connections each large download may be '
+                  'fetched over at once, if the server allows this.'))
+        parser.add_argument(
+            '--compile-jobs', '--compile_jobs', dest='compile_jobs',
+            default=0, type=int,
+            help=('The number of C files that may be compiled at once, '
+                  'over all the recipes being built, and of .pyx files '
+                  'each recipe may cythonize at once. The default is one '
+                  'per CPU.'))
+        parser.add_argument(
+            '--reprobe', dest='reprobe', action='store_true', default=False,
+            help=('Check the Android SDK, NDK and build tools again, '
+                  'rather than reusing what was found by an earlier '
+                  'command.'))
+        parser.add_argument(
+            '--trace', dest='trace', default=None,
+            help=('Write a trace of the time spent in each build phase '
+                  'and command to this file, in the Chrome trace event '
+                  'format.'))
 
         # AND: This option doesn't really fit in the other categories, the
         # arg structure needs a rethink
@@ -261,6 +353,12 @@ build_dist
             description=('Whether the dist recipes must perfectly match '
                          'those requested'))
 
+        add_boolean_option(
+            parser, ["build-cache"],
+            default=True,
+            description=('Whether to restore recipe builds from the build '
+                         'artifact cache when their inputs are unchanged:'))
+
         parser.add_argument(
             '--local-recipes', '--local_recipes',
             dest='local_recipes', default='./p4a-recipes',
@@ -299,9 +397,15 @@ build_dist
             parser.print_help()
             exit(1)
 
-        self.ctx.local_recipes = args.local_recipes
+        if args.trace is not None:
+            tracer.start(realpath(expanduser(args.trace)))
 
-        getattr(self, args.command)(unknown)
+        try:
+            getattr(self, args.command)(unknown)
+        finally:
+            if tracer.enabled:
+                info('Writing build trace to {}'.format(tracer.filename))
+            tracer.finish()
 
     def _read_configuration(self):
         # search for a .p4a configuration file in the current directory
@@ -318,16 +422,47 @@ build_dist
 
     @property
     def ctx(self):
-        if self._ctx is None:
-            self._ctx = Context()
+        '''The build context, created when first used, as this imports the
+        build machinery and creates the storage dirs.'''
+        if not self._ctx_configured:
+            from pythonforandroid.build import Context
+            from pythonforandroid.artifacts import ArtifactCache
+            args = self.dist_args
+            if self._ctx is None:
+                self._ctx = Context()
+            self._ctx.local_recipes = args.local_recipes
+            if self._ctx_reused:
+                self._ctx.forget_shadowed_recipes()
+            self._ctx.jobs = args.jobs
+            self._ctx.download_jobs = args.download_jobs
+            self._ctx.download_segments = args.download_segments
+            self._ctx.compile_jobs = args.compile_jobs
+            self._ctx.reprobe = args.reprobe
+            if args.build_cache:
+                self._ctx.artifact_cache = ArtifactCache(self._ctx)
+            else:
+                self._ctx.artifact_cache = None
+            self._ctx_configured = True
         return self._ctx
 
+    @property
+    def dirs(self):
+        '''The storage dirs, for commands that only list their contents.'''
+        if self._dirs is None:
+            self._dirs = StorageDirs(self.dist_args.local_recipes)
+        return self._dirs
+
     def recipes(self, args):
         parser = argparse.ArgumentParser(
                 description="List all the available recipes")
         parser.add_argument(
                 "--compact", action="store_true", default=False,
                 help="Produce a compact list suitable for scripting")
+        parser.add_argument(
+                "--levels", action="store_true", default=False,
+                help=("List the recipes grouped by the level at which "
+                      "they can be built, where each level only depends "
+                      "on the ones before it"))
 
         add_boolean_option(
                 parser, ["color"],
@@ -342,12 +477,26 @@ build_dist
             Fore = Null_Fore
             Style = Null_Style
 
-        ctx = self.ctx
-        if args.compact:
-            print(" ".join(set(Recipe.list_recipes(ctx))))
+        ctx = self.dirs
+        if args.levels:
+            from pythonforandroid.graph import find_levels
+            from pythonforandroid.scheduler import get_recipe_dependencies
+            recipes = [ctx.recipe_index.get(name)
+                       for name in sorted(list_recipes(ctx))]
+            levels = find_levels(get_recipe_dependencies(recipes))
+            for i, level in enumerate(levels):
+                if args.compact:
+                    print(" ".join(level))
+                else:
+                    print('{Fore.BLUE}{Style.BRIGHT}level {i}:'
+                          '{Style.RESET_ALL} {names}'.format(
+                            Fore=Fore, Style=Style, i=i,
+                            names=' '.join(level)))
+        elif args.compact:
+            print(" ".join(set(list_recipes(ctx))))
         else:
-            for name in sorted(Recipe.list_recipes(ctx)):
-                recipe = Recipe.get_recipe(name, ctx)
+            for name in sorted(list_recipes(ctx)):
+                recipe = ctx.recipe_index.get(name)
                 version = str(recipe.version)
                 print('{Fore.BLUE}{Style.BRIGHT}{recipe.name:<12} '
                       '{Style.RESET_ALL}{Fore.LIGHTBLUE_EX}'
@@ -367,8 +516,9 @@ build_dist
 
     def bootstraps(self, args):
         '''List all the bootstraps available to build with.'''
+        from pythonforandroid.bootstrap import Bootstrap
         for bs in Bootstrap.list_bootstraps():
-            bs = Bootstrap.get_bootstrap(bs, self.ctx)
+            bs = Bootstrap.get_bootstrap(bs, self.dirs)
             print('{Fore.BLUE}{Style.BRIGHT}{bs.name}{Style.RESET_ALL}'
                   .format(bs=bs, Fore=Out_Fore, Style=Out_Style))
             print('    {Fore.GREEN}depends: {bs.recipe_depends}{Fore.RESET}'
@@ -380,9 +530,16 @@ build_dist
         parser = argparse.ArgumentParser(
                 description="Clean the build cache, downloads and dists")
         parsed_args = parser.parse_args(args)
+        from pythonforandroid import gitcache
         self.clean_dists(args)
         self.clean_builds(args)
+        self.clean_build_cache(args)
         self.clean_download_cache(args)
+        # The git mirrors are only deleted along with the builds, as
+        # checkouts in the build dirs borrow their objects
+        mirrors_dir = gitcache.get_mirrors_dir(self.dirs)
+        if exists(mirrors_dir):
+            shutil.rmtree(mirrors_dir)
 
     def clean_dists(self, args):
         '''Delete all compiled distributions in the internal distribution
@@ -390,7 +547,7 @@ build_dist
         parser = argparse.ArgumentParser(
                 description="Delete any distributions that have been built.")
         args = parser.parse_args(args)
-        ctx = Context()
+        ctx = self.dirs
         if exists(ctx.dist_dir):
             shutil.rmtree(ctx.dist_dir)
 
@@ -405,17 +562,33 @@ build_dist
         parser = argparse.ArgumentParser(
                 description="Delete all build files (but not download caches)")
         args = parser.parse_args(args)
-        ctx = Context()
+        ctx = self.dirs
         # if exists(ctx.dist_dir):
         #     shutil.rmtree(ctx.dist_dir)
         if exists(ctx.build_dir):
             shutil.rmtree(ctx.build_dir)
-        if exists(ctx.python_installs_dir):
-            shutil.rmtree(ctx.python_installs_dir)
-        libs_dir = join(self.ctx.build_dir, 'libs_collections')
+        # The python-installs, javaclasses and aars dirs are in the build
+        # dir too
+        libs_dir = join(ctx.build_dir, 'libs_collections')
         if exists(libs_dir):
             shutil.rmtree(libs_dir)
 
+    def clean_build_cache(self, args):
+        '''Delete the cache of recipe build outputs, so that every recipe
+        is built again rather than restored from the cache.
+
+        This does *not* delete the build dirs themselves, see
+        clean_builds for that.
+        '''
+        parser = argparse.ArgumentParser(
+                description="Delete the cache of recipe build outputs")
+        args = parser.parse_args(args)
+        from pythonforandroid.artifacts import ArtifactCache
+        ctx = self.dirs
+        cache_dir = ArtifactCache(ctx).cache_dir
+        if exists(cache_dir):
+            shutil.rmtree(cache_dir)
+
     def clean_recipe_build(self, args):
         '''Deletes the build files of the given recipe.
 
@@ -430,6 +603,7 @@ build_dist
         parser.add_argument('recipe', help='The recipe name')
         args = parser.parse_args(args)
 
+        from pythonforandroid.recipe import Recipe
         recipe = Recipe.get_recipe(args.recipe, self.ctx)
         info('Cleaning build for {} recipe.'.format(recipe.name))
         recipe.clean_build()
@@ -438,14 +612,16 @@ build_dist
         '''
         Deletes any downloaded recipe packages.
 
-        This does *not* delete the build caches or final distributions.
+        This does *not* delete the build caches or final distributions,
+        nor the mirrors of git repositories, which are deleted by
+        clean_all.
         '''
         parser = argparse.ArgumentParser(
                 description="Delete all download caches")
         args = parser.parse_args(args)
-        ctx = Context()
-        if exists(ctx.packages_path):
-            shutil.rmtree(ctx.packages_path)
+        packages_path = join(self.dirs.storage_dir, 'packages')
+        if exists(packages_path):
+            shutil.rmtree(packages_path)
 
     @require_prebuilt_dist
     def export_dist(self, args):
@@ -468,6 +644,7 @@ build_dist
                  'with suitable recipes available. For now, you must '
                  ' create one first with the create argument.')
             exit(1)
+        import sh
         shprint(sh.cp, '-r', dist.dist_dir, args.output)
 
     @require_prebuilt_dist
@@ -492,6 +669,7 @@ build_dist
                  'with suitable recipes available. For now, you must '
                  'create one first with the create argument.')
             exit(1)
+        import sh
         shprint(sh.ln, '-s', dist.dist_dir, args.output)
 
     # def _get_dist(self):
@@ -507,6 +685,10 @@ build_dist
     @require_prebuilt_dist
     def apk(self, args):
         '''Create an APK using the given distribution.'''
+        import glob
+        import imp
+        import sh
+        from pythonforandroid.util import current_directory
 
         # AND: Need to add a parser here for any extra options
         # parser = argparse.ArgumentParser(
@@ -565,7 +747,7 @@ build_dist
         python-for-android will internally use for package building, along
         with information about where the Android SDK and NDK will be called
         from.'''
-        ctx = Context()
+        ctx = self.ctx
         for attribute in ('root_dir', 'build_dir', 'dist_dir', 'libs_dir',
                           'ccache', 'cython', 'sdk_dir', 'ndk_dir',
                           'ndk_platform', 'ndk_ver', 'android_api'):
@@ -575,17 +757,119 @@ build_dist
         '''List the target architectures available to be built for.'''
         print('{Style.BRIGHT}Available target architectures are:'
               '{Style.RESET_ALL}'.format(Style=Out_Style))
-        for arch in self.ctx.archs:
+        from pythonforandroid.archs import ArchARM, ArchARMv7_a, Archx86
+        for arch in (ArchARM, ArchARMv7_a, Archx86):
             print('    {}'.format(arch.arch))
 
     def dists(self, args):
         '''The same as :meth:`distributions`.'''
         self.distributions(args)
 
+    def _explain_build_status(self, args):
+        from pythonforandroid.bootstrap import Bootstrap
+        from pythonforandroid.graph import get_recipe_order_and_bootstrap
+        from pythonforandroid.recipe import Recipe
+        ctx = self.ctx
+        ctx.set_archs(self._archs)
+        ctx.prepare_build_environment(user_sdk_dir=self.sdk_dir,
+                                      user_ndk_dir=self.ndk_dir,
+                                      user_android_api=self.android_api,
+                                      user_ndk_ver=self.ndk_version)
+        dist = self._dist
+        if not dist.needs_build:
+            info('Dist {} already exists, and will be used without building '
+                 'anything. The recipes would be built as follows.'.format(
+                     dist.name))
+
+        bs = Bootstrap.get_bootstrap(args.bootstrap, ctx)
+        build_order, python_modules, bs = get_recipe_order_and_bootstrap(
+            ctx, dist.recipes, bs)
+        bs.distribution = dist
+        bs.build_dir = bs.get_build_dir()
+        ctx.bootstrap = bs
+        ctx.dist_name = dist.name
+        ctx.recipe_build_order = build_order
+        recipes = [Recipe.get_recipe(name, ctx) for name in build_order]
+
+        for arch in ctx.archs:
+            ctx.fingerprints.compute(recipes, arch)
+            print('{Style.BRIGHT}Recipes of dist {dist} with the {bs} '
+                  'bootstrap for {arch}:{Style.RESET_ALL}'.format(
+                      Style=Out_Style, dist=dist.name, bs=bs.name,
+                      arch=arch.arch))
+            for recipe in recipes:
+                reasons = ctx.fingerprints.explain(recipe, arch)
+                if not recipe.should_build(arch):
+                    status = '{Fore.GREEN}up to date{Fore.RESET}'
+                elif reasons:
+                    status = ('{Fore.YELLOW}will be built, as ' +
+                              ', '.join(reasons) + '{Fore.RESET}')
+                elif recipe.clean_build_on_change:
+                    status = ('{Fore.YELLOW}will run its build, which '
+                              'reuses what was compiled in its build dir, '
+                              'as the build environment and dependencies '
+                              'are unchanged{Fore.RESET}')
+                else:
+                    status = ('{Fore.YELLOW}will be built, as the recipe '
+                              'always runs its build or its outputs are '
+                              'missing{Fore.RESET}')
+                print(('    {Style.BRIGHT}{name}{Style.RESET_ALL}: ' +
+                       status).format(name=recipe.name, Fore=Out_Fore,
+                                      Style=Out_Style))
+
+    def daemon(self, args):
+        '''Runs a build daemon in the foreground, which keeps the recipes,
+        bootstraps, the results of checking the Android SDK and NDK and
+        the list of dists loaded between commands. While it runs, every
+        other p4a command run by the same user is passed to it over a
+        Unix socket in the storage dir and runs in a copy of it, with the
+        command's own arguments, current dir, environment and terminal,
+        so commands start without loading all these again. Set
+        P4A_NO_DAEMON=1 to run a command by itself regardless.
+
+        Needs Python 3.3 or later. Use ``--status`` to show what the
+        running daemon is doing, and ``--stop`` to stop it once its
+        running commands have finished.
+        '''
+        parser = argparse.ArgumentParser(
+            description='Run a build daemon that later commands are '
+                        'passed to')
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument(
+            '--status', action='store_true', default=False,
+            help='Show the state of the running daemon')
+        group.add_argument(
+            '--stop', action='store_true', default=False,
+            help='Stop the running daemon')
+        args = parser.parse_args(args)
+
+        from pythonforandroid.daemon import BuildDaemon, send_control
+        if not args.status and not args.stop:
+            BuildDaemon().serve_forever()
+            return
+        reply = send_control('status' if args.status else 'stop')
+        if reply is None:
+            warning('No build daemon is running')
+            exit(1)
+        if args.stop:
+            info('The build daemon will stop once its commands have '
+                 'finished')
+            return
+        print('{Style.BRIGHT}Build daemon {pid}{Style.RESET_ALL}, running '
+              'for {uptime:.0f}s, {requests} commands run'.format(
+                  Style=Out_Style, **reply))
+        print('    {recipes} recipes, {environments} prepared build '
+              'environments and {dists} dists loaded'.format(**reply))
+        for argv in reply['running']:
+            print('    {Fore.GREEN}running: p4a {argv}{Fore.RESET}'.format(
+                Fore=Out_Fore, argv=' '.join(argv)))
+
     def distributions(self, args):
         '''Lists all distributions currently available (i.e. that have already
         been built).'''
-        ctx = Context()
+        from pythonforandroid.distribution import (Distribution,
+                                                   pretty_log_dists)
+        ctx = self.dirs
         dists = Distribution.get_distributions(ctx)
 
         if dists:
@@ -615,6 +899,7 @@ build_dist
         parser.add_argument('tool', help=('The tool binary name to run'))
         args, unknown = parser.parse_known_args(args)
 
+        import sh
         ctx = self.ctx
         ctx.prepare_build_environment(user_sdk_dir=self.sdk_dir,
                                       user_ndk_dir=self.ndk_dir,
@@ -632,6 +917,7 @@ build_dist
         arguments straight to it. This is intended as a convenience
         function if adb is not in your $PATH.
         '''
+        import sh
         ctx = self.ctx
         ctx.prepare_build_environment(user_sdk_dir=self.sdk_dir,
                                       user_ndk_dir=self.ndk_dir,
@@ -653,18 +939,40 @@ build_dist
         self.adb(['logcat'] + args)
 
     def build_status(self, args):
+        '''Lists the bootstraps and recipes that are probably already built.
+        With --explain, says instead why each recipe of the requested dist
+        will or will not be built again.'''
+        parser = argparse.ArgumentParser(
+            description='Information about the state of the builds')
+        parser.add_argument(
+            '--explain', action='store_true', default=False,
+            help=('Explain why each recipe of the requested dist will '
+                  'or will not be built again'))
+        parser.add_argument(
+            '--bootstrap', default=None,
+            help='The bootstrap the dist would be built with')
+        args = parser.parse_args(args)
 
+        if args.explain:
+            self._explain_build_status(args)
+            return
+
+        build_dir = self.dirs.build_dir
         print('{Style.BRIGHT}Bootstraps whose core components are probably '
               'already built:{Style.RESET_ALL}'.format(Style=Out_Style))
-        for filen in os.listdir(join(self.ctx.build_dir, 'bootstrap_builds')):
+        if exists(join(build_dir, 'bootstrap_builds')):
+            filens = os.listdir(join(build_dir, 'bootstrap_builds'))
+        else:
+            filens = []
+        for filen in filens:
             print('    {Fore.GREEN}{Style.BRIGHT}{filen}{Style.RESET_ALL}'
                   .format(filen=filen, Fore=Out_Fore, Style=Out_Style))
 
         print('{Style.BRIGHT}Recipes that are probably already built:'
               '{Style.RESET_ALL}'.format(Style=Out_Style))
-        if exists(join(self.ctx.build_dir, 'other_builds')):
+        if exists(join(build_dir, 'other_builds')):
             for filen in sorted(
-                    os.listdir(join(self.ctx.build_dir, 'other_builds'))):
+                    os.listdir(join(build_dir, 'other_builds'))):
                 name = filen.split('-')[0]
                 dependencies = filen.split('-')[1:]
                 recipe_str = ('    {Style.BRIGHT}{Fore.GREEN}{name}'
@@ -679,6 +987,12 @@ build_dist
 
 
 def main():
+    # If a build daemon is running, the command is run by it instead
+    if sys.argv[1:2] != ['daemon']:
+        from pythonforandroid.daemon import run_client
+        status = run_client(sys.argv[1:])
+        if status is not None:
+            sys.exit(status)
     ToolchainCL()
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+#!/bin/sh
+
+# The same as liblink, as a shell script: this runs once for every
+# extension module that is built, and starting a python interpreter
+# each time costs more than the link itself.
+
+libs=
+output=
+skip=
+
+# The objects replace the arguments in "$@", as they are parsed
+n=$#
+while [ $n -gt 0 ]; do
+    opt=$1
+    shift
+    n=$((n - 1))
+
+    if [ -n "$skip" ]; then
+        if [ "$skip" = output ]; then
+            output=$opt
+        fi
+        skip=
+        continue
+    fi
+
+    case $opt in
+        -o)
+            skip=output ;;
+        -l*|-L*)
+            libs="${libs:+$libs }$opt" ;;
+        -r|-pipe|-no-cpp-precomp)
+            ;;
+        --sysroot|-isysroot|-framework|-undefined|-macosx_version_min)
+            skip=argument ;;
+        -I*|-m*|-f*|-O*|-g*|-D*)
+            ;;
+        -*)
+            echo "Unknown option: $opt"
+            exit 1 ;;
+        *.o)
+            set -- "$@" "$opt" ;;
+    esac
+done
+
+: > "$output"
+
+output=$LIBLINK_PATH/${output##*/}
+
+printf '%s' "$libs" > "$output.libs"
+
+exec "$LD" -r -o "$output.o" "$@"
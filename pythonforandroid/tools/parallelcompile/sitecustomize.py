@@ -0,0 +1,124 @@
+'''Makes distutils compile the source files of each extension in
+parallel.
+
+This dir is put first in the PYTHONPATH of the setup.py builds of
+recipes that allow it, so that python imports this module at startup.
+It replaces CCompiler.compile with a version compiling up to
+P4A_COMPILE_JOBS objects at once. Every compile holds one of the
+P4A_COMPILE_JOBS lock files of the dir P4A_COMPILE_SLOTS while it
+runs, so that the limit holds over all the builds running at once.
+Linking is left alone, so LDSHARED (liblink) sees the same objects in
+the same order as before.
+
+Any other sitecustomize module in the path is imported afterwards, as
+it would have been without this one.
+'''
+
+import os
+import sys
+import threading
+import time
+
+
+def _acquire_slot(slots_dir, jobs):
+    '''Locks and returns a free slot file, waiting for one if
+    necessary.'''
+    import fcntl
+    while True:
+        for number in range(jobs):
+            fileh = open(os.path.join(slots_dir, 'slot{}'.format(number)),
+                         'a')
+            try:
+                fcntl.flock(fileh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                fileh.close()
+                continue
+            return fileh
+        time.sleep(0.05)
+
+
+def _release_slot(fileh):
+    import fcntl
+    fcntl.flock(fileh, fcntl.LOCK_UN)
+    fileh.close()
+
+
+def _patch_distutils(jobs, slots_dir):
+    try:
+        from distutils import ccompiler
+    except ImportError:
+        return
+
+    def compile(self, sources, output_dir=None, macros=None,
+                include_dirs=None, debug=0, extra_preargs=None,
+                extra_postargs=None, depends=None):
+        # As CCompiler.compile, but with the _compile calls run from
+        # several threads
+        macros, objects, extra_postargs, pp_opts, build = \
+            self._setup_compile(output_dir, macros, include_dirs, sources,
+                                depends, extra_postargs)
+        cc_args = self._get_cc_args(pp_opts, debug, extra_preargs)
+
+        queue = [obj for obj in objects if obj in build]
+        queue_lock = threading.Lock()
+        failures = []
+
+        def compile_worker():
+            while not failures:
+                with queue_lock:
+                    if not queue:
+                        return
+                    obj = queue.pop(0)
+                src, ext = build[obj]
+                slot = None
+                if slots_dir:
+                    slot = _acquire_slot(slots_dir, jobs)
+                try:
+                    self._compile(obj, src, ext, cc_args, extra_postargs,
+                                  pp_opts)
+                except BaseException:
+                    failures.append(sys.exc_info())
+                finally:
+                    if slot is not None:
+                        _release_slot(slot)
+
+        threads = [threading.Thread(target=compile_worker)
+                   for _ in range(min(jobs, len(queue)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise failures[0][1]
+
+        return objects
+
+    ccompiler.CCompiler.compile = compile
+
+
+def _import_next_sitecustomize():
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    module = sys.modules.pop('sitecustomize', None)
+    path = sys.path[:]
+    sys.path[:] = [entry for entry in sys.path
+                   if os.path.abspath(entry or '.') != this_dir]
+    try:
+        import sitecustomize  # noqa
+    except ImportError:
+        if module is not None:
+            sys.modules['sitecustomize'] = module
+    finally:
+        sys.path[:] = path
+
+
+def _main():
+    try:
+        jobs = int(os.environ.get('P4A_COMPILE_JOBS', '1'))
+    except ValueError:
+        jobs = 1
+    if jobs > 1:
+        _patch_distutils(jobs, os.environ.get('P4A_COMPILE_SLOTS'))
+    _import_next_sitecustomize()
+
+
+_main()
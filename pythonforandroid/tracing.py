@@ -0,0 +1,177 @@
+'''Tracing of the time spent in each phase of a build.
+
+When enabled with ``--trace FILE``, the build phases of every recipe
+(download, unpack, prebuild, patch, build, postbuild), the biglink and
+distribution steps, and every command run with
+:func:`~pythonforandroid.logger.shprint` are recorded as spans with
+their start time, duration, recipe, arch and command. At the end of
+the run they are written to FILE in the Chrome trace event format,
+which can be loaded in chrome://tracing or https://ui.perfetto.dev.
+Counters (e.g. of work avoided by caches) are recorded as counter
+events, and their totals are printed after the table of build phases.
+
+Spans may be recorded from the worker processes used for parallel
+builds, so each one is appended to a shared events file as soon as it
+ends, and the trace is assembled from this file by the process that
+started the tracing.
+'''
+
+from os.path import exists
+from os import getpid
+import os
+import contextlib
+import json
+import threading
+import time
+
+
+RECIPE_PHASES = ('download', 'unpack', 'prebuild', 'patch', 'build',
+                 'postbuild')
+
+
+class Tracer(object):
+    '''Records spans to a trace file, see the module docstring.'''
+
+    def __init__(self):
+        self.filename = None
+        self._fd = None
+        self._pid = None
+        self._local = threading.local()
+        self._counters = {}  # name -> value, in this process
+        self._counters_pid = None
+
+    @property
+    def enabled(self):
+        return self.filename is not None
+
+    @property
+    def events_filename(self):
+        return self.filename + '.events'
+
+    def start(self, filename):
+        '''Starts recording spans, to be written to filename.'''
+        self.filename = filename
+        self._pid = getpid()
+        self._fd = os.open(self.events_filename,
+                           os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                           os.O_APPEND)
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        '''Context manager recording a span for the code run inside it.
+        The recipe and arch of the enclosing span are used if not given
+        in args.'''
+        if not self.enabled:
+            yield
+            return
+        stack = self._stack()
+        span_args = dict(stack[-1]) if stack else {}
+        span_args.update(args)
+        stack.append(span_args)
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            stack.pop()
+            self._write({'name': name,
+                         'cat': category,
+                         'ph': 'X',
+                         'ts': int(start * 1e6),
+                         'dur': int((end - start) * 1e6),
+                         'pid': getpid(),
+                         'tid': threading.current_thread().ident,
+                         'args': span_args})
+
+    def count(self, name, value=1):
+        '''Adds value to the counter name of this process.'''
+        if not self.enabled:
+            return
+        if self._counters_pid != getpid():  # a new worker process
+            self._counters = {}
+            self._counters_pid = getpid()
+        self._counters[name] = self._counters.get(name, 0) + value
+        self._write({'name': name,
+                     'cat': 'counter',
+                     'ph': 'C',
+                     'ts': int(time.time() * 1e6),
+                     'pid': getpid(),
+                     'args': {name: self._counters[name]}})
+
+    def get_counters(self):
+        '''Returns the totals of the counters over every process.'''
+        totals = {}  # (name, pid) -> the last value, which is the total
+        for event in self.read_events():
+            if event['ph'] == 'C':
+                key = (event['name'], event['pid'])
+                totals[key] = max(totals.get(key, 0),
+                                  event['args'][event['name']])
+        counters = {}
+        for (name, pid), value in totals.items():
+            counters[name] = counters.get(name, 0) + value
+        return counters
+
+    def _write(self, event):
+        # A single write to a file opened with O_APPEND, so events from
+        # different processes are never interleaved
+        os.write(self._fd, (json.dumps(event) + '\n').encode('utf-8'))
+
+    def read_events(self):
+        if not self.enabled or not exists(self.events_filename):
+            return []
+        with open(self.events_filename) as fileh:
+            return [json.loads(line) for line in fileh if line.strip()]
+
+    def finish(self):
+        '''Writes the trace file. This does nothing in worker processes.'''
+        if not self.enabled or getpid() != self._pid:
+            return
+        events = self.read_events()
+        with open(self.filename, 'w') as fileh:
+            json.dump({'traceEvents': events,
+                       'displayTimeUnit': 'ms'}, fileh)
+        os.close(self._fd)
+        os.unlink(self.events_filename)
+        self.filename = None
+
+    def summary_lines(self):
+        '''Returns the lines of a table of the time spent in each phase
+        of every recipe build, and the number of commands each ran.'''
+        rows = {}  # (recipe, arch) -> {phase: seconds}
+        for event in self.read_events():
+            recipe = event['args'].get('recipe')
+            if recipe is None:
+                continue
+            row = rows.setdefault(
+                (recipe, event['args'].get('arch', '-')), {'commands': 0})
+            if event['cat'] == 'recipe':
+                row[event['name']] = (row.get(event['name'], 0) +
+                                      event['dur'] / 1e6)
+            elif event['cat'] == 'command':
+                row['commands'] += 1
+
+        for row in rows.values():
+            row['total'] = sum([row.get(phase, 0) for phase in RECIPE_PHASES])
+
+        columns = RECIPE_PHASES + ('total', )
+        lines = ['{:<24} {:<12}'.format('recipe', 'arch') +
+                 ''.join(['{:>10}'.format(column) for column in columns]) +
+                 '{:>10}'.format('commands')]
+        for (recipe, arch), row in sorted(
+                rows.items(), key=lambda item: -item[1]['total']):
+            lines.append(
+                '{:<24} {:<12}'.format(recipe, arch) +
+                ''.join(['{:>10.1f}'.format(row.get(column, 0))
+                         for column in columns]) +
+                '{:>10}'.format(row['commands']))
+        for name, value in sorted(self.get_counters().items()):
+            lines.append('{:<37}{:>10}'.format(name, value))
+        return lines
+
+
+tracer = Tracer()
@@ -1,15 +1,22 @@
 import contextlib
-from os.path import exists
-from os import getcwd, chdir, makedirs
+from os.path import exists, getsize
+from os import getcwd, chdir, makedirs, rename, unlink
+import fcntl
+import hashlib
 import io
 import json
+import re
 import shutil
 import sys
+import threading
 from tempfile import mkdtemp
+from appdirs import user_data_dir
 try:
     from urllib.request import FancyURLopener
+    from http.client import HTTPException
 except ImportError:
     from urllib import FancyURLopener
+    from httplib import HTTPException
 
 from pythonforandroid.logger import (logger, Err_Fore)
 
@@ -21,7 +28,409 @@ class ChromeDownloader(FancyURLopener):
         'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
         '(KHTML, like Gecko) Chrome/28.0.1500.71 Safari/537.36')
 
-urlretrieve = ChromeDownloader().retrieve
+
+class DownloadError(IOError):
+    pass
+
+
+class RangeError(DownloadError):
+    '''Raised when a server doesn't answer a Range request with the
+    requested part of the file being downloaded.'''
+
+
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+class RangeDownload(object):
+    '''Downloads a url to a file, via a .part file that is only renamed
+    to the file once the download is complete.
+
+    If the server supports HTTP Range requests, a download that is
+    interrupted (in this run or an earlier one) is resumed from the end
+    of the .part file rather than restarted, and large files may be
+    fetched in several segments at once, over separate connections.
+    The progress of a segmented download is kept next to the .part
+    file, so that it can be resumed too.
+
+    The size, ETag and Last-Modified date of the file are kept next to
+    the .part file as well, and resumed requests are sent with an
+    If-Range header, so that a file which changed on the server since
+    the .part file was written is downloaded again rather than spliced
+    onto the old data. A .part file left by an earlier run is only
+    resumed if the server sent an ETag or Last-Modified date for it.
+    '''
+
+    blocksize = 1024 * 64
+    retries = 5  # attempts to resume after each dropped connection
+    min_segment_size = 4 * 1024 * 1024
+    save_interval = 1024 * 1024  # bytes between saves of segment progress
+
+    def __init__(self, url, filename, reporthook=None, digests=(),
+                 segments=1):
+        self.url = url
+        self.filename = filename
+        self.part_filename = filename + '.part'
+        self.segments_filename = filename + '.part.segments'
+        self.validator_filename = filename + '.part.validator'
+        self.reporthook = reporthook
+        self.digests = digests
+        self.segments = segments
+        self.lock = threading.Lock()
+        self.aborted = threading.Event()
+
+    def open(self, start=0, end=None, validator=None):
+        '''Opens the url, requesting the bytes from start to end
+        (inclusive, or to the end of the file if end is None) of the
+        file identified by validator.'''
+        # A new opener is used for every request, as openers keep some
+        # state and downloads may run in several threads at once
+        opener = ChromeDownloader()
+        if start or end is not None:
+            opener.addheader('Range', 'bytes={}-{}'.format(
+                start, '' if end is None else end))
+            if_range = self.get_if_range(validator)
+            if if_range is not None:
+                opener.addheader('If-Range', if_range)
+        response = opener.open(self.url)
+        code = getattr(response, 'code', None)
+        if code is not None and code >= 400:
+            response.close()
+            raise DownloadError(
+                'Download of {} failed with HTTP status {}'.format(
+                    self.url, code))
+        return response
+
+    @staticmethod
+    def get_size(response):
+        '''Returns the full size of the file being downloaded, or -1 if
+        it is unknown.'''
+        content_range = response.info().get('Content-Range')
+        if content_range is not None:
+            total = content_range.split('/')[-1].strip()
+            return int(total) if total.isdigit() else -1
+        length = response.info().get('Content-Length')
+        return int(length) if length is not None else -1
+
+    def get_validator(self, response, size):
+        '''Returns what identifies the version of the file that response
+        is a part of.'''
+        info = response.info()
+        return {'url': self.url, 'size': size, 'etag': info.get('ETag'),
+                'last_modified': info.get('Last-Modified')}
+
+    @staticmethod
+    def get_if_range(validator):
+        '''Returns the If-Range header for the file identified by
+        validator: its ETag if it is a strong one, or else its
+        Last-Modified date. None if the server sent neither.'''
+        if validator is None:
+            return None
+        etag = validator.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return validator.get('last_modified')
+
+    def is_range_of(self, response, validator, start, end=None):
+        '''Returns whether response is the part from start to end of the
+        file identified by validator: a 206 with that Content-Range, for
+        a file of the same size and, if the server sent them, the same
+        ETag and Last-Modified date.'''
+        if getattr(response, 'code', None) != 206:
+            return False
+        match = CONTENT_RANGE_PATTERN.match(
+            response.info().get('Content-Range', '').strip())
+        if match is None or int(match.group(1)) != start or \
+           (end is not None and int(match.group(2)) != end) or \
+           match.group(3) != str(validator['size']):
+            return False
+        current = self.get_validator(response, validator['size'])
+        for name in ('etag', 'last_modified'):
+            if current[name] is not None and validator[name] is not None \
+               and current[name] != validator[name]:
+                return False
+        return True
+
+    def load_validator(self):
+        '''Returns the validator saved by an earlier run for this url, or
+        None.'''
+        if not exists(self.validator_filename):
+            return None
+        try:
+            with open(self.validator_filename) as fileh:
+                validator = json.load(fileh)
+        except ValueError:
+            return None
+        if validator.get('url') != self.url:
+            return None
+        return validator
+
+    def save_validator(self, validator):
+        with open(self.validator_filename, 'w') as fileh:
+            json.dump(validator, fileh)
+
+    def remove_part(self):
+        '''Removes the .part file, and the progress of its download.'''
+        for filename in (self.part_filename, self.segments_filename,
+                         self.validator_filename):
+            if exists(filename):
+                unlink(filename)
+
+    def report(self, received, size):
+        if self.reporthook is not None:
+            self.reporthook(received, size)
+
+    def run(self):
+        '''Downloads the file, returning a dict of the hex digests of its
+        contents for each hashlib algorithm named in digests.'''
+        validator = self.load_validator()
+        if self.get_if_range(validator) is None or \
+           not exists(self.part_filename):
+            # The .part file can't be told apart from a part of another
+            # version of the file, so it isn't resumed
+            self.remove_part()
+            validator = None
+        if exists(self.segments_filename):
+            hashes = self.run_segmented(validator)
+        else:
+            hashes = self.run_single(validator)
+        rename(self.part_filename, self.filename)
+        self.remove_part()
+        return dict([(name, file_hash.hexdigest())
+                     for name, file_hash in hashes.items()])
+
+    def new_hashes(self):
+        return dict([(name, hashlib.new(name)) for name in self.digests])
+
+    def hash_file(self, hashes, end=None):
+        '''Updates hashes with the contents of the .part file, up to
+        end.'''
+        with open(self.part_filename, 'rb') as fileh:
+            remaining = end
+            while remaining is None or remaining > 0:
+                size = self.blocksize
+                if remaining is not None:
+                    size = min(size, remaining)
+                    remaining -= size
+                block = fileh.read(size)
+                if not block:
+                    break
+                for file_hash in hashes.values():
+                    file_hash.update(block)
+
+    def run_single(self, validator=None):
+        '''Downloads the file over a single connection, hashing the data
+        as it is written and resuming after dropped connections. The
+        .part file is resumed if there is one, of the file identified by
+        validator.'''
+        received = 0
+        if validator is not None and exists(self.part_filename):
+            received = getsize(self.part_filename)
+        failures = 0
+        segmented_response = None
+        while segmented_response is None:
+            try:
+                response = self.open(received, validator=validator)
+            except DownloadError:
+                if not received:
+                    raise
+                # e.g. 416 if the .part file is complete or bigger than the
+                # file now is, so the download is just restarted
+                self.remove_part()
+                received = 0
+                continue
+            try:
+                size = self.get_size(response)
+                if received and \
+                   not self.is_range_of(response, validator, received):
+                    # The server ignored the Range, or the file changed
+                    # since the .part file was written, so the download
+                    # restarts
+                    logger.info('Download of {} could not be resumed, '
+                                'restarting it'.format(self.url))
+                    self.remove_part()
+                    received = 0
+                    if getattr(response, 'code', None) != 200:
+                        # Not the whole file, which is requested again
+                        continue
+                if not received:
+                    validator = self.get_validator(response, size)
+                    self.save_validator(validator)
+                if (self.segments > 1 and not received and
+                        size >= 2 * self.min_segment_size and
+                        response.info().get('Accept-Ranges') == 'bytes'):
+                    segmented_response, response = response, None
+                    continue
+
+                hashes = self.new_hashes()
+                if received:
+                    self.hash_file(hashes, received)
+                with open(self.part_filename,
+                          'ab' if received else 'wb') as fileh:
+                    self.report(received, size)
+                    while True:
+                        block = response.read(self.blocksize)
+                        if not block:
+                            break
+                        fileh.write(block)
+                        for file_hash in hashes.values():
+                            file_hash.update(block)
+                        received += len(block)
+                        self.report(received, size)
+                if size >= 0 and received < size:
+                    raise DownloadError(
+                        'Download of {} was incomplete: got only {} out of '
+                        '{} bytes'.format(self.url, received, size))
+                return hashes
+            except (IOError, OSError, HTTPException) as e:
+                failures += 1
+                if failures > self.retries:
+                    raise
+                logger.info('Download of {} interrupted ({}), resuming from '
+                            'byte {}'.format(self.url, e, received))
+            finally:
+                if response is not None:
+                    response.close()
+        # Outside of the retries above, as the segments are resumed from
+        # their own progress
+        return self.run_segmented(validator, segmented_response)
+
+    def run_segmented(self, validator, response=None):
+        '''Downloads the file identified by validator in several segments
+        at once. The response of the first request is used for the first
+        segment, or if there is none, the segmented download recorded
+        next to the .part file is resumed. If the server doesn't answer
+        the requests for the segments with them, the file is downloaded
+        again over a single connection.'''
+        size = validator['size']
+        if response is None:
+            try:
+                with open(self.segments_filename) as fileh:
+                    state = json.load(fileh)
+            except ValueError:
+                state = {}
+            if state.get('url') != self.url or state.get('size') != size:
+                self.remove_part()
+                return self.run_single()
+            segments = state['segments']
+        else:
+            segment_size = size // self.segments
+            segments = [[index * segment_size,
+                         (index + 1) * segment_size - 1, 0]
+                        for index in range(self.segments)]
+            segments[-1][1] = size - 1
+            with open(self.part_filename, 'wb') as fileh:
+                fileh.truncate(size)
+            self.save_segments(size, segments)
+
+        responses = [response] + [None] * (len(segments) - 1)
+        errors = []
+        self.aborted.clear()
+
+        def fetch(index):
+            try:
+                self.fetch_segment(validator, segments, index,
+                                   responses[index])
+            except RangeError as e:
+                # The other segments are stopped, as the file is
+                # downloaded again
+                self.aborted.set()
+                errors.append(e)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=fetch, args=(index, ))
+                   for index in range(len(segments))
+                   if segments[index][2] <= segments[index][1] -
+                   segments[index][0]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.aborted.is_set():
+            logger.info('Segmented download of {} failed ({}), downloading '
+                        'it again over a single connection'.format(
+                            self.url, [error for error in errors
+                                       if isinstance(error, RangeError)][0]))
+            self.remove_part()
+            self.segments = 1
+            return self.run_single()
+        self.save_segments(size, segments)
+        if errors:
+            raise errors[0]
+
+        # The segments arrive out of order, so they are hashed once the
+        # whole file is there
+        hashes = self.new_hashes()
+        self.hash_file(hashes)
+        return hashes
+
+    def fetch_segment(self, validator, segments, index, response):
+        size = validator['size']
+        segment = segments[index]
+        failures = 0
+        with open(self.part_filename, 'r+b') as fileh:
+            while segment[2] < segment[1] - segment[0] + 1 and \
+                    not self.aborted.is_set():
+                try:
+                    if response is None:
+                        start = segment[0] + segment[2]
+                        response = self.open(start, segment[1], validator)
+                        if not self.is_range_of(response, validator, start,
+                                                segment[1]):
+                            raise RangeError(
+                                'Request of bytes {}-{} of {} was answered '
+                                'with HTTP status {} ({})'.format(
+                                    start, segment[1], self.url,
+                                    getattr(response, 'code', None),
+                                    response.info().get('Content-Range')))
+                    fileh.seek(segment[0] + segment[2])
+                    while segment[2] < segment[1] - segment[0] + 1 and \
+                            not self.aborted.is_set():
+                        block = response.read(min(
+                            self.blocksize,
+                            segment[1] - segment[0] + 1 - segment[2]))
+                        if not block:
+                            raise DownloadError(
+                                'Connection closed during download of '
+                                '{}'.format(self.url))
+                        fileh.write(block)
+                        with self.lock:
+                            segment[2] += len(block)
+                            self.report(sum([seg[2] for seg in segments]),
+                                        size)
+                            # The progress is saved every so often, so
+                            # that little is lost if p4a is interrupted
+                            if segment[2] % self.save_interval < len(block):
+                                fileh.flush()
+                                self.save_segments(size, segments)
+                except RangeError:
+                    raise
+                except (IOError, OSError, HTTPException) as e:
+                    failures += 1
+                    if failures > self.retries:
+                        raise
+                    logger.info('Download of {} interrupted ({}), resuming '
+                                'segment {}'.format(self.url, e, index))
+                finally:
+                    if response is not None:
+                        response.close()
+                        response = None
+                    fileh.flush()
+                    with self.lock:
+                        self.save_segments(size, segments)
+
+    def save_segments(self, size, segments):
+        with open(self.segments_filename, 'w') as fileh:
+            json.dump({'url': self.url, 'size': size,
+                       'segments': segments}, fileh)
+
+
+def urlretrieve(url, filename, reporthook=None, digests=(), segments=1):
+    '''Downloads url to filename, see :class:`RangeDownload`, calling
+    reporthook(received, size) as the download progresses. Returns a
+    dict of the hex digests of the file for each hashlib algorithm
+    named in digests.'''
+    return RangeDownload(url, filename, reporthook, digests, segments).run()
 
 
 @contextlib.contextmanager
@@ -49,6 +458,20 @@ def temp_directory():
                               temp_dir, Err_Fore.RESET)))
 
 
+@contextlib.contextmanager
+def file_lock(filename):
+    '''Holds an exclusive lock on the given file, which is created if
+    necessary, for the duration of the context. This works across
+    processes, so can be used to protect dirs shared by parallel
+    build jobs.'''
+    with open(filename, 'a') as fileh:
+        fcntl.flock(fileh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fileh, fcntl.LOCK_UN)
+
+
 def ensure_dir(filename):
     if not exists(filename):
         makedirs(filename)
@@ -106,6 +529,12 @@ class JsonStore(object):
                 fd.write(unicode(json.dumps(self.data, ensure_ascii=False)))
 
 
+def get_storage_dir():
+    '''The root dir where builds, dists and caches are stored.'''
+    # AND: TODO: Allow the user to set the build_dir
+    return user_data_dir('python-for-android')
+
+
 def which(program, path_env):
     '''Locate an executable in the system.'''
     import os
@@ -37,7 +37,7 @@ recursively_include(package_data, 'pythonforandroid/bootstraps',
 recursively_include(package_data, 'pythonforandroid/bootstraps',
                     ['sdl-config', ])
 recursively_include(package_data, 'pythonforandroid',
-                    ['liblink', 'biglink'])
+                    ['liblink', 'liblink.sh', 'biglink', 'sitecustomize.py'])
 
 setup(name='python-for-android',
       version='0.3',